@@ -2,154 +2,179 @@
 (Full file content below)
 """
 
+# Con STARTUP_PROFILE=1 se mide el import de todo lo que sigue
+import startup_profile
+startup_profile.activar_si_configurado()
+
 import os
+import json
+import math
+import time
 import asyncio
 import random
-import re
 from datetime import datetime
-from io import BytesIO
-import requests
-from PIL import Image, ImageDraw, ImageFont
-from bs4 import BeautifulSoup
 
-from telegram import Update
-from telegram.ext import Application, CommandHandler, ContextTypes
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
+from telegram.request import HTTPXRequest
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from image_utils import crear_imagen_producto
+import http_client
+import http_server
+import metrics
+from caches import CACHE_DIR
+from catalog import Cambios, Catalog
+import catalog_sync
+from envios import enviar_tarjeta, enviar_album
+from file_id_cache import file_id_cache
+from prerender import prerender_pipeline
+from singleflight import SingleFlight
+from publisher import publisher, parsear_canales, PUBLICAR_CANALES
+from render_cache import clave_render, render_cache
+from render_executor import render_executor
+import webhook
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+# Servidor de la Bot API alternativo (servidor local de Telegram o tools/webhook_stub.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
 WEBSITE_URL = os.getenv("WEBSITE_URL", "https://www.nexushcr.com")
 CHANNEL_ID = os.getenv("CHANNEL_ID", "")
+# Productos por álbum en /productos (Telegram admite de 2 a 10 por álbum)
+PRODUCTOS_POR_PAGINA = min(10, max(2, int(os.getenv("PRODUCTOS_POR_PAGINA", "8"))))
+# Último catálogo bueno, para arrancar sin esperar al sitio
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", os.path.join(CACHE_DIR, "catalogo.json.gz"))
+# Resultados por página en /buscar y máximo de resultados por búsqueda
+RESULTADOS_POR_PAGINA = 5
+MAX_RESULTADOS_BUSQUEDA = int(os.getenv("MAX_RESULTADOS_BUSQUEDA", "50"))
+# Cada cuántos minutos se sincroniza el catálogo (0 = solo al arrancar y con
+# /actualizar). Con el GET condicional un catálogo sin cambios cuesta un 304.
+CATALOGO_REFRESCO_MIN = float(os.getenv("CATALOGO_REFRESCO_MIN", "10"))
+
+# Catálogo vigente. Se reemplaza entero (asignación atómica) en cada
+# actualización; los handlers toman la referencia una vez al empezar.
+catalogo = Catalog()
+
+_actualizaciones = metrics.histograma("catalogo_actualizacion_segundos",
+                                      "Descargas del catálogo desde el sitio", ("resultado",))
+_bot_api = metrics.histograma("telegram_api_segundos", "Llamadas a la Bot API", ("metodo", "resultado"))
+# Descargas simultáneas de productos.json comparten una sola petición
+_descargas_catalogo = SingleFlight("catalogo")
+metrics.calibre("catalogo_productos", "Productos en el catálogo vigente", lambda: len(catalogo))
+
 
-productos_cache = []
-ultima_actualizacion = None
+class RequestMedido(HTTPXRequest):
+    """HTTPXRequest que mide cada llamada a la Bot API (send_photo, etc.)."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        metodo = url.rsplit("/", 1)[-1]
+        t0 = time.perf_counter()
+        resultado = "error"
+        try:
+            status, cuerpo = await super().do_request(url, method, *args, **kwargs)
+            resultado = "ok" if status == 200 else str(status)
+            return status, cuerpo
+        finally:
+            segundos = time.perf_counter() - t0
+            _bot_api.observar(segundos, metodo=metodo, resultado=resultado)
+            metrics.registrar_lento("telegram", metodo, segundos)
 
 
 async def scrape_productos():
-    global productos_cache, ultima_actualizacion
+    """Sincroniza el catálogo con el sitio y, si cambió, publica el nuevo y sus
+    cambios (ver catalog_sync). Si ya hay una descarga en curso (carga inicial,
+    /actualizar, refresco periódico) se espera a esa en lugar de empezar otra.
+    Devuelve (resultado, cambios): resultado "ok", "no_modificado" o "error"."""
+    json_url = WEBSITE_URL + "/productos.json"
+    return await _descargas_catalogo.hacer(json_url, _scrape_medido, json_url)
+
+
+async def _scrape_medido(json_url):
+    t0 = time.perf_counter()
+    resultado, cambios = await _scrape_productos(json_url)
+    _actualizaciones.observar(time.perf_counter() - t0, resultado=resultado)
+    return resultado, cambios
+
+
+async def _scrape_productos(json_url):
+    global catalogo
     
     try:
         print("Cargando productos desde nexushcr.com/productos.json...")
         
-        json_url = WEBSITE_URL + "/productos.json"
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        response = requests.get(json_url, headers=headers, timeout=20)
-        response.raise_for_status()
+        anterior = catalogo
+        descarga = await catalog_sync.descargar_productos(json_url, anterior.validadores, WEBSITE_URL)
+        if descarga is None:
+            print("Catalogo sin cambios en el sitio (304)")
+            catalogo = anterior.revalidado()
+            catalog_sync.registrar("no_modificado")
+            return "no_modificado", Cambios(total_anterior=len(anterior))
         
-        print(f"JSON descargado ({len(response.text)} caracteres)")
+        productos_encontrados, validadores, tamano = descarga
+        print(f"JSON descargado ({tamano} bytes)")
         
-        data = response.json()
-        productos_json = data.get('productos', [])
-        
-        if not productos_json:
+        if not productos_encontrados:
             print("No se encontraron productos en el JSON")
-            return
-        
-        productos_encontrados = []
-        
-        for prod in productos_json:
-            imagen = prod.get('imagen', '')
-            
-            if imagen.startswith('/'):  
-                imagen_url = WEBSITE_URL + imagen
-            elif imagen.startswith('http'):
-                imagen_url = imagen
-            else:
-                imagen_url = WEBSITE_URL + '/' + imagen
-            
-            productos_encontrados.append({
-                'id': prod.get('id'),
-                'nombre': prod.get('nombre', '').strip(),
-                'precio': prod.get('precio', 0),
-                'imagen_url': imagen_url,
-                'categoria': prod.get('categoria', '').strip(),
-                'descripcion': prod.get('descripcion', '').strip()
-            })
+            catalog_sync.registrar("error")
+            return "error", None
         
-        productos_cache = productos_encontrados
-        ultima_actualizacion = datetime.now()
-        print(f"{len(productos_cache)} productos cargados correctamente")
-        
-        categorias = {} 
-        for p in productos_cache:
-            cat = p['categoria']
-            categorias[cat] = categorias.get(cat, 0) + 1
+        nuevo, cambios = await asyncio.to_thread(anterior.actualizar, productos_encontrados, validadores)
+        catalogo = nuevo
+        print(f"{len(catalogo)} productos cargados correctamente ({cambios.resumen()})")
+        if cambios or nuevo.validadores != anterior.validadores:
+            await asyncio.to_thread(catalogo.guardar_snapshot, CATALOG_SNAPSHOT)
+        await catalog_sync.publicar(cambios, catalogo)
         
         print("Productos por categoria:")
-        for cat, count in categorias.items():
+        for cat, count in catalogo.conteo_categorias.items():
             print(f"   {cat}: {count}")
-        
-        # Keep backward-compatible scraping attempts if needed
-        # (existing code had a regex path which may still be useful)
-        try:
-            # This is a no-op unless you have additional parsing to add
-            pass
-        except Exception:
-            pass
+        return "ok", cambios
         
     except Exception as e:
         print(f"Error en scraping: {e}")
         import traceback
         traceback.print_exc()
+        catalog_sync.registrar("error")
+        return "error", None
 
 
-async def publicar_producto_aleatorio(context: ContextTypes.DEFAULT_TYPE):
-    if not productos_cache:
-        print("No hay productos para publicar, intentando actualizar...")
-        await scrape_productos()
-        if not productos_cache:
-            print("No se pudieron cargar productos")
-            return
-    
-    producto = random.choice(productos_cache)
-    print(f"Preparando publicacion: {producto['nombre']}")
-    
-    try:
-        img = crear_imagen_producto(producto)
-        bio = BytesIO()
-        bio.name = f"producto_{producto['id']}.png"
-        img.save(bio, "PNG", quality=95, optimize=True)
-        bio.seek(0)
-        
-        mensaje = f"OFERTA DESTACADA\n\n"
-        mensaje += f"{producto['nombre']}\n\n"
-        
-        if producto['descripcion']:
-            desc_corta = producto['descripcion'][:80] + "..." if len(producto['descripcion']) > 80 else producto['descripcion']
-            mensaje += f"{desc_corta}\n\n"
-        
-        mensaje += f"Precio: C{producto['precio']:,}\n"
-        mensaje += f"Categoria: {producto['categoria'].title()}\n\n"
-        mensaje += f"Visita: {WEBSITE_URL}\n"
-        mensaje += f"Contactanos para mas informacion"
-        
-        if CHANNEL_ID:
-            await context.bot.send_photo(
-                chat_id=CHANNEL_ID,
-                photo=bio,
-                caption=mensaje
-            )
-            print(f"Publicado exitosamente: {producto['nombre']}")
-        else:
-            print("No hay CHANNEL_ID configurado")
-            
-    except Exception as e:
-        print(f"Error al publicar: {e}")
-        import traceback
-        traceback.print_exc()
+async def invalidar_caches(cambios, cat):
+    """Suscriptor del feed de cambios: borra los renders y file_ids de los
+    productos cuya tarjeta cambió o que ya no están en el catálogo. Los hashes
+    y el borrado en disco se hacen en un hilo."""
+    await asyncio.to_thread(_invalidar_caches, cambios)
+
+
+def _invalidar_caches(cambios):
+    obsoletos = [prod for prod in cambios.eliminados]
+    obsoletos += [anterior for anterior, nuevo in cambios.actualizados
+                  if clave_render(anterior) != clave_render(nuevo)]
+    for prod in obsoletos:
+        render_cache.descartar(clave_render(prod))
+    file_id_cache.invalidar_productos([prod.id for prod in obsoletos])
+
+
+def caption_canal(producto):
+    mensaje = f"OFERTA DESTACADA\n\n"
+    mensaje += f"{producto['nombre']}\n\n"
+    
+    if producto['descripcion']:
+        desc_corta = producto['descripcion'][:80] + "..." if len(producto['descripcion']) > 80 else producto['descripcion']
+        mensaje += f"{desc_corta}\n\n"
+    
+    mensaje += f"Precio: C{producto['precio']:,}\n"
+    mensaje += f"Categoria: {producto['categoria'].title()}\n\n"
+    mensaje += f"Visita: {WEBSITE_URL}\n"
+    mensaje += f"Contactanos para mas informacion"
+    return mensaje
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     mensaje = (
         "Bienvenido al Bot de NexusHCR\n\n"
         "Comandos disponibles:\n"
-        "/productos - Ver catalogo completo\n"
+        "/productos - Ver catalogo completo (por paginas)\n"
         "/aleatorio - Producto sorpresa\n"
+        "/buscar <texto> - Buscar productos\n"
         "/categorias - Ver por categoria\n"
         "/actualizar - Actualizar catalogo\n"
         "/estado - Estado del sistema\n\n"
@@ -158,65 +183,204 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(mensaje)
 
 
+def _caption_catalogo(prod):
+    return (
+        f"{prod['nombre']}\n"
+        f"C{prod['precio']:,}\n"
+        f"{prod['categoria'].title()}"
+    )
+
+
+def _teclado_paginas(pagina, total_paginas):
+    botones = []
+    if pagina > 0:
+        botones.append(InlineKeyboardButton("« Anterior", callback_data=f"productos:{pagina - 1}"))
+    if pagina < total_paginas - 1:
+        botones.append(InlineKeyboardButton("Siguiente »", callback_data=f"productos:{pagina + 1}"))
+    return InlineKeyboardMarkup([botones]) if botones else None
+
+
+async def enviar_pagina_productos(context: ContextTypes.DEFAULT_TYPE, chat_id, pagina):
+    cat = catalogo
+    total_paginas = max(1, math.ceil(len(cat) / PRODUCTOS_POR_PAGINA))
+    pagina = min(max(pagina, 0), total_paginas - 1)
+    inicio = pagina * PRODUCTOS_POR_PAGINA
+    productos_pagina = cat[inicio:inicio + PRODUCTOS_POR_PAGINA]
+    
+    try:
+        await enviar_album(
+            context.bot,
+            chat_id,
+            productos_pagina,
+            [_caption_catalogo(p) for p in productos_pagina],
+        )
+    except Exception as e:
+        print(f"Error enviando pagina {pagina + 1}: {e}")
+        await context.bot.send_message(chat_id=chat_id, text="Error al enviar los productos, intenta de nuevo")
+        return
+    
+    # Pre-renderizar la siguiente página en segundo plano mientras el usuario
+    # mira esta (después de enviarla, para no competir con su render)
+    siguiente = cat[inicio + PRODUCTOS_POR_PAGINA:inicio + 2 * PRODUCTOS_POR_PAGINA]
+    if siguiente:
+        context.application.create_task(render_executor.prerender(siguiente))
+    
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=(
+            f"Pagina {pagina + 1} de {total_paginas} "
+            f"({inicio + 1}-{inicio + len(productos_pagina)} de {len(cat)} productos)"
+        ),
+        reply_markup=_teclado_paginas(pagina, total_paginas)
+    )
+
+
 async def ver_productos(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not productos_cache:
+    if not catalogo:
         await update.message.reply_text("Cargando productos por primera vez...")
         await scrape_productos()
     
-    if not productos_cache:
+    if not catalogo:
         await update.message.reply_text("No se pudieron cargar los productos. Intenta /actualizar")
         return
     
-    productos_mostrar = productos_cache[:8]
+    await enviar_pagina_productos(context, update.effective_chat.id, 0)
+
+
+async def navegar_productos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    if not catalogo:
+        await query.message.reply_text("No hay productos disponibles. Intenta /actualizar")
+        return
+    
+    pagina = int(query.data.split(":", 1)[1])
+    # Quitar los botones del mensaje anterior para no navegar dos veces desde él
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    await enviar_pagina_productos(context, query.message.chat_id, pagina)
+
+
+def _texto_resultados(consulta, productos, pagina, total_paginas):
+    inicio = pagina * RESULTADOS_POR_PAGINA
+    texto = f"Resultados para \"{consulta}\" ({len(productos)})\n\n"
+    for n, p in enumerate(productos[inicio:inicio + RESULTADOS_POR_PAGINA], start=inicio + 1):
+        texto += f"{n}. {p['nombre']} - C{p['precio']:,}\n   {p['categoria'].title()}\n"
+    if total_paginas > 1:
+        texto += f"\nPagina {pagina + 1} de {total_paginas}"
+    return texto
+
+
+def _teclado_resultados(pagina, total_paginas, total):
+    inicio = pagina * RESULTADOS_POR_PAGINA
+    fin = min(inicio + RESULTADOS_POR_PAGINA, total)
+    # Un botón por resultado para ver su tarjeta
+    filas = [[
+        InlineKeyboardButton(f"Ver {n + 1}", callback_data=f"buscar:ver:{n}")
+        for n in range(inicio, fin)
+    ]]
+    navegacion = []
+    if pagina > 0:
+        navegacion.append(InlineKeyboardButton("« Anterior", callback_data=f"buscar:{pagina - 1}"))
+    if pagina < total_paginas - 1:
+        navegacion.append(InlineKeyboardButton("Siguiente »", callback_data=f"buscar:{pagina + 1}"))
+    if navegacion:
+        filas.append(navegacion)
+    return InlineKeyboardMarkup(filas)
+
+
+def _resultados_guardados(context, cat):
+    """Productos de la última búsqueda del usuario que siguen en el catálogo."""
+    busqueda = context.user_data.get("busqueda")
+    if not busqueda:
+        return None, []
+    productos = [p for p in (cat.get(i) for i in busqueda["ids"]) if p is not None]
+    return busqueda["consulta"], productos
+
+
+async def buscar_productos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    consulta = " ".join(context.args).strip()
+    if not consulta:
+        await update.message.reply_text("Uso: /buscar <texto>\nEjemplo: /buscar bufanda roja")
+        return
+    
+    if not catalogo:
+        await update.message.reply_text("Cargando productos...")
+        await scrape_productos()
+    
+    cat = catalogo
+    if not cat:
+        await update.message.reply_text("No hay productos disponibles")
+        return
+    
+    resultados = cat.buscar(consulta, MAX_RESULTADOS_BUSQUEDA)
+    if not resultados:
+        await update.message.reply_text(f"No se encontraron productos para \"{consulta}\"")
+        return
     
+    # Se guardan los ids (no los objetos) para paginar sobre el catálogo vigente
+    context.user_data["busqueda"] = {"consulta": consulta, "ids": [p['id'] for p in resultados]}
+    total_paginas = math.ceil(len(resultados) / RESULTADOS_POR_PAGINA)
     await update.message.reply_text(
-        f"Mostrando {len(productos_mostrar)} de {len(productos_cache)} productos disponibles..."
+        _texto_resultados(consulta, resultados, 0, total_paginas),
+        reply_markup=_teclado_resultados(0, total_paginas, len(resultados))
     )
+
+
+async def navegar_busqueda(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    consulta, resultados = _resultados_guardados(context, catalogo)
+    if not resultados:
+        await query.message.reply_text("La busqueda expiro. Usa /buscar <texto> de nuevo")
+        return
     
-    for prod in productos_mostrar:
+    partes = query.data.split(":")
+    if partes[1] == "ver":
+        n = int(partes[2])
+        if n >= len(resultados):
+            return
+        prod = resultados[n]
+        caption = (
+            f"{prod['nombre']}\n\n"
+            f"{prod['descripcion']}\n\n"
+            f"Precio: C{prod['precio']:,}\n"
+            f"Categoria: {prod['categoria'].title()}"
+        )
         try:
-            img = crear_imagen_producto(prod)
-            bio = BytesIO()
-            bio.name = f"producto_{prod['id']}.png"
-            img.save(bio, "PNG", quality=85)
-            bio.seek(0)
-            
-            caption = (
-                f"{prod['nombre']}\n"
-                f"C{prod['precio']:,}\n"
-                f"{prod['categoria'].title()}"
-            )
-            
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=bio,
-                caption=caption
-            )
-            
-            await asyncio.sleep(1)
-            
+            await enviar_tarjeta(context.bot, query.message.chat_id, prod, caption)
         except Exception as e:
-            print(f"Error enviando producto {prod['id']}: {e}")
+            print(f"Error: {e}")
+            await query.message.reply_text("Error al generar la imagen")
+        return
+    
+    total_paginas = math.ceil(len(resultados) / RESULTADOS_POR_PAGINA)
+    pagina = min(int(partes[1]), total_paginas - 1)
+    try:
+        await query.edit_message_text(
+            _texto_resultados(consulta, resultados, pagina, total_paginas),
+            reply_markup=_teclado_resultados(pagina, total_paginas, len(resultados))
+        )
+    except Exception:
+        pass
 
 
 async def producto_aleatorio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not productos_cache:
+    if not catalogo:
         await update.message.reply_text("Cargando productos...")
         await scrape_productos()
     
-    if not productos_cache:
+    if not catalogo:
         await update.message.reply_text("No hay productos disponibles")
         return
     
-    prod = random.choice(productos_cache)
+    prod = random.choice(catalogo.productos)
     
     try:
-        img = crear_imagen_producto(prod)
-        bio = BytesIO()
-        bio.name = f"producto_{prod['id']}.png"
-        img.save(bio, "PNG", quality=90)
-        bio.seek(0)
-        
         caption = (
             f"Producto Aleatorio\n\n"
             f"{prod['nombre']}\n\n"
@@ -225,40 +389,30 @@ async def producto_aleatorio(update: Update, context: ContextTypes.DEFAULT_TYPE)
             f"Categoria: {prod['categoria'].title()}"
         )
         
-        await context.bot.send_photo(
-            chat_id=update.effective_chat.id,
-            photo=bio,
-            caption=caption
-        )
+        await enviar_tarjeta(context.bot, update.effective_chat.id, prod, caption)
     except Exception as e:
         print(f"Error: {e}")
         await update.message.reply_text("Error al generar la imagen")
 
 
 async def ver_categorias(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not productos_cache:
+    if not catalogo:
         await update.message.reply_text("Cargando productos...")
         await scrape_productos()
     
-    if not productos_cache:
+    cat = catalogo
+    if not cat:
         await update.message.reply_text("No hay productos disponibles")
         return
     
-    categorias = {}
-    for prod in productos_cache:
-        cat = prod['categoria']
-        if cat not in categorias:
-            categorias[cat] = []
-        categorias[cat].append(prod)
-    
     mensaje = "Productos por Categoria\n\n"
     
-    for cat, prods in categorias.items():
-        mensaje += f"{cat.upper()} ({len(prods)} productos)\n"
-        for p in prods[:3]:
+    for categoria, total in cat.conteo_categorias.items():
+        mensaje += f"{categoria.upper()} ({total} productos)\n"
+        for p in cat.destacados(categoria, 3):
             mensaje += f"  {p['nombre']} - C{p['precio']:,}\n"
-        if len(prods) > 3:
-            mensaje += f"  ... y {len(prods) - 3} mas\n"
+        if total > 3:
+            mensaje += f"  ... y {total - 3} mas\n"
         mensaje += "\n"
     
     await update.message.reply_text(mensaje)
@@ -268,19 +422,23 @@ async def actualizar_catalogo(update: Update, context: ContextTypes.DEFAULT_TYPE
     await update.message.reply_text("Actualizando catalogo desde nexushcr.com...")
     
     try:
-        await scrape_productos()
+        resultado, cambios = await scrape_productos()
         
-        if productos_cache:
-            categorias = {}
-            for p in productos_cache:
-                cat = p['categoria']
-                categorias[cat] = categorias.get(cat, 0) + 1
-            
+        cat = catalogo
+        if resultado == "no_modificado" and cat:
+            await update.message.reply_text(f"El catalogo no cambio desde la ultima actualizacion ({len(cat)} productos)")
+        elif resultado == "ok" and cat:
             resumen = "Catalogo actualizado exitosamente\n\n"
-            resumen += f"Total de productos: {len(productos_cache)}\n\n"
-            resumen += "Por categoria:\n"
-            for cat, count in categorias.items():
-                resumen += f"{cat.title()}: {count}\n"
+            resumen += f"Total de productos: {len(cat)}\n"
+            resumen += f"Cambios: {cambios.resumen()}\n"
+            for prod in cambios.agregados[:5]:
+                resumen += f"  Nuevo: {prod.nombre}\n"
+            for anterior, prod in cambios.actualizados[:5]:
+                if anterior.precio != prod.precio:
+                    resumen += f"  Precio: {prod.nombre} C{anterior.precio:,} -> C{prod.precio:,}\n"
+            resumen += "\nPor categoria:\n"
+            for categoria, count in cat.conteo_categorias.items():
+                resumen += f"{categoria.title()}: {count}\n"
             
             await update.message.reply_text(resumen)
         else:
@@ -290,9 +448,10 @@ async def actualizar_catalogo(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 
 async def estado_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    cat = catalogo
     tiempo_desde_actualizacion = "Nunca"
-    if ultima_actualizacion:
-        delta = datetime.now() - ultima_actualizacion
+    if cat.actualizado:
+        delta = datetime.now() - cat.actualizado
         minutos = int(delta.total_seconds() / 60)
         if minutos < 60:
             tiempo_desde_actualizacion = f"Hace {minutos} minutos"
@@ -300,67 +459,116 @@ async def estado_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
             horas = minutos // 60
             tiempo_desde_actualizacion = f"Hace {horas} horas"
     
-    categorias_count = {}
-    for p in productos_cache:
-        cat = p['categoria']
-        categorias_count[cat] = categorias_count.get(cat, 0) + 1
-    
     mensaje = (
         "Estado del Sistema NexusHCR\n\n"
-        f"Productos cargados: {len(productos_cache)}\n"
+        f"Productos cargados: {len(cat)}\n"
         f"Ultima actualizacion: {tiempo_desde_actualizacion}\n"
+        f"Sincronizacion: {catalog_sync.estado()}\n"
         f"Sitio web: {WEBSITE_URL}\n"
-        f"Publicaciones automaticas: {'Activas' if CHANNEL_ID else 'No configuradas'}\n\n"
+        f"Publicaciones automaticas: {'Activas' if CHANNEL_ID or PUBLICAR_CANALES else 'No configuradas'}\n"
+        f"Cola de publicaciones: {publisher.resumen()}\n"
+        f"Pre-render: {prerender_pipeline.progreso()}\n\n"
     )
     
-    if categorias_count:
+    if cat.conteo_categorias:
         mensaje += "Productos por categoria:\n"
-        for cat, count in categorias_count.items():
-            mensaje += f"{cat.title()}: {count}\n"
+        for categoria, count in cat.conteo_categorias.items():
+            mensaje += f"{categoria.title()}: {count}\n"
     
     await update.message.reply_text(mensaje)
 
 
-async def post_init(application: Application):
-    print("Iniciando Bot de NexusHCR...")
+async def carga_inicial():
+    """Scraping inicial con reintentos, sin bloquear el arranque del bot."""
     print("Realizando scraping inicial...")
-    
-    await asyncio.sleep(2)
-    
     intentos = 3
     for i in range(intentos):
-        await scrape_productos()
-        if productos_cache:
-            break
+        resultado, _ = await scrape_productos()
+        if catalogo and resultado != "error":
+            return
         if i < intentos - 1:
             print(f"Intento {i+1} fallo, reintentando en 5 segundos...")
             await asyncio.sleep(5)
     
-    if not productos_cache:
+    if catalogo:
+        print("No se pudo actualizar el catalogo en el inicio, se usa el snapshot")
+    else:
         print("No se pudieron cargar productos en el inicio")
+
+
+async def calentar_render(application: Application):
+    """Carga el render (workers, fuentes, atlas, rembg) cuando el bot ya está
+    recibiendo mensajes, para no retrasar el arranque."""
+    while not application.running or (application.updater and not application.updater.running):
+        await asyncio.sleep(0.1)
+    with startup_profile.etapa("calentamiento render"):
+        futuros = render_executor.warm_up()
+        await asyncio.gather(*(asyncio.wrap_future(f) for f in futuros), return_exceptions=True)
+    if startup_profile.STARTUP_PROFILE:
+        print(startup_profile.reporte())
+
+
+async def post_init(application: Application):
+    global catalogo
+    print("Iniciando Bot de NexusHCR...")
     
-    scheduler = AsyncIOScheduler()
-    
-    hora_aleatoria = random.randint(9, 21)
-    minuto_aleatorio = random.randint(0, 59)
-    
-    scheduler.add_job(
-        publicar_producto_aleatorio,
-        'cron',
-        hour=hora_aleatoria,
-        minute=minuto_aleatorio,
-        args=[application]
-    )
+    # Arrancar con el último catálogo guardado; el del sitio llega en segundo plano
+    with startup_profile.etapa("snapshot catalogo"):
+        snapshot = Catalog.cargar_snapshot(CATALOG_SNAPSHOT)
+    if snapshot:
+        catalogo = snapshot
+        print(f"{len(catalogo)} productos cargados desde el snapshot ({catalogo.actualizado})")
+        prerender_pipeline.iniciar(catalogo)
+    else:
+        print("No hay snapshot de catalogo, se espera al scraping inicial")
+    application.create_task(carga_inicial())
+    application.create_task(calentar_render(application))
+    await http_server.iniciar()
     
-    print(f"Publicacion automatica programada para las {hora_aleatoria:02d}:{minuto_aleatorio:02d} diariamente")
+    scheduler = AsyncIOScheduler()
     
-    if CHANNEL_ID:
-        print(f"Canal configurado: {CHANNEL_ID}")
+    if PUBLICAR_CANALES:
+        canales = parsear_canales(PUBLICAR_CANALES)
+    elif CHANNEL_ID:
+        canales = {CHANNEL_ID: [(random.randint(9, 21), random.randint(0, 59))]}
     else:
+        canales = {}
+    publisher.iniciar(application.bot, scheduler, canales, lambda: catalogo, caption_canal)
+    
+    if CATALOGO_REFRESCO_MIN > 0:
+        scheduler.add_job(scrape_productos, 'interval', minutes=CATALOGO_REFRESCO_MIN,
+                          max_instances=1, coalesce=True)
+        print(f"Sincronizacion del catalogo cada {CATALOGO_REFRESCO_MIN:g} minutos")
+    
+    for canal, horarios in canales.items():
+        horas = ", ".join(f"{h:02d}:{m:02d}" for h, m in horarios)
+        print(f"Publicacion automatica en {canal} a las {horas} diariamente")
+    if not canales:
         print("CHANNEL_ID no configurado")
     
     scheduler.start()
     print("Sistema completamente inicializado")
+    if startup_profile.STARTUP_PROFILE:
+        print(startup_profile.reporte())
+
+
+async def salud(peticion):
+    cuerpo = {
+        "estado": "ok",
+        "modo": "webhook" if webhook.activo() else "polling",
+        "productos": len(catalogo),
+        "actualizado": catalogo.actualizado.isoformat() if catalogo.actualizado else None,
+    }
+    return 200, "application/json", json.dumps(cuerpo).encode("utf-8")
+
+
+async def post_shutdown(application: Application):
+    await publisher.detener()
+    await prerender_pipeline.detener()
+    await http_server.detener()
+    render_executor.shutdown()
+    await asyncio.to_thread(file_id_cache.guardar)
+    await http_client.cerrar()
 
 
 def main():
@@ -370,21 +578,47 @@ def main():
     
     print("BOT NEXUSHCR - Sistema de Publicaciones")
     
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
-    
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("productos", ver_productos))
-    app.add_handler(CommandHandler("aleatorio", producto_aleatorio))
-    app.add_handler(CommandHandler("categorias", ver_categorias))
-    app.add_handler(CommandHandler("actualizar", actualizar_catalogo))
-    app.add_handler(CommandHandler("estado", estado_bot))
+    with startup_profile.etapa("Application.build"):
+        builder = Application.builder().token(TELEGRAM_TOKEN).request(RequestMedido(connection_pool_size=256))
+        if TELEGRAM_API_URL:
+            builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        if webhook.activo():
+            builder = builder.updater(None).concurrent_updates(webhook.BOT_CONCURRENCIA)
+        app = builder.build()
+    
+    comandos = {
+        "start": start,
+        "productos": ver_productos,
+        "buscar": buscar_productos,
+        "aleatorio": producto_aleatorio,
+        "categorias": ver_categorias,
+        "actualizar": actualizar_catalogo,
+        "estado": estado_bot,
+    }
+    for nombre, callback in comandos.items():
+        app.add_handler(CommandHandler(nombre, metrics.instrumentar(nombre, callback)))
+    app.add_handler(CallbackQueryHandler(metrics.instrumentar("productos:pagina", navegar_productos),
+                                         pattern=r"^productos:\d+$"))
+    app.add_handler(CallbackQueryHandler(metrics.instrumentar("buscar:pagina", navegar_busqueda),
+                                         pattern=r"^buscar:(ver:)?\d+$"))
+    
+    # Consumidores del feed de cambios del catálogo
+    catalog_sync.suscribir(invalidar_caches)
+    catalog_sync.suscribir(lambda cambios, cat: prerender_pipeline.iniciar(cat, cambios))
+    catalog_sync.suscribir(publisher.anunciar_nuevos)
     
     app.post_init = post_init
+    app.post_shutdown = post_shutdown
+    http_server.agregar_ruta("GET", "/health", salud)
     
     print("Bot iniciado correctamente")
-    print("Esperando mensajes en Telegram...")
     
-    app.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    if webhook.activo():
+        print(f"Esperando actualizaciones por webhook en {webhook.WEBHOOK_URL}")
+        webhook.ejecutar(app)
+    else:
+        print("Esperando mensajes en Telegram...")
+        app.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
 
 
 if __name__ == "__main__":
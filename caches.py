@@ -0,0 +1,203 @@
+# caches.py
+# Cachés de bytes reutilizables por el bot y el pipeline de imágenes:
+# - LRUBytesCache: caché en memoria con presupuesto máximo de bytes (LRU).
+# - DiskBytesCache: directorio en disco que sobrevive reinicios, con límite de
+#   tamaño opcional y expulsión LRU según la fecha de último acceso (mtime).
+#   El tamaño total se lleva con un contador; recorrer el directorio (tamaño
+#   inicial y expulsión) se hace en un hilo aparte, nunca en quien escribe.
+#   Varios procesos pueden compartir el directorio (los workers de render con
+#   la caché de recortes): cada uno solo cuenta lo que escribe él, así que
+#   vuelve a medir el disco cada vez que escribió RECUENTO_FRACCION del límite.
+#   El exceso queda acotado a workers * RECUENTO_FRACCION del límite.
+#
+# Las claves deben ser cadenas seguras como nombre de archivo (p. ej. hashes hex).
+
+import os
+import threading
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+
+# Fracción del límite escrita desde el último recorrido que obliga a recontar
+RECUENTO_FRACCION = 0.1
+
+
+class LRUBytesCache:
+    """Caché LRU en memoria limitada por el total de bytes almacenados."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, expulsado = self._items.popitem(last=False)
+                self._bytes -= len(expulsado)
+
+    def discard(self, key):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskBytesCache:
+    """Caché persistente en disco: un archivo por clave dentro de `directorio`.
+
+    Si `max_bytes` está definido, al superar el límite se eliminan en segundo
+    plano los archivos con acceso más antiguo. Las lecturas actualizan el mtime
+    para llevar el LRU."""
+
+    def __init__(self, directorio, max_bytes=None, sufijo=".bin"):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.sufijo = sufijo
+        self._lock = threading.Lock()
+        self._bytes = None  # se calcula en el primer mantenimiento
+        self._delta = 0     # cambios desde que empezó el último recorrido
+        self._manteniendo = False
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directorio, key[:2], key + self.sufijo)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return data
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, data):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                previo = os.path.getsize(path)
+            except OSError:
+                previo = 0
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("No se pudo escribir caché %s : %s", path, e)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self._ajustar(len(data) - previo)
+
+    def discard(self, key):
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self._ajustar(-size)
+
+    def _ajustar(self, delta):
+        """Actualiza el contador de bytes y lanza el mantenimiento si todavía
+        no se conoce el tamaño total, se superó el límite o se escribió mucho
+        desde el último recorrido (otros procesos pueden haber escrito también)."""
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            self._delta += delta
+            if self._bytes is not None:
+                self._bytes += delta
+            lanzar = not self._manteniendo and (self._bytes is None or self._bytes > self.max_bytes
+                                                or self._delta > self.max_bytes * RECUENTO_FRACCION)
+            if lanzar:
+                self._manteniendo = True
+        if lanzar:
+            threading.Thread(target=self._mantener, name="cache-mantenimiento", daemon=True).start()
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directorio):
+            for name in files:
+                if not name.endswith(self.sufijo):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _mantener(self):
+        """Hilo de mantenimiento: recorre el directorio, expulsa por LRU hasta
+        el 90% del límite si hace falta (para no repetirlo en cada escritura) y
+        recalcula el contador sumando lo escrito mientras tanto (lo que el
+        recorrido ya vio se cuenta dos veces: el error es por exceso y se
+        corrige en el siguiente mantenimiento)."""
+        try:
+            with self._lock:
+                self._delta = 0
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                objetivo = int(self.max_bytes * 0.9)
+                for _, size, path in entries:
+                    if total <= objetivo:
+                        break
+                    try:
+                        os.remove(path)
+                        total -= size
+                    except OSError:
+                        continue
+            with self._lock:
+                self._bytes = total + self._delta
+        except Exception as e:
+            logger.warning("Error en el mantenimiento de la caché %s : %s", self.directorio, e)
+        finally:
+            with self._lock:
+                self._manteniendo = False
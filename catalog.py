@@ -0,0 +1,261 @@
+# catalog.py
+# Catálogo de productos en memoria con índices y agregados precalculados.
+#
+# Un Catalog es inmutable: se construye completo (índices por id, categoría y
+# precio, conteos por categoría, índice de búsqueda) y luego se publica
+# reemplazando una sola referencia global, de modo que los handlers nunca ven
+# un catálogo a medias.
+# Los handlers deben tomar esa referencia una vez al empezar y usarla durante
+# todo el comando.
+#
+# El último catálogo bueno se guarda en un snapshot compacto (JSON con gzip)
+# para arrancar con datos al instante, aunque el sitio no responda. El snapshot
+# guarda también los validadores HTTP (ETag, Last-Modified) con los que se
+# descargó, para pedir el siguiente con un GET condicional.
+#
+# Cada producto tiene una huella de su contenido; Catalog.cambios_desde compara
+# dos catálogos por id y huella y devuelve los productos agregados,
+# actualizados y eliminados (ver catalog_sync.py).
+
+import os
+import sys
+import copy
+import gzip
+import json
+import hashlib
+import bisect
+import logging
+from datetime import datetime
+
+from search import IndiceBusqueda
+
+logger = logging.getLogger(__name__)
+
+
+def url_absoluta(ruta, base_url):
+    if ruta.startswith('/'):
+        return base_url + ruta
+    if ruta.startswith('http'):
+        return ruta
+    return base_url + '/' + ruta
+
+
+class Producto:
+    """Registro compacto de un producto. Admite acceso tipo dict
+    (prod['nombre'], prod.get('packaging_url')) para el código de render."""
+
+    __slots__ = ("id", "nombre", "precio", "imagen_url", "categoria", "descripcion", "packaging_url")
+
+    def __init__(self, id, nombre, precio, imagen_url, categoria, descripcion, packaging_url=None):
+        self.id = id
+        self.nombre = nombre
+        self.precio = precio
+        self.imagen_url = imagen_url
+        self.categoria = categoria
+        self.descripcion = descripcion
+        self.packaging_url = packaging_url
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**{campo: d.get(campo) for campo in cls.__slots__})
+
+    @classmethod
+    def desde_json(cls, d, base_url):
+        """Producto a partir de un registro de productos.json del sitio; las
+        rutas de imagen relativas se resuelven contra base_url. La categoría
+        se interna: hay pocas distintas y se repiten en miles de productos."""
+        return cls(
+            id=d.get('id'),
+            nombre=(d.get('nombre') or '').strip(),
+            precio=d.get('precio', 0),
+            imagen_url=url_absoluta(d.get('imagen') or '', base_url),
+            categoria=sys.intern((d.get('categoria') or '').strip()),
+            descripcion=(d.get('descripcion') or '').strip(),
+        )
+
+    def to_dict(self):
+        return {campo: getattr(self, campo) for campo in self.__slots__}
+
+    def huella(self):
+        """Hash del contenido de todos los campos, para detectar cambios."""
+        crudo = json.dumps([getattr(self, c) for c in self.__slots__], ensure_ascii=False, default=str)
+        return hashlib.sha1(crudo.encode("utf-8")).hexdigest()
+
+    def keys(self):
+        return self.__slots__
+
+    def get(self, campo, default=None):
+        valor = getattr(self, campo, None) if campo in self.__slots__ else None
+        return default if valor is None else valor
+
+    def __getitem__(self, campo):
+        if campo not in self.__slots__:
+            raise KeyError(campo)
+        return getattr(self, campo)
+
+    def __repr__(self):
+        return f"Producto(id={self.id!r}, nombre={self.nombre!r})"
+
+
+def _precio_orden(prod):
+    try:
+        return float(prod.precio or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class Cambios:
+    """Diferencia entre dos catálogos. actualizados: [(anterior, nuevo)]."""
+
+    def __init__(self, agregados=(), actualizados=(), eliminados=(), total_anterior=0):
+        self.agregados = tuple(agregados)
+        self.actualizados = tuple(actualizados)
+        self.eliminados = tuple(eliminados)
+        self.total_anterior = total_anterior
+        self.fecha = datetime.now()
+
+    def __bool__(self):
+        return bool(self.agregados or self.actualizados or self.eliminados)
+
+    def resumen(self):
+        if not self:
+            return "sin cambios"
+        return (f"{len(self.agregados)} nuevos, {len(self.actualizados)} actualizados, "
+                f"{len(self.eliminados)} eliminados")
+
+    def __repr__(self):
+        return f"Cambios({self.resumen()})"
+
+
+class Catalog:
+    def __init__(self, productos=(), actualizado=None, validadores=None):
+        self.productos = tuple(productos)
+        self.actualizado = actualizado
+        # Cabeceras ETag / Last-Modified de la respuesta de la que salió
+        self.validadores = dict(validadores or {})
+        self._huellas = None
+
+        self.por_id = {}
+        self.por_categoria = {}
+        for prod in self.productos:
+            self.por_id[prod.id] = prod
+            self.por_categoria.setdefault(prod.categoria, []).append(prod)
+        self.por_categoria = {cat: tuple(prods) for cat, prods in self.por_categoria.items()}
+        self.conteo_categorias = {cat: len(prods) for cat, prods in self.por_categoria.items()}
+
+        # Índice por precio: productos ordenados y sus precios para bisect
+        self._por_precio = tuple(sorted(self.productos, key=_precio_orden))
+        self._precios = [_precio_orden(p) for p in self._por_precio]
+
+        # Índice de texto para /buscar
+        self.indice = IndiceBusqueda(self.productos)
+
+    @classmethod
+    def desde_productos(cls, productos, validadores=None):
+        """Construye un catálogo nuevo marcado como actualizado ahora."""
+        return cls(productos, actualizado=datetime.now(), validadores=validadores)
+
+    def actualizar(self, productos, validadores=None):
+        """(catálogo, cambios) para una descarga nueva de `productos`.
+
+        Compara las huellas antes de construir nada: si ningún producto cambió
+        y el orden es el mismo, devuelve una copia de este catálogo que
+        comparte sus índices y solo lleva los validadores nuevos. Es CPU pura
+        (huellas e índice de búsqueda): en el bot se llama con asyncio.to_thread."""
+        productos = tuple(productos)
+        ahora = {p.id: p.huella() for p in productos}
+        antes = self.huellas()
+        if ahora == antes and [p.id for p in productos] == [p.id for p in self.productos]:
+            return self.revalidado(validadores or {}), Cambios(total_anterior=len(self))
+        nuevo = Catalog.desde_productos(productos, validadores)
+        nuevo._huellas = ahora
+        return nuevo, nuevo.cambios_desde(self)
+
+    def revalidado(self, validadores=None):
+        """Copia que comparte productos e índices, marcada como actualizada
+        ahora: el sitio confirmó que el catálogo no cambió. validadores: los de
+        la respuesta, si reemplazan a los actuales."""
+        igual = copy.copy(self)
+        igual.actualizado = datetime.now()
+        if validadores is not None:
+            igual.validadores = dict(validadores)
+        return igual
+
+    @classmethod
+    def cargar_snapshot(cls, path):
+        """Catálogo guardado con guardar_snapshot, o None si no hay uno válido."""
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            campos = data["campos"]
+            productos = [Producto(**dict(zip(campos, fila))) for fila in data["productos"]]
+            actualizado = data.get("actualizado")
+            actualizado = datetime.fromisoformat(actualizado) if actualizado else None
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Snapshot de catálogo inválido %s : %s", path, e)
+            return None
+        return cls(productos, actualizado=actualizado, validadores=data.get("validadores"))
+
+    def guardar_snapshot(self, path):
+        """Guarda el catálogo (filas sin nombres de campo, gzip) de forma atómica."""
+        data = {
+            "actualizado": self.actualizado.isoformat() if self.actualizado else None,
+            "validadores": self.validadores,
+            "campos": Producto.__slots__,
+            "productos": [[getattr(p, c) for c in Producto.__slots__] for p in self.productos],
+        }
+        tmp = f"{path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+                json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("No se pudo guardar el snapshot %s : %s", path, e)
+
+    def __len__(self):
+        return len(self.productos)
+
+    def __bool__(self):
+        return bool(self.productos)
+
+    def __iter__(self):
+        return iter(self.productos)
+
+    def __getitem__(self, indice):
+        return self.productos[indice]
+
+    def get(self, producto_id):
+        return self.por_id.get(producto_id)
+
+    def huellas(self):
+        """{id: huella} de todos los productos (se calcula una sola vez)."""
+        if self._huellas is None:
+            self._huellas = {p.id: p.huella() for p in self.productos}
+        return self._huellas
+
+    def cambios_desde(self, anterior):
+        """Cambios de `anterior` a este catálogo, comparando por id y huella."""
+        antes, ahora = anterior.huellas(), self.huellas()
+        agregados = [p for p in self.productos if p.id not in antes]
+        actualizados = [(anterior.get(p.id), p) for p in self.productos
+                        if p.id in antes and antes[p.id] != ahora[p.id]]
+        eliminados = [p for p in anterior.productos if p.id not in ahora]
+        return Cambios(agregados, actualizados, eliminados, total_anterior=len(anterior))
+
+    def en_rango_precio(self, minimo=None, maximo=None):
+        """Productos con minimo <= precio <= maximo, ordenados por precio."""
+        i = 0 if minimo is None else bisect.bisect_left(self._precios, minimo)
+        j = len(self._precios) if maximo is None else bisect.bisect_right(self._precios, maximo)
+        return self._por_precio[i:j]
+
+    def destacados(self, categoria, n=3):
+        """Primeros n productos de la categoría, en el orden del catálogo."""
+        return self.por_categoria.get(categoria, ())[:n]
+
+    def buscar(self, consulta, limite=None):
+        """Productos que coinciden con la consulta, ordenados por relevancia
+        (los `limite` más relevantes si se indica)."""
+        return self.indice.buscar(consulta, limite)
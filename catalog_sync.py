@@ -0,0 +1,127 @@
+# catalog_sync.py
+# Sincronización incremental del catálogo con el sitio.
+#
+# - descargar_productos(url, validadores, base_url): GET condicional con
+#   If-None-Match / If-Modified-Since a partir de los validadores del catálogo
+#   vigente (ver Catalog.validadores). Si el sitio responde 304 no se descarga
+#   ni se parsea nada, así que refrescar cada pocos minutos cuesta casi cero.
+#   Si hay cuerpo, se lee en streaming: el array "productos" se parsea a medida
+#   que llega (json_stream.py) y cada registro se convierte enseguida en un
+#   Producto, así que la memoria no depende del tamaño del JSON, solo de la
+#   cantidad de productos. El parser es Python puro: cada parte se parsea en
+#   un hilo (asyncio.to_thread) para no frenar a los handlers del bot.
+# - Feed de cambios: cuando bot.py publica un catálogo nuevo llama a
+#   publicar(cambios, catalogo) con los productos agregados, actualizados y
+#   eliminados (Catalog.cambios_desde). Cada suscriptor registrado con
+#   suscribir(fn) los recibe: invalidación de renders y file_ids, pre-render,
+#   anuncio de productos nuevos, etc.
+# - Se recuerdan los últimos cambios y la última sincronización para /estado.
+
+import asyncio
+import inspect
+from collections import deque
+from datetime import datetime
+import logging
+
+import http_client
+import metrics
+from catalog import Producto
+from json_stream import LectorArray
+
+logger = logging.getLogger(__name__)
+
+ULTIMOS_CAMBIOS = 20
+# Bytes de la respuesta que se entregan juntos al parser (una ida al hilo cada uno)
+PARTE_DESCARGA = 256 * 1024
+
+_suscriptores = []
+ultimos = deque(maxlen=ULTIMOS_CAMBIOS)
+ultima_sincronizacion = None  # (datetime, resultado)
+
+_cambios = metrics.contador("catalogo_cambios_total", "Productos del catálogo agregados, actualizados o eliminados",
+                            ("tipo",))
+
+
+def validadores_de(response):
+    """ETag y Last-Modified de una respuesta, para el próximo GET condicional."""
+    validadores = {"etag": response.headers.get("etag"),
+                   "last_modified": response.headers.get("last-modified")}
+    return {k: v for k, v in validadores.items() if v}
+
+
+def leer_productos(partes, base_url):
+    """Generador: Producto por cada registro de doc["productos"], a partir de
+    partes del JSON en bytes. ValueError si el documento está mal formado."""
+    lector = LectorArray("productos")
+    for parte in partes:
+        for d in lector.alimentar(parte):
+            yield Producto.desde_json(d, base_url)
+    for d in lector.terminar():
+        yield Producto.desde_json(d, base_url)
+
+
+def _parsear(paso, base_url, *args):
+    """Productos de los registros que devuelve paso(*args) (alimentar o
+    terminar de un LectorArray); se ejecuta en un hilo."""
+    return [Producto.desde_json(d, base_url) for d in paso(*args)]
+
+
+async def descargar_productos(url, validadores=None, base_url="", timeout=20):
+    """Descarga y parsea el catálogo en streaming. Devuelve
+    (productos, validadores, bytes leídos), o None si el sitio responde 304
+    (sin cambios desde los validadores dados)."""
+    headers = http_client.cabeceras_condicionales(validadores or {})
+    async with http_client.stream(url, headers=headers, timeout=timeout) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        lector = LectorArray("productos")
+        productos = []
+        async for parte in response.aiter_bytes(PARTE_DESCARGA):
+            productos += await asyncio.to_thread(_parsear, lector.alimentar, base_url, parte)
+        productos += await asyncio.to_thread(_parsear, lector.terminar, base_url)
+        return productos, validadores_de(response), response.num_bytes_downloaded
+
+
+def suscribir(fn):
+    """fn(cambios, catalogo), síncrona o async; se llama en cada publicar()."""
+    _suscriptores.append(fn)
+    return fn
+
+
+def registrar(resultado):
+    global ultima_sincronizacion
+    ultima_sincronizacion = (datetime.now(), resultado)
+
+
+async def publicar(cambios, catalogo):
+    """Entrega los cambios a los suscriptores. Un suscriptor que falla no
+    impide que los demás los reciban."""
+    registrar("ok")
+    if not cambios:
+        return
+    ultimos.append(cambios)
+    _cambios.inc(len(cambios.agregados), tipo="agregado")
+    _cambios.inc(len(cambios.actualizados), tipo="actualizado")
+    _cambios.inc(len(cambios.eliminados), tipo="eliminado")
+    logger.info("Cambios en el catálogo: %s", cambios.resumen())
+    for fn in list(_suscriptores):
+        try:
+            resultado = fn(cambios, catalogo)
+            if inspect.isawaitable(resultado):
+                await resultado
+        except Exception as e:
+            logger.warning("Error en el suscriptor de cambios %s: %s", getattr(fn, "__name__", fn), e)
+
+
+def estado():
+    """Texto de una línea para /estado."""
+    if ultima_sincronizacion is None:
+        return "pendiente"
+    fecha, resultado = ultima_sincronizacion
+    minutos = int((datetime.now() - fecha).total_seconds() // 60)
+    texto = {"ok": "catalogo descargado", "no_modificado": "sin cambios (304)"}.get(resultado, resultado)
+    texto += f", hace {minutos} min"
+    if ultimos:
+        texto += f"; ultimos cambios: {ultimos[-1].resumen()}"
+    return texto
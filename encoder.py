@@ -0,0 +1,67 @@
+# encoder.py
+# Codificación de las tarjetas renderizadas según el uso.
+#
+# Perfiles (formato:calidad), configurables por entorno:
+# - ENCODER_INTERACTIVO (por defecto JPEG:82): comandos del bot, prima la velocidad
+# - ENCODER_CANAL (por defecto JPEG:92): publicaciones en el canal, prima la calidad
+#
+# Formatos admitidos: JPEG, WEBP y PNG (en PNG la calidad no aplica).
+
+import os
+import io
+
+FORMATOS = {
+    "JPEG": "jpg",
+    "WEBP": "webp",
+    "PNG": "png",
+}
+
+PERFIL_INTERACTIVO = "interactivo"
+PERFIL_CANAL = "canal"
+
+
+def _parse_perfil(valor):
+    formato, _, calidad = valor.partition(":")
+    formato = formato.strip().upper()
+    if formato == "JPG":
+        formato = "JPEG"
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de imagen no soportado: {valor}")
+    return {"formato": formato, "quality": int(calidad) if calidad else 90}
+
+
+PERFILES = {
+    PERFIL_INTERACTIVO: _parse_perfil(os.getenv("ENCODER_INTERACTIVO", "JPEG:82")),
+    PERFIL_CANAL: _parse_perfil(os.getenv("ENCODER_CANAL", "JPEG:92")),
+}
+
+
+def huella(perfil):
+    """Identificador estable de la configuración del perfil (para claves de caché)."""
+    p = PERFILES[perfil]
+    return f"{p['formato'].lower()}{p['quality']}"
+
+
+def extension(perfil):
+    return FORMATOS[PERFILES[perfil]["formato"]]
+
+
+def codificar(img, perfil=PERFIL_INTERACTIVO):
+    """Codifica una PIL.Image RGB con el perfil indicado y devuelve los bytes."""
+    p = PERFILES[perfil]
+    bio = io.BytesIO()
+    if p["formato"] == "JPEG":
+        # 4:4:4 solo en alta calidad: el texto rojo/naranja se ve mejor sin submuestreo
+        subsampling = 0 if p["quality"] >= 90 else 2
+        img.save(bio, "JPEG", quality=p["quality"], subsampling=subsampling, progressive=False)
+    elif p["formato"] == "WEBP":
+        img.save(bio, "WEBP", quality=p["quality"], method=4)
+    else:
+        # compress_level bajo: optimize=True tardaba mucho para una foto de 1080x1080
+        img.save(bio, "PNG", compress_level=3)
+    return bio.getvalue()
+
+
+def codificar_perfiles(img, perfiles=None):
+    """Codifica la imagen en varios perfiles a la vez: {perfil: bytes}."""
+    return {perfil: codificar(img, perfil) for perfil in (perfiles or PERFILES)}
@@ -0,0 +1,113 @@
+# envios.py
+# Envío de tarjetas de producto a Telegram reutilizando file_ids.
+#
+# Si la tarjeta (mismo hash de render y perfil) ya se subió antes, se reenvía
+# por file_id: sin render, sin subida. Si no, se obtiene de render_executor
+# (caché o render), se sube y se guarda el file_id devuelto.
+# enviar_album hace lo mismo para varias tarjetas en un solo send_media_group.
+
+import asyncio
+from io import BytesIO
+import logging
+
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest
+
+import encoder
+from file_id_cache import file_id_cache
+from render_cache import clave_render
+from render_executor import render_executor
+
+logger = logging.getLogger(__name__)
+
+
+async def enviar_tarjeta(bot, chat_id, prod, caption, perfil=encoder.PERFIL_INTERACTIVO, imagenes=None):
+    """Envía la tarjeta del producto con send_photo y devuelve el Message."""
+    clave = clave_render(prod)
+    huella = encoder.huella(perfil)
+    file_id = file_id_cache.get(prod.get('id'), clave, huella)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption)
+        except BadRequest as e:
+            logger.warning("file_id rechazado para producto %s (%s), se vuelve a subir", prod.get('id'), e)
+            file_id_cache.descartar(clave, huella)
+
+    bio = BytesIO(await render_executor.obtener(prod, imagenes, perfil=perfil))
+    bio.name = f"producto_{prod.get('id')}.{encoder.extension(perfil)}"
+    mensaje = await bot.send_photo(chat_id=chat_id, photo=bio, caption=caption)
+    if mensaje.photo:
+        # La última variante es la de mayor resolución
+        file_id_cache.put(prod.get('id'), clave, huella, mensaje.photo[-1].file_id)
+    return mensaje
+
+
+async def _renderizar_varios(prods, perfil, imagenes=None):
+    """Renderiza (o toma de caché) varias tarjetas en paralelo. Devuelve una
+    lista alineada con prods; None donde el render falló."""
+    if imagenes is None:
+        imagenes = await render_executor.precargar_imagenes(prods)
+    resultados = await asyncio.gather(
+        *(render_executor.obtener(p, imagenes, perfil=perfil) for p in prods),
+        return_exceptions=True,
+    )
+    salida = []
+    for prod, res in zip(prods, resultados):
+        if isinstance(res, BaseException):
+            logger.warning("Error renderizando producto %s: %s", prod.get('id'), res)
+            res = None
+        salida.append(res)
+    return salida
+
+
+async def enviar_album(bot, chat_id, prods, captions, perfil=encoder.PERFIL_INTERACTIVO, imagenes=None):
+    """Envía varias tarjetas (2 a 10) como un álbum con send_media_group.
+    Devuelve la lista de Message enviados; RuntimeError si no se pudo
+    obtener ninguna tarjeta."""
+    huella = encoder.huella(perfil)
+    claves = [clave_render(p) for p in prods]
+    file_ids = [file_id_cache.get(p.get('id'), c, huella) for p, c in zip(prods, claves)]
+
+    faltan = [i for i, f in enumerate(file_ids) if not f]
+    datos = dict(zip(faltan, await _renderizar_varios([prods[i] for i in faltan], perfil, imagenes)))
+
+    def armar(usar_file_ids):
+        media, indices = [], []
+        for i, prod in enumerate(prods):
+            if usar_file_ids and file_ids[i]:
+                media.append(InputMediaPhoto(file_ids[i], caption=captions[i]))
+            elif datos.get(i):
+                nombre = f"producto_{prod.get('id')}.{encoder.extension(perfil)}"
+                media.append(InputMediaPhoto(datos[i], caption=captions[i], filename=nombre))
+            else:
+                continue
+            indices.append(i)
+        return media, indices
+
+    media, indices = armar(True)
+    if not media:
+        ids = [p.get('id') for p in prods]
+        logger.error("No se pudo renderizar ninguna tarjeta del álbum (productos %s)", ids)
+        raise RuntimeError(f"Falló el render de las {len(prods)} tarjetas del álbum")
+    if len(media) < 2:
+        # send_media_group exige al menos 2 elementos
+        return [await enviar_tarjeta(bot, chat_id, prods[i], captions[i], perfil, imagenes) for i in indices]
+    try:
+        mensajes = await bot.send_media_group(chat_id=chat_id, media=media)
+    except BadRequest as e:
+        if all(datos.get(i) for i in indices):
+            raise
+        # Algún file_id ya no es válido: descartarlos y subir todo
+        logger.warning("Álbum rechazado con file_ids (%s), se vuelve a subir", e)
+        for i, f in enumerate(file_ids):
+            if f:
+                file_id_cache.descartar(claves[i], huella)
+        pendientes = [i for i in range(len(prods)) if not datos.get(i)]
+        datos.update(zip(pendientes, await _renderizar_varios([prods[i] for i in pendientes], perfil, imagenes)))
+        media, indices = armar(False)
+        mensajes = await bot.send_media_group(chat_id=chat_id, media=media)
+
+    for i, mensaje in zip(indices, mensajes):
+        if mensaje.photo:
+            file_id_cache.put(prods[i].get('id'), claves[i], huella, mensaje.photo[-1].file_id)
+    return mensajes
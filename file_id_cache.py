@@ -0,0 +1,127 @@
+# file_id_cache.py
+# Mapa persistente (render, perfil) -> file_id de Telegram.
+#
+# Tras el primer envío de una tarjeta se guarda el file_id que devuelve la Bot
+# API; los envíos siguientes de la misma tarjeta lo reutilizan y no suben nada.
+# La clave incluye el hash de render (campos del producto + versión de la
+# plantilla), así que un cambio de producto o de plantilla nunca reutiliza una
+# foto vieja. Además se recuerda el último hash de cada producto para borrar
+# las entradas obsoletas en cuanto cambia.
+#
+# Los cambios se guardan en disco agrupados: cada modificación programa una
+# escritura FILE_ID_GUARDAR_SEG segundos después en un hilo aparte, así que
+# una ráfaga de envíos produce una sola escritura y nunca bloquea el event
+# loop. guardar() escribe lo pendiente de inmediato (al apagar el bot).
+
+import os
+import json
+import threading
+import logging
+
+import metrics
+from caches import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+FILE_ID_GUARDAR_SEG = float(os.getenv("FILE_ID_GUARDAR_SEG", "2"))
+
+
+class FileIdCache:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file_ids = {}      # "<clave render>-<huella perfil>" -> file_id
+        self._por_producto = {}  # id producto -> clave render actual
+        self.hits = 0
+        self.misses = 0
+        self._timer = None
+        self._lock_disco = threading.Lock()
+        self._cargar()
+
+    def _cargar(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._file_ids = data.get("file_ids", {})
+            self._por_producto = data.get("por_producto", {})
+        except (OSError, ValueError):
+            pass
+
+    def _guardar(self):
+        """Programa una escritura (se llama con self._lock tomado)."""
+        if self._timer is None:
+            self._timer = threading.Timer(FILE_ID_GUARDAR_SEG, self.guardar)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def guardar(self):
+        """Escribe el mapa en disco si hay cambios pendientes."""
+        with self._lock:
+            if self._timer is None:
+                return
+            self._timer.cancel()
+            self._timer = None
+            data = {"file_ids": dict(self._file_ids), "por_producto": dict(self._por_producto)}
+        tmp = f"{self.path}.tmp"
+        with self._lock_disco:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                logger.warning("No se pudo guardar %s : %s", self.path, e)
+
+    def _invalidar_clave(self, clave):
+        prefijo = clave + "-"
+        for k in [k for k in self._file_ids if k.startswith(prefijo)]:
+            del self._file_ids[k]
+
+    def get(self, producto_id, clave, huella):
+        with self._lock:
+            anterior = self._por_producto.get(str(producto_id))
+            if anterior is not None and anterior != clave:
+                # El producto o la plantilla cambiaron: las fotos viejas ya no sirven
+                self._invalidar_clave(anterior)
+                self._por_producto[str(producto_id)] = clave
+                self._guardar()
+            file_id = self._file_ids.get(f"{clave}-{huella}")
+            if file_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return file_id
+
+    def put(self, producto_id, clave, huella, file_id):
+        with self._lock:
+            anterior = self._por_producto.get(str(producto_id))
+            if anterior is not None and anterior != clave:
+                self._invalidar_clave(anterior)
+            self._por_producto[str(producto_id)] = clave
+            self._file_ids[f"{clave}-{huella}"] = file_id
+            self._guardar()
+
+    def descartar(self, clave, huella):
+        """Olvida un file_id que Telegram rechazó."""
+        with self._lock:
+            if self._file_ids.pop(f"{clave}-{huella}", None) is not None:
+                self._guardar()
+
+    def invalidar_productos(self, producto_ids):
+        """Olvida los file_ids de varios productos guardando una sola vez."""
+        with self._lock:
+            cambio = False
+            for producto_id in producto_ids:
+                clave = self._por_producto.pop(str(producto_id), None)
+                if clave is not None:
+                    self._invalidar_clave(clave)
+                    cambio = True
+            if cambio:
+                self._guardar()
+
+    def __len__(self):
+        return len(self._file_ids)
+
+
+file_id_cache = FileIdCache(os.path.join(CACHE_DIR, "telegram_file_ids.json"))
+metrics.registrar_cache("telegram_file_ids", lambda: (file_id_cache.hits, file_id_cache.misses))
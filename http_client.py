@@ -0,0 +1,88 @@
+# http_client.py
+# Cliente HTTP asíncrono compartido (httpx) para el catálogo y las imágenes
+# (las imágenes pasan además por image_cache).
+#
+# - Un único AsyncClient por proceso: pool de conexiones con keep-alive.
+# - Límite de peticiones simultáneas por host (HTTP_MAX_POR_HOST) para no
+#   saturar nexushcr.com cuando se descargan muchas imágenes a la vez.
+# - Timeouts por defecto (HTTP_TIMEOUT segundos).
+# - stream(url) para respuestas grandes que se procesan a medida que llegan
+#   (productos.json, ver catalog_sync.py).
+# - cabeceras_condicionales(validadores) para los GET condicionales del
+#   catálogo y de la caché de imágenes.
+
+import os
+import asyncio
+import contextlib
+from urllib.parse import urlsplit
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+HTTP_MAX_CONEXIONES = int(os.getenv("HTTP_MAX_CONEXIONES", "20"))
+HTTP_MAX_POR_HOST = int(os.getenv("HTTP_MAX_POR_HOST", "6"))
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+_client = None
+_limites_host = {}
+
+
+def get_client():
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            headers={'User-Agent': USER_AGENT},
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONEXIONES,
+                max_keepalive_connections=HTTP_MAX_CONEXIONES,
+                keepalive_expiry=60,
+            ),
+            follow_redirects=True,
+        )
+    return _client
+
+
+def _limite_host(url):
+    host = urlsplit(url).netloc
+    sem = _limites_host.get(host)
+    if sem is None:
+        sem = _limites_host[host] = asyncio.Semaphore(HTTP_MAX_POR_HOST)
+    return sem
+
+
+def cabeceras_condicionales(validadores):
+    """If-None-Match / If-Modified-Since a partir de {"etag", "last_modified"}
+    guardados de una respuesta anterior."""
+    headers = {}
+    if validadores.get("etag"):
+        headers["If-None-Match"] = validadores["etag"]
+    if validadores.get("last_modified"):
+        headers["If-Modified-Since"] = validadores["last_modified"]
+    return headers
+
+
+async def get(url, **kwargs):
+    """GET respetando el límite por host. Devuelve httpx.Response."""
+    async with _limite_host(url):
+        return await get_client().get(url, **kwargs)
+
+
+@contextlib.asynccontextmanager
+async def stream(url, **kwargs):
+    """GET en streaming respetando el límite por host: produce la
+    httpx.Response sin leer el cuerpo, para consumirla con aiter_bytes()."""
+    async with _limite_host(url):
+        async with get_client().stream("GET", url, **kwargs) as response:
+            yield response
+
+
+async def cerrar():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
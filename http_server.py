@@ -0,0 +1,137 @@
+# http_server.py
+# Servidor HTTP mínimo sobre asyncio, dentro del mismo event loop del bot.
+#
+# Sirve rutas registradas con agregar_ruta(metodo, path, handler); el handler es
+# async, recibe una Peticion y devuelve (status, content_type, cuerpo). Por
+# defecto expone /metrics (ver metrics.py).
+#
+# Puede haber más de un servidor (p. ej. el público del webhook, ver
+# webhook.py). Las rutas internas, como /metrics, solo se sirven en los
+# iniciados con internas=True, que es el caso del de METRICS_HOST:METRICS_PORT.
+#
+# Configuración:
+# - METRICS_HOST: interfaz donde escuchar (127.0.0.1 por defecto, solo local)
+# - METRICS_PORT: puerto (9100 por defecto; 0 lo desactiva)
+#
+# Es deliberadamente simple: una petición por conexión, sin chunked ni TLS.
+
+import os
+import asyncio
+import functools
+from collections import namedtuple
+from http import HTTPStatus
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+MAX_CUERPO = int(os.getenv("HTTP_SERVER_MAX_BODY", str(1024 * 1024)))
+TIMEOUT_LECTURA = 10
+
+Peticion = namedtuple("Peticion", "metodo path consulta headers cuerpo")
+
+_rutas = {}  # (metodo, path) -> (handler, interna)
+_servidores = {}  # (host, port) -> asyncio.Server
+
+
+def agregar_ruta(metodo, path, handler, interna=False):
+    """interna=True: solo en los servidores iniciados con internas=True."""
+    _rutas[(metodo.upper(), path)] = (handler, interna)
+
+
+async def _metrics(peticion):
+    return 200, "text/plain; version=0.0.4; charset=utf-8", metrics.exposicion().encode("utf-8")
+
+
+agregar_ruta("GET", "/metrics", _metrics, interna=True)
+
+
+async def _leer_peticion(reader):
+    linea = await reader.readline()
+    if not linea:
+        return None
+    metodo, objetivo, _ = linea.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        linea = await reader.readline()
+        if linea in (b"\r\n", b"\n", b""):
+            break
+        nombre, _, valor = linea.decode("latin-1").partition(":")
+        headers[nombre.strip().lower()] = valor.strip()
+    largo = int(headers.get("content-length") or 0)
+    if largo > MAX_CUERPO:
+        raise ValueError("cuerpo demasiado grande")
+    cuerpo = await reader.readexactly(largo) if largo else b""
+    path, _, consulta = objetivo.partition("?")
+    return Peticion(metodo.upper(), path, consulta, headers, cuerpo)
+
+
+def _responder(writer, status, content_type, cuerpo):
+    razon = HTTPStatus(status).phrase
+    cabecera = (
+        f"HTTP/1.1 {status} {razon}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(cuerpo)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    writer.write(cabecera.encode("latin-1") + cuerpo)
+
+
+async def _atender(reader, writer, internas=True):
+    try:
+        try:
+            peticion = await asyncio.wait_for(_leer_peticion(reader), TIMEOUT_LECTURA)
+        except (ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            _responder(writer, 400, "text/plain", b"bad request")
+            return
+        if peticion is None:
+            return
+        rutas = {clave: handler for clave, (handler, interna) in _rutas.items() if internas or not interna}
+        handler = rutas.get((peticion.metodo, peticion.path))
+        if handler is None:
+            existe = any(path == peticion.path for _, path in rutas)
+            _responder(writer, 405 if existe else 404, "text/plain", b"")
+            return
+        try:
+            status, content_type, cuerpo = await handler(peticion)
+        except Exception as e:
+            logger.warning("Error atendiendo %s %s: %s", peticion.metodo, peticion.path, e)
+            status, content_type, cuerpo = 500, "text/plain", b"error"
+        _responder(writer, status, content_type, cuerpo)
+    finally:
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+async def iniciar(host=METRICS_HOST, port=METRICS_PORT, internas=True):
+    """Arranca un servidor en host:port (si port no es 0; si ya hay uno ahí,
+    lo devuelve). internas: servir también las rutas internas (/metrics).
+    Devuelve el asyncio.Server o None."""
+    if not port:
+        return None
+    servidor = _servidores.get((host, port))
+    if servidor is not None:
+        return servidor
+    try:
+        servidor = await asyncio.start_server(functools.partial(_atender, internas=internas), host, port)
+    except OSError as e:
+        logger.warning("No se pudo abrir el servidor HTTP en %s:%s : %s", host, port, e)
+        return None
+    _servidores[(host, port)] = servidor
+    rutas = sorted({path for (_, path), (_, interna) in _rutas.items() if internas or not interna})
+    logger.info("Servidor HTTP en http://%s:%s (rutas: %s)", host, port, ", ".join(rutas))
+    return servidor
+
+
+async def detener():
+    servidores = list(_servidores.values())
+    _servidores.clear()
+    for servidor in servidores:
+        servidor.close()
+        await servidor.wait_closed()
@@ -0,0 +1,160 @@
+# image_cache.py
+# Caché persistente en disco de las imágenes de producto descargadas.
+#
+# - Clave: hash de la URL. Cada entrada guarda el cuerpo y sus metadatos HTTP
+#   (ETag, Last-Modified, fecha de descarga) en un único archivo, de modo que la
+#   expulsión LRU nunca deja metadatos sin cuerpo.
+# - Durante IMAGE_CACHE_TTL segundos la copia se usa sin tocar la red; después
+#   se revalida con If-None-Match / If-Modified-Since (un 304 no descarga nada).
+# - Si el origen falla o tarda más de IMAGE_REVALIDATE_TIMEOUT, se sirve la copia
+#   guardada aunque esté vencida.
+# - Tamaño máximo IMAGE_CACHE_MB con expulsión LRU.
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+
+import http_client
+import metrics
+from caches import CACHE_DIR, DiskBytesCache
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_MB = int(os.getenv("IMAGE_CACHE_MB", "256"))
+IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL", "3600"))
+IMAGE_REVALIDATE_TIMEOUT = float(os.getenv("IMAGE_REVALIDATE_TIMEOUT", "3"))
+
+
+_descargas = metrics.histograma("descarga_imagen_segundos",
+                                "Descargas y revalidaciones de imágenes de producto", ("resultado",))
+_eventos = metrics.contador("imagen_cache_eventos_total",
+                            "Revalidaciones, copias vencidas servidas porque el origen falló y errores de origen",
+                            ("tipo",))
+
+
+def clave_url(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    def __init__(self, directorio, max_bytes, ttl=IMAGE_CACHE_TTL):
+        self.disco = DiskBytesCache(directorio, max_bytes=max_bytes, sufijo=".img")
+        self.ttl = ttl
+        self.hits = 0          # servidas sin descargar el cuerpo (frescas o 304)
+        self.misses = 0        # descargas completas
+
+    def leer(self, url):
+        """Devuelve (meta, cuerpo) o None."""
+        raw = self.disco.get(clave_url(url))
+        if raw is None:
+            return None
+        cabecera, _, cuerpo = raw.partition(b"\n")
+        try:
+            meta = json.loads(cabecera)
+        except ValueError:
+            return None
+        return meta, cuerpo
+
+    def guardar(self, url, cuerpo, headers):
+        meta = {
+            "url": url,
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+            "fecha": time.time(),
+        }
+        self._escribir(url, meta, cuerpo)
+
+    def _escribir(self, url, meta, cuerpo):
+        cabecera = json.dumps(meta).encode("utf-8")
+        self.disco.put(clave_url(url), cabecera + b"\n" + cuerpo)
+
+    def _refrescar(self, url, meta, cuerpo):
+        # 304: la copia sigue siendo válida, solo se renueva la fecha
+        meta = dict(meta, fecha=time.time())
+        self._escribir(url, meta, cuerpo)
+
+    def fresca(self, meta):
+        return time.time() - meta.get("fecha", 0) < self.ttl
+
+    def _resolver(self, url, entrada, status, cuerpo, headers):
+        """Aplica la respuesta HTTP a la caché y devuelve los bytes a usar."""
+        if entrada and status == 304:
+            self.hits += 1
+            self._refrescar(url, *entrada)
+            return entrada[1]
+        if 200 <= status < 300 and cuerpo:
+            self.misses += 1
+            self.guardar(url, cuerpo, headers)
+            return cuerpo
+        raise RuntimeError(f"HTTP {status}")
+
+    def _fallback(self, url, entrada, error):
+        _eventos.inc(tipo="error")
+        if entrada:
+            _eventos.inc(tipo="vencida")
+            logger.warning("Origen no disponible para %s (%s), usando copia en caché", url, error)
+            return entrada[1]
+        logger.warning("Error descargando imagen %s : %s", url, error)
+        return None
+
+    async def obtener(self, url):
+        """Devuelve los bytes de la imagen (desde caché o red) o None. Las
+        lecturas y escrituras de disco se hacen en un hilo, fuera del loop."""
+        entrada = await asyncio.to_thread(self.leer, url)
+        if entrada and self.fresca(entrada[0]):
+            self.hits += 1
+            return entrada[1]
+        headers, timeout = {}, http_client.HTTP_TIMEOUT
+        if entrada:
+            _eventos.inc(tipo="revalidacion")
+            headers = http_client.cabeceras_condicionales(entrada[0])
+            timeout = IMAGE_REVALIDATE_TIMEOUT
+        t0 = time.perf_counter()
+        try:
+            r = await http_client.get(url, headers=headers, timeout=timeout)
+            data = await asyncio.to_thread(self._resolver, url, entrada, r.status_code, r.content, r.headers)
+            resultado = "no_modificada" if r.status_code == 304 else "ok"
+        except Exception as e:
+            data = self._fallback(url, entrada, e)
+            resultado = "error"
+        segundos = time.perf_counter() - t0
+        _descargas.observar(segundos, resultado=resultado)
+        metrics.registrar_lento("descarga", url, segundos)
+        return data
+
+    def obtener_sync(self, url, session, timeout=15):
+        """Igual que obtener() pero con una requests.Session (fuera del event loop)."""
+        entrada = self.leer(url)
+        if entrada and self.fresca(entrada[0]):
+            self.hits += 1
+            return entrada[1]
+        headers = {}
+        if entrada:
+            _eventos.inc(tipo="revalidacion")
+            headers = http_client.cabeceras_condicionales(entrada[0])
+            timeout = min(timeout, IMAGE_REVALIDATE_TIMEOUT)
+        try:
+            r = session.get(url, headers=headers, timeout=timeout)
+            return self._resolver(url, entrada, r.status_code, r.content, r.headers)
+        except Exception as e:
+            return self._fallback(url, entrada, e)
+
+
+image_cache = ImageCache(os.path.join(CACHE_DIR, "imagenes"), IMAGE_CACHE_MB * 1024 * 1024)
+metrics.registrar_cache("imagenes", lambda: (image_cache.hits, image_cache.misses))
+
+
+# Valor de una imagen que ya se intentó descargar y falló: el render usa el
+# placeholder sin volver a intentarlo
+DESCARGA_FALLIDA = b""
+
+
+async def descargar_imagenes(urls):
+    """Obtiene varias imágenes en paralelo (caché + red). Devuelve {url: bytes},
+    con DESCARGA_FALLIDA para las que no se pudieron obtener."""
+    urls = list(dict.fromkeys(u for u in urls if u))
+    resultados = await asyncio.gather(*(image_cache.obtener(u) for u in urls))
+    return {u: data or DESCARGA_FALLIDA for u, data in zip(urls, resultados)}
@@ -14,69 +14,202 @@ import os
 import io
 import math
 import random
-import requests
-from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageOps, ImageEnhance
+import struct
+import hashlib
+import functools
+import threading
+import importlib.util
+from PIL import Image, ImageDraw, ImageFilter, ImageOps, ImageEnhance, ImageChops, ImageStat
 import logging
 
+from caches import CACHE_DIR, DiskBytesCache
+from image_cache import image_cache
+from layer_atlas import LayerAtlas
+import text_layout
+from render_etapas import etapa
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# Intentar importar rembg y esrgan wrapper si están instalados.
-try:
-    from rembg import remove as rembg_remove
-    _HAS_REMBG = True
-except Exception:
-    _HAS_REMBG = False
-
-# Intentar importar wrapper ESRGAN si existe (esrgan_wrapper.py)
-try:
-    import esrgan_wrapper
-    _HAS_ESRGAN = True
-except Exception:
-    _HAS_ESRGAN = False
+# Dependencias pesadas opcionales (rembg arrastra onnxruntime; render_numpy,
+# NumPy; esrgan_wrapper, sus pesos): solo se comprueba si están instaladas y se
+# importan la primera vez que hacen falta, no al importar este módulo.
+_HAS_REMBG = importlib.util.find_spec("rembg") is not None
+rembg_remove = rembg_new_session = None
 
-def load_font(path_candidates, size):
-    for p in path_candidates:
+def _cargar_rembg():
+    """Importa rembg si hace falta. Devuelve False si no está disponible."""
+    global _HAS_REMBG, rembg_remove, rembg_new_session
+    if rembg_remove is None and _HAS_REMBG:
+        try:
+            from rembg import remove, new_session
+            rembg_remove, rembg_new_session = remove, new_session
+        except Exception as e:
+            logger.warning("No se pudo importar rembg: %s", e)
+            _HAS_REMBG = False
+    return _HAS_REMBG
+
+# Modelo de rembg y lado máximo (px) de la imagen que se segmenta; la máscara
+# se reescala después al tamaño original.
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+REMBG_MAX_SIDE = int(os.getenv("REMBG_MAX_SIDE", "1024"))
+CUTOUT_CACHE_MB = int(os.getenv("CUTOUT_CACHE_MB", "256"))
+
+# Recortes ya calculados, por hash de la imagen original: cada producto se
+# segmenta una sola vez mientras su imagen no cambie.
+_cutout_cache = DiskBytesCache(os.path.join(CACHE_DIR, "recortes"),
+                               max_bytes=CUTOUT_CACHE_MB * 1024 * 1024, sufijo=".png")
+_rembg_session = None
+
+# Backend de los pasos caros del render: "numpy" (vectorizado, ver render_numpy)
+# o "pil" (ruta original). Si NumPy no está disponible se usa PIL.
+_HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+render_numpy = None
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "numpy" if _HAS_NUMPY else "pil")
+
+def _usar_numpy(backend):
+    """True si se usa el backend numpy; importa render_numpy la primera vez."""
+    global _HAS_NUMPY, render_numpy
+    if (backend or RENDER_BACKEND) != "numpy" or not _HAS_NUMPY:
+        return False
+    if render_numpy is None:
         try:
-            return ImageFont.truetype(p, size)
+            import render_numpy as modulo
+            render_numpy = modulo
+        except Exception as e:
+            logger.warning("No se pudo importar render_numpy: %s", e)
+            _HAS_NUMPY = False
+    return _HAS_NUMPY
+
+# Wrapper ESRGAN opcional (esrgan_wrapper.py), solo si ENABLE_ESRGAN=1
+_HAS_ESRGAN = importlib.util.find_spec("esrgan_wrapper") is not None
+esrgan_wrapper = None
+
+def _cargar_esrgan():
+    global _HAS_ESRGAN, esrgan_wrapper
+    if esrgan_wrapper is None and _HAS_ESRGAN:
+        try:
+            import esrgan_wrapper as modulo
+            esrgan_wrapper = modulo
         except Exception:
-            continue
-    return ImageFont.load_default()
+            _HAS_ESRGAN = False
+    return _HAS_ESRGAN
+
+# Fuentes de la plantilla (Poppins recomendada)
+FONTS_BOLD = (
+    "fonts/Poppins-Bold.ttf",
+    "/usr/share/fonts/truetype/custom/Poppins-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+)
+FONTS_REGULAR = (
+    "fonts/Poppins-Regular.ttf",
+    "/usr/share/fonts/truetype/custom/Poppins-Regular.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+)
+
+# Incrementar cuando cambie el diseño de la plantilla: invalida la caché de
+# renders (render_cache) y regenera el atlas de capas
+TEMPLATE_VERSION = 4
+
+# Tamaño final (Instagram feed)
+W, H = 1080, 1080
+
+# Render a 2x para mayor nitidez y luego downscale
+SCALE = 2
+RW, RH = W*SCALE, H*SCALE
+
+# Alto de la zona inferior para texto
+INFO_H = int(RH*0.32)
+
+# La capa superior (fibras, zona de texto y CTA) solo ocupa la parte baja del
+# lienzo: se guarda recortada desde esta altura
+SUPERIOR_Y = min(int(RH*0.78) - int(RW*0.05) - 32, RH - INFO_H)
+
+# Número de fondos bokeh distintos en el atlas (se rotan según el producto)
+LAYER_ATLAS_VARIANTS = int(os.getenv("LAYER_ATLAS_VARIANTS", "6"))
+
+# (candidatas, tamaño a 1x) de cada fuente usada por crear_imagen_producto
+TEMPLATE_FONTS = {
+    "title": (FONTS_BOLD, 56),
+    "sub": (FONTS_REGULAR, 36),
+    "price": (FONTS_BOLD, 100),
+    "cta": (FONTS_BOLD, 44),
+}
+
+def load_font(path_candidates, size):
+    return text_layout.fuente(path_candidates, size)
+
+def template_font(nombre):
+    paths, size = TEMPLATE_FONTS[nombre]
+    return load_font(paths, size*SCALE)
 
-def create_warm_bokeh_background(size, inner_color=(50,30,20), outer_color=(20,10,8), bokeh_count=30):
-    """Crea un fondo cálido con degradado radial y bokeh procedimental."""
+def get_rembg_session():
+    """Sesión ONNX de rembg, creada una sola vez por proceso."""
+    global _rembg_session
+    if _rembg_session is None and _cargar_rembg():
+        try:
+            _rembg_session = rembg_new_session(REMBG_MODEL)
+        except Exception as e:
+            logger.warning("No se pudo crear la sesión de rembg: %s", e)
+    return _rembg_session
+
+def warm_up():
+    """Precarga en el proceso actual el estado costoso del render (fuentes,
+    atlas de capas y sesión de rembg con una inferencia de prueba).
+    Lo usan los workers de render_executor al arrancar."""
+    for nombre in TEMPLATE_FONTS:
+        template_font(nombre)
+    _get_atlas().preparar()
+    session = get_rembg_session()
+    if session is not None:
+        try:
+            rembg_remove(Image.new("RGB", (64, 64), (255, 255, 255)), session=session)
+        except Exception as e:
+            logger.warning("Calentamiento de rembg fallo: %s", e)
+
+def create_warm_bokeh_background(size, inner_color=(50,30,20), outer_color=(20,10,8), bokeh_count=30, rng=None, backend=None):
+    """Crea un fondo cálido con degradado radial y bokeh procedimental.
+    rng: instancia de random.Random para un resultado reproducible (opcional).
+    backend: "numpy" o "pil" (por defecto RENDER_BACKEND)."""
+    rng = rng or random
     w, h = size
     # Gradiente radial
-    base = Image.new("RGB", size, outer_color)
-    overlay = Image.new("RGBA", size, (0,0,0,0))
-    draw = ImageDraw.Draw(overlay)
     radius = math.hypot(w, h) / 1.2
     center = (int(w*0.55), int(h*0.35))
-    step = max(4, int(radius/120))
-    for i in range(int(radius), 0, -step):
-        f = i / radius
-        r = int(inner_color[0] * (1 - f) + outer_color[0] * f)
-        g = int(inner_color[1] * (1 - f) + outer_color[1] * f)
-        b = int(inner_color[2] * (1 - f) + outer_color[2] * f)
-        a = int(180 * (1 - f))
-        draw.ellipse((center[0]-i, center[1]-i, center[0]+i, center[1]+i), fill=(r,g,b,a))
-    bg = Image.alpha_composite(base.convert("RGBA"), overlay).convert("RGB")
+    if _usar_numpy(backend):
+        bg = render_numpy.radial_gradient_background(size, center, radius, inner_color, outer_color)
+    else:
+        base = Image.new("RGB", size, outer_color)
+        overlay = Image.new("RGBA", size, (0,0,0,0))
+        draw = ImageDraw.Draw(overlay)
+        step = max(4, int(radius/120))
+        for i in range(int(radius), 0, -step):
+            f = i / radius
+            r = int(inner_color[0] * (1 - f) + outer_color[0] * f)
+            g = int(inner_color[1] * (1 - f) + outer_color[1] * f)
+            b = int(inner_color[2] * (1 - f) + outer_color[2] * f)
+            a = int(180 * (1 - f))
+            draw.ellipse((center[0]-i, center[1]-i, center[0]+i, center[1]+i), fill=(r,g,b,a))
+        bg = Image.alpha_composite(base.convert("RGBA"), overlay).convert("RGB")
 
     # Añadir bokeh: círculos brillantes desenfocados
     bokeh_layer = Image.new("RGBA", size, (0,0,0,0))
     bdraw = ImageDraw.Draw(bokeh_layer)
     for i in range(bokeh_count):
-        bx = random.randint(0, w)
-        by = random.randint(0, h)
-        br = random.randint(int(w*0.02), int(w*0.10))
+        bx = rng.randint(0, w)
+        by = rng.randint(0, h)
+        br = rng.randint(int(w*0.02), int(w*0.10))
         color = (
-            random.randint(200,255),
-            random.randint(160,230),
-            random.randint(120,200),
-            random.randint(120,200)
+            rng.randint(200,255),
+            rng.randint(160,230),
+            rng.randint(120,200),
+            rng.randint(120,200)
         )
         bdraw.ellipse((bx-br, by-br, bx+br, by+br), fill=color)
-    bokeh_layer = bokeh_layer.filter(ImageFilter.GaussianBlur(radius=40))
+    if _usar_numpy(backend):
+        bokeh_layer = render_numpy.fast_gaussian_blur(bokeh_layer, 40)
+    else:
+        bokeh_layer = bokeh_layer.filter(ImageFilter.GaussianBlur(radius=40))
     bg = Image.alpha_composite(bg.convert("RGBA"), bokeh_layer).convert("RGB")
     # ligera textura de grano (ruido)
     noise = Image.effect_noise(size, 12)
@@ -84,63 +217,102 @@ def create_warm_bokeh_background(size, inner_color=(50,30,20), outer_color=(20,1
     bg = Image.blend(bg, noise, 0.05)
     return bg
 
-def add_shadow_from_alpha(fg_rgba, offset=(20,30), blur_radius=36, shadow_color=(0,0,0,150)):
-    """Genera una sombra a partir del alpha channel de fg_rgba."""
-    alpha = fg_rgba.split()[-1]
-    # Crear sombra base del tamaño del fg
-    shadow = Image.new("RGBA", fg_rgba.size, (0,0,0,0))
-    shadow_draw = ImageDraw.Draw(shadow)
-    shadow_draw.bitmap((0,0), alpha, fill=shadow_color)
-    # Desplazar y difuminar la sombra
-    shadow = shadow.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-    # Expandir canvas para offset
-    total_w = fg_rgba.width + abs(offset[0]) + 80
-    total_h = fg_rgba.height + abs(offset[1]) + 80
-    back = Image.new("RGBA", (total_w, total_h), (0,0,0,0))
-    shadow_left = 40 + max(offset[0], 0)
-    shadow_top = 40 + max(offset[1], 0)
-    back.paste(shadow, (shadow_left, shadow_top), shadow)
-    # Pegar fg en su posición correcta
-    fg_left = 40 + max(-offset[0], 0)
-    fg_top = 40 + max(-offset[1], 0)
-    back.paste(fg_rgba, (fg_left, fg_top), fg_rgba)
-    return back
+def mascara_sombra(alpha, blur_radius, opacidad, backend=None):
+    """Máscara L de la sombra: alpha escalado a `opacidad` y difuminado."""
+    if _usar_numpy(backend):
+        return render_numpy.shadow_mask_from_alpha(alpha, blur_radius, opacidad)
+    mask = alpha.point(lambda v: v * opacidad // 255)
+    return mask.filter(ImageFilter.GaussianBlur(radius=blur_radius))
+
+def pegar_con_sombra(canvas, fg_rgba, xy, offset=(20,30), blur_radius=36, shadow_color=(0,0,0,150), backend=None):
+    """Pega fg_rgba en `xy` con una sombra generada desde su alpha, desplazada
+    `offset` y difuminada. La sombra se pega como color sólido a través de su
+    máscara L, directamente sobre el lienzo."""
+    x, y = xy
+    mask = mascara_sombra(fg_rgba.getchannel("A"), blur_radius, shadow_color[3], backend=backend)
+    canvas.paste(tuple(shadow_color[:3]), (x + 40 + max(offset[0], 0), y + 40 + max(offset[1], 0)), mask)
+    canvas.paste(fg_rgba, (x + 40 + max(-offset[0], 0), y + 40 + max(-offset[1], 0)), fg_rgba)
+
+# Sesión compartida (pool de conexiones y keep-alive) para las descargas síncronas.
+# En el bot render_executor entrega todas las imágenes ya descargadas o marcadas
+# como fallidas, así que el render nunca llega aquí; esta ruta queda para los
+# usos fuera del bot (render_catalogo, bench_render) y también pasa por la caché.
+_session = None
+
+def _get_session():
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
 
 def download_image_bytes(url, timeout=15):
-    try:
-        r = requests.get(url, timeout=timeout)
-        r.raise_for_status()
-        return r.content
-    except Exception as e:
-        logger.warning("Error descargando imagen %s : %s", url, e)
-        return None
+    return image_cache.obtener_sync(url, _get_session(), timeout=timeout)
+
+def cutout_with_capped_mask(img):
+    """Elimina el fondo de img (RGBA) segmentando una copia reducida a
+    REMBG_MAX_SIDE y aplicando la máscara reescalada al original."""
+    small = img.convert("RGB")
+    if max(small.size) > REMBG_MAX_SIDE:
+        small.thumbnail((REMBG_MAX_SIDE, REMBG_MAX_SIDE), Image.Resampling.LANCZOS)
+    session = get_rembg_session()
+    mask = rembg_remove(small, session=session).getchannel("A")
+    if mask.size != img.size:
+        mask = mask.resize(img.size, Image.Resampling.BILINEAR)
+    out = img.copy()
+    out.putalpha(ImageChops.multiply(img.getchannel("A"), mask))
+    return out
 
 def remove_background_if_possible(image_bytes):
-    if not _HAS_REMBG:
+    """Devuelve los bytes PNG del producto sin fondo, o None.
+    El resultado se guarda en disco por hash de la imagen original."""
+    if not _cargar_rembg():
         return None
+    huella = f"|{REMBG_MODEL}|{REMBG_MAX_SIDE}".encode("utf-8")
+    clave = hashlib.sha256(image_bytes + huella).hexdigest()
+    cached = _cutout_cache.get(clave)
+    if cached is not None:
+        return cached
     try:
-        out_bytes = rembg_remove(image_bytes)
-        return out_bytes
+        img = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
+        bio = io.BytesIO()
+        cutout_with_capped_mask(img).save(bio, "PNG")
+        out_bytes = bio.getvalue()
     except Exception as e:
         logger.warning("rembg fallo: %s", e)
         return None
+    _cutout_cache.put(clave, out_bytes)
+    return out_bytes
 
-def prepare_product_image_from_url(url, target_box, use_rembg=True, esrgan_fallback=True):
+def prepare_product_image_from_url(url, target_box, use_rembg=True, esrgan_fallback=True, content=None):
     """Descarga, opcionalmente elimina el fondo y escala la imagen del producto para caber en target_box.
     target_box = (max_w, max_h)
+    content: bytes ya descargados de la imagen (evita la descarga); vacío
+    (image_cache.DESCARGA_FALLIDA) si ya falló: no se reintenta
     Retorna PIL.Image RGBA o None."""
-    content = download_image_bytes(url)
+    if content is None:
+        with etapa("descarga"):
+            content = download_image_bytes(url)
     if not content:
         return None
     # Opcional: intentar remover fondo
     img = None
-    if use_rembg and _HAS_REMBG:
-        try:
-            bg_removed = remove_background_if_possible(content)
-            if bg_removed:
-                img = Image.open(io.BytesIO(bg_removed)).convert("RGBA")
-        except Exception:
-            img = None
+    if use_rembg and _cargar_rembg():
+        with etapa("rembg"):
+            try:
+                bg_removed = remove_background_if_possible(content)
+                if bg_removed:
+                    img = Image.open(io.BytesIO(bg_removed)).convert("RGBA")
+            except Exception:
+                img = None
+    with etapa("escalado_producto"):
+        return _escalar_producto(img, content, target_box)
+
+def _escalar_producto(img, content, target_box):
+    """Decodifica (si no hubo recorte), aplica ESRGAN opcional y ajusta al tamaño."""
     if img is None:
         try:
             img = Image.open(io.BytesIO(content)).convert("RGBA")
@@ -148,7 +320,7 @@ def prepare_product_image_from_url(url, target_box, use_rembg=True, esrgan_fallb
             return None
 
     # Upscale opcional con ESRGAN si está activado y disponible
-    if _HAS_ESRGAN and os.getenv("ENABLE_ESRGAN", "0") == "1":
+    if os.getenv("ENABLE_ESRGAN", "0") == "1" and _cargar_esrgan():
         try:
             img = esrgan_wrapper.upscale_with_esrgan_if_available(img)
             img = img.convert("RGBA")
@@ -170,176 +342,246 @@ def prepare_product_image_from_url(url, target_box, use_rembg=True, esrgan_fallb
             img = img.resize((int(w*scale_up), int(h*scale_up)), Image.Resampling.LANCZOS)
     return img
 
-def color_grade_warm(pil_img):
+def color_grade_warm(pil_img, backend=None):
     """Aplicar un pequeño grading cálido para asemejar el estilo de la referencia."""
-    # ajustar contraste y color
-    enh = ImageEnhance.Color(pil_img)
-    pil_img = enh.enhance(1.05)
-    enh = ImageEnhance.Contrast(pil_img)
-    pil_img = enh.enhance(1.06)
-    # overlay cálido
-    overlay = Image.new("RGB", pil_img.size, (40, 18, 10))
-    return Image.blend(pil_img, overlay, 0.06)
-
-def crear_imagen_producto(prod):
+    if _usar_numpy(backend):
+        return render_numpy.color_grade_warm(pil_img)
+    # ajustar color
+    pil_img = ImageEnhance.Color(pil_img).enhance(1.05)
+    # Contraste y overlay cálido son por canal: en una sola tabla (point) en
+    # lugar de dos blend con imágenes auxiliares del tamaño del lienzo.
+    # Reproduce la aritmética de Image.blend (float, recorte y truncado).
+    mean = int(ImageStat.Stat(pil_img.convert("L")).mean[0] + 0.5)
+    tabla = []
+    for tinte in (40, 18, 10):
+        for v in range(256):
+            c = min(255, max(0, int(_blend_f32(mean, v, 1.06))))
+            tabla.append(int(_blend_f32(c, tinte, 0.06)))
+    return pil_img.point(tabla)
+
+def _blend_f32(a, b, alpha):
+    """a + alpha * (b - a) en float de 32 bits, como ImagingBlend."""
+    f32 = lambda x: struct.unpack("f", struct.pack("f", x))[0]
+    return f32(a + f32(f32(alpha) * (b - a)))
+
+def _construir_fondo(variante, backend=None):
+    """Fondo cálido con bokeh; cada variante usa su propia semilla."""
+    return create_warm_bokeh_background((RW, RH),
+                                        inner_color=(110, 70, 50),
+                                        outer_color=(28, 14, 8),
+                                        bokeh_count=45,
+                                        rng=random.Random(variante),
+                                        backend=backend)
+
+def _construir_capa_superior(backend=None):
+    """Todo lo que va encima del producto y no depende de él: fibras en primer
+    plano, zona inferior semitransparente para el texto y CTA."""
+    rng = random.Random(0)
+    # La capa cubre de SUPERIOR_Y hasta abajo; las coordenadas son del lienzo
+    # menos `y0`
+    y0 = SUPERIOR_Y
+    # Añadir pequeñas fibras/pelusas procedurales en primer plano (opcional, para la estética de referencia)
+    foreground = Image.new("RGBA", (RW, RH - y0), (0,0,0,0))
+    fdraw = ImageDraw.Draw(foreground)
+    # dibujar unas "bolitas" de lana como brush suave
+    for i in range(6):
+        fx = int(RW*(0.18 + i*0.06))
+        fy = int(RH*(0.78 + (i%2)*0.02)) - y0
+        fr = rng.randint(int(RW*0.03), int(RW*0.05))
+        fdraw.ellipse((fx-fr, fy-fr, fx+fr, fy+fr), fill=(220,220,210,200))
+    layer = foreground.filter(ImageFilter.GaussianBlur(radius=8))
+
+    # Zona inferior semitransparente para texto
+    info_box = Image.new("RGBA", (RW, INFO_H), (10,10,10,210))
+    # agregar un degradado en la parte superior de la caja para suavizar la transición
+    if _usar_numpy(backend):
+        alpha_grad = render_numpy.linear_gradient_alpha((RW, INFO_H))
+    else:
+        grad = Image.new("L", (1, INFO_H))
+        for y in range(INFO_H):
+            grad.putpixel((0,y), int(255 * (y / INFO_H)))
+        alpha_grad = grad.resize((RW, INFO_H))
+    info_box.putalpha(alpha_grad)
+    layer.alpha_composite(info_box, (0, RH - INFO_H - y0))
+
+    # CTA pequeño centrado abajo
+    draw = ImageDraw.Draw(layer)
+    cta = "¡COMPRA AHORA!"
+    draw.text((RW//2, RH - int(36*SCALE) - y0), cta, font=template_font("cta"), fill=(255,120,100), anchor="mm")
+    return layer
+
+# Capas pre-renderizadas de la plantilla (ver layer_atlas), una por backend
+_atlases = {}
+
+# Lienzos RGB reutilizados entre renders: cada render toma uno libre y copia
+# el fondo encima en vez de reservar un lienzo nuevo, y lo devuelve al terminar
+# la composición. Se guardan como mucho LIENZOS_LIBRES (en un worker de
+# render_executor hay un render a la vez; con RENDER_WORKERS=0 los renders
+# corren en varios hilos y los lienzos que sobran se liberan).
+LIENZOS_LIBRES = int(os.getenv("LIENZOS_LIBRES", "2"))
+_lienzos = []
+_lienzos_lock = threading.Lock()
+
+def _tomar_lienzo(fondo):
+    with _lienzos_lock:
+        lienzo = _lienzos.pop() if _lienzos else None
+    if lienzo is None or lienzo.size != fondo.size or lienzo.mode != fondo.mode:
+        return fondo.copy()
+    lienzo.paste(fondo)
+    return lienzo
+
+def _devolver_lienzo(lienzo):
+    with _lienzos_lock:
+        if len(_lienzos) < LIENZOS_LIBRES:
+            _lienzos.append(lienzo)
+
+def _get_atlas(backend=None):
+    backend = "numpy" if _usar_numpy(backend) else "pil"
+    atlas = _atlases.get(backend)
+    if atlas is None:
+        atlas = LayerAtlas(os.path.join(CACHE_DIR, "atlas"), f"{TEMPLATE_VERSION}-{backend}")
+        for i in range(LAYER_ATLAS_VARIANTS):
+            atlas.registrar(f"fondo_{i}", functools.partial(_construir_fondo, i, backend))
+        atlas.registrar("capa_superior", functools.partial(_construir_capa_superior, backend), fijar=True)
+        _atlases[backend] = atlas
+    return atlas
+
+def crear_imagen_producto(prod, seed=None, imagenes=None, backend=None):
     """Nueva versión que crea una composición inspirada en la referencia:
     - Producto dominante a la derecha
     - (Opcional) packaging_url detrás a la izquierda si está presente
-    - Fondo cálido con bokeh procedimental
+    - Fondo cálido con bokeh procedimental (variante del atlas de capas)
     - Sombra realista generada desde alpha
-    - Zona inferior semitransparente para nombre/descripcion/precio"""
-    # Tamaño final (Instagram feed)
-    W, H = 1080, 1080
-
-    # Render a 2x para mayor nitidez y luego downscale
-    SCALE = 2
-    RW, RH = W*SCALE, H*SCALE
-
-    # Fondo cálido con bokeh
-    bg = create_warm_bokeh_background((RW, RH),
-                                     inner_color=(110, 70, 50),
-                                     outer_color=(28, 14, 8),
-                                     bokeh_count=45)
-
-    canvas = bg.convert("RGBA")
-
-    # Cargar fuentes (Poppins recomendada)
-    fonts_bold = [
-        "fonts/Poppins-Bold.ttf",
-        "/usr/share/fonts/truetype/custom/Poppins-Bold.ttf",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
-    ]
-    fonts_regular = [
-        "fonts/Poppins-Regular.ttf",
-        "/usr/share/fonts/truetype/custom/Poppins-Regular.ttf",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
-    ]
-    font_title = load_font(fonts_bold, 56*SCALE)
-    font_sub = load_font(fonts_regular, 36*SCALE)
-    font_price_big = load_font(fonts_bold, 100*SCALE)
-    font_cta = load_font(fonts_bold, 44*SCALE)
+    - Zona inferior semitransparente para nombre/descripcion/precio
+    seed: elige de forma reproducible la variante de fondo (ver render_cache).
+    imagenes: {url: bytes} con imágenes ya descargadas (ver image_cache); las
+    URLs que faltan se descargan aquí, las que valen DESCARGA_FALLIDA no.
+    backend: "numpy" o "pil" (por defecto RENDER_BACKEND)."""
+    imagenes = imagenes or {}
+    atlas = _get_atlas(backend)
+    if seed is None:
+        seed = random.randrange(LAYER_ATLAS_VARIANTS)
+
+    # Fondo cálido con bokeh, ya renderizado en el atlas. El lienzo es RGB
+    # (el fondo es opaco): las capas se pegan con su alfa como máscara y solo
+    # sobre la región que ocupan
+    with etapa("fondo"):
+        canvas = _tomar_lienzo(atlas.capa(f"fondo_{seed % LAYER_ATLAS_VARIANTS}"))
+    try:
+        final = _componer(canvas, prod, imagenes, atlas, backend)
+    finally:
+        # color_grade_warm devuelve una imagen nueva: el lienzo ya está libre
+        _devolver_lienzo(canvas)
+    if _usar_numpy(backend):
+        with etapa("nitidez_y_reduccion"):
+            return render_numpy.sharpen_and_downscale(final, (W, H), radius=1.2, percent=120, threshold=3)
+    with etapa("unsharp"):
+        try:
+            final = final.filter(ImageFilter.UnsharpMask(radius=1.2, percent=120, threshold=3))
+        except Exception:
+            pass
+
+    # Downscale a W x H si render 2x
+    with etapa("downscale"):
+        final = final.resize((W, H), Image.Resampling.LANCZOS)
+    return final
+
+def _componer(canvas, prod, imagenes, atlas, backend):
+    """Pega packaging, producto con sombra, capa superior y textos sobre el
+    lienzo y devuelve el resultado del color grade (una imagen nueva)."""
 
     # Preparar caja de producto si hay packaging_url
     packaging_img = None
     if prod.get("packaging_url"):
-        pkg = prepare_product_image_from_url(prod["packaging_url"], target_box=(int(RW*0.36), int(RH*0.6)))
+        pkg = prepare_product_image_from_url(prod["packaging_url"], target_box=(int(RW*0.36), int(RH*0.6)),
+                                             content=imagenes.get(prod["packaging_url"]))
         if pkg:
-            # colocar packaging detrás en la izquierda (detrás del producto)
-            pkg_w, pkg_h = pkg.size
-            pkg_x = int(RW*0.08)
-            pkg_y = int(RH*0.25)
-            # aplicar ligera sombra y desenfoque al packaging para profundidad
-            pkg_bg = pkg.filter(ImageFilter.GaussianBlur(radius=6)).convert("RGBA")
-            canvas.paste(pkg_bg, (pkg_x, pkg_y), pkg_bg)
-            canvas.paste(pkg, (pkg_x, pkg_y), pkg)
+            with etapa("composicion"):
+                # colocar packaging detrás en la izquierda (detrás del producto)
+                pkg_w, pkg_h = pkg.size
+                pkg_x = int(RW*0.08)
+                pkg_y = int(RH*0.25)
+                # aplicar ligera sombra y desenfoque al packaging para profundidad
+                pkg_bg = pkg.filter(ImageFilter.GaussianBlur(radius=6))
+                canvas.paste(pkg_bg, (pkg_x, pkg_y), pkg_bg)
+                canvas.paste(pkg, (pkg_x, pkg_y), pkg)
 
     # Preparar imagen principal del producto
-    prod_img = prepare_product_image_from_url(prod.get("imagen_url",""), target_box=(int(RW*0.55), int(RH*0.75)))
+    prod_img = prepare_product_image_from_url(prod.get("imagen_url",""), target_box=(int(RW*0.55), int(RH*0.75)),
+                                              content=imagenes.get(prod.get("imagen_url","")))
     if prod_img is None:
         # fallback: un placeholder simple (círculo)
         prod_img = Image.new("RGBA", (int(RW*0.4), int(RH*0.5)), (220,220,220,255))
         d = ImageDraw.Draw(prod_img)
         d.ellipse([(0,0),(prod_img.width, prod_img.height)], fill=(190,190,190))
-    # Generar sombra desde alpha
-    prod_with_shadow = add_shadow_from_alpha(prod_img, offset=(int(22*SCALE), int(28*SCALE)), blur_radius=40, shadow_color=(0,0,0,160))
-
-    # Pegar producto (derecha)
+    # Pegar producto (derecha) con su sombra generada desde alpha
+    offset = (int(22*SCALE), int(28*SCALE))
     px = int(RW*0.58)
     py = int(RH*0.18)
     # Ajustar si la imagen con sombra es más grande que el canvas
-    if prod_with_shadow.width + px > RW:
-        px = RW - prod_with_shadow.width - int(40*SCALE)
-    canvas.paste(prod_with_shadow, (px, py), prod_with_shadow)
-
-    # Añadir pequeñas fibras/pelusas procedurales en primer plano (opcional, para la estética de referencia)
-    foreground = Image.new("RGBA", (RW, RH), (0,0,0,0))
-    fdraw = ImageDraw.Draw(foreground)
-    # dibujar unas "bolitas" de lana como brush suave
-    for i in range(6):
-        fx = int(RW*(0.18 + i*0.06))
-        fy = int(RH*(0.78 + (i%2)*0.02))
-        fr = random.randint(int(RW*0.03), int(RW*0.05))
-        fdraw.ellipse((fx-fr, fy-fr, fx+fr, fy+fr), fill=(220,220,210,200))
-    foreground = foreground.filter(ImageFilter.GaussianBlur(radius=8))
-    canvas = Image.alpha_composite(canvas, foreground)
-
-    # Zona inferior semitransparente para texto
-    info_h = int(RH*0.32)
-    info_box = Image.new("RGBA", (RW, info_h), (10,10,10,210))
-    # agregar un degradado en la parte superior de la caja para suavizar la transición
-    grad = Image.new("L", (1, info_h))
-    for y in range(info_h):
-        grad.putpixel((0,y), int(255 * (y / info_h)))
-    alpha_grad = grad.resize((RW, info_h))
-    black = Image.new("RGBA", (RW, info_h), (6,6,6,200))
-    info_box.putalpha(alpha_grad)
-    # aplicar info_box al canvas abajo
-    canvas.paste(info_box, (0, RH - info_h), info_box)
-
+    ancho_con_sombra = prod_img.width + abs(offset[0]) + 80
+    if ancho_con_sombra + px > RW:
+        px = RW - ancho_con_sombra - int(40*SCALE)
+    with etapa("sombra"):
+        pegar_con_sombra(canvas, prod_img, (px, py), offset=offset, blur_radius=40,
+                         shadow_color=(0,0,0,160), backend=backend)
+
+    with etapa("composicion"):
+        # Fibras en primer plano, zona inferior para texto y CTA (capa fija del atlas)
+        superior = atlas.capa("capa_superior")
+        canvas.paste(superior, (0, SUPERIOR_Y), superior)
+
+    with etapa("texto"):
+        _dibujar_textos(canvas, prod)
+
+    # Corrección final: color grade cálido (el unsharp lo aplica el llamador)
+    with etapa("color_grade"):
+        return color_grade_warm(canvas, backend=backend)
+
+def _dibujar_textos(canvas, prod):
+    """Precio, título y descripción en la zona inferior."""
     draw = ImageDraw.Draw(canvas)
 
-    # Escribir título grande (centrado en parte superior)
-    title = prod.get("nombre", "").upper()
-    # limitar texto a 2 líneas de tamaño responsivo
-    max_chars = 30
-    lines = []
-    if len(title) > max_chars:
-        words = title.split()
-        line = ""
-        for w in words:
-            if len(line + " " + w) <= max_chars:
-                line = (line + " " + w).strip()
-            else:
-                lines.append(line)
-                line = w
-        if line:
-            lines.append(line)
-    else:
-        lines = [title]
-
-    title_y = RH - info_h + int(28*SCALE)
-    for i, ln in enumerate(lines[:2]):
-        draw.text((int(RW*0.08), title_y + i*(48*SCALE)), ln, font=font_title, fill=(255,240,225))
-
     # Precio grande a la derecha dentro de la zona inferior (alineado con la parte baja)
     price_text = f"₡{prod.get('precio',0):,}"
     price_x = int(RW*0.87)
-    price_y = RH - int(info_h*0.55)
-    draw.text((price_x, price_y), price_text, font=font_price_big, fill=(255,210,140), anchor="rm")
-
-    # Pequeña descripción debajo del título
+    price_y = RH - int(INFO_H*0.55)
+    paths, size = TEMPLATE_FONTS["price"]
+    precio = text_layout.ajustar(price_text, paths, (int(RW*0.4), INFO_H), 1,
+                                 size*SCALE, int(size*0.6)*SCALE)
+    draw.text((price_x, price_y), precio.lineas[0], font=precio.fuente, fill=(255,210,140), anchor="rm")
+
+    # Columna de texto: desde el margen izquierdo hasta el precio, y desde el
+    # borde de la zona inferior hasta el CTA
+    text_x = int(RW*0.08)
+    text_y = RH - INFO_H + int(28*SCALE)
+    ancho_precio = int(precio.fuente.getlength(precio.lineas[0]))
+    ancho = max(int(RW*0.4), price_x - ancho_precio - int(40*SCALE) - text_x)
+    alto = RH - int(66*SCALE) - text_y
+
+    # Título en mayúsculas, hasta 2 líneas, con el mayor tamaño que quepa
+    paths, size = TEMPLATE_FONTS["title"]
+    titulo = text_layout.ajustar(prod.get("nombre", "").upper(), paths, (ancho, int(alto*0.6)), 2,
+                                 size*SCALE, 40*SCALE)
+    y = text_layout.dibujar(draw, (text_x, text_y), titulo, fill=(255,240,225))
+
+    # Pequeña descripción debajo del título, en el espacio que quede
     desc = prod.get("descripcion","")
     if desc:
-        desc_lines = []
-        max_chars_desc = 60
-        if len(desc) > max_chars_desc:
-            words = desc.split()
-            line = ""
-            for w in words:
-                if len(line + " " + w) <= max_chars_desc:
-                    line = (line + " " + w).strip()
-                else:
-                    desc_lines.append(line)
-                    line = w
-            if line:
-                desc_lines.append(line)
-        else:
-            desc_lines = [desc]
-        for i, ln in enumerate(desc_lines[:2]):
-            draw.text((int(RW*0.08), title_y + int(120*SCALE) + i*(36*SCALE)), ln, font=font_sub, fill=(230,230,230))
-
-    # CTA pequeño centrado abajo
-    cta = "¡COMPRA AHORA!"
-    draw.text((RW//2, RH - int(36*SCALE)), cta, font=font_cta, fill=(255,120,100), anchor="mm")
-
-    # Correcciones finales: color grade cálido y unsharp
-    final = canvas.convert("RGB")
-    final = color_grade_warm(final)
-    try:
-        final = final.filter(ImageFilter.UnsharpMask(radius=1.2, percent=120, threshold=3))
-    except Exception:
-        pass
-
-    # Downscale a W x H si render 2x
-    final = final.resize((W, H), Image.Resampling.LANCZOS)
-    return final
+        y += int(10*SCALE)
+        paths, size = TEMPLATE_FONTS["sub"]
+        descripcion = text_layout.ajustar(desc, paths, (ancho, text_y + alto - y), 2,
+                                          size*SCALE, 26*SCALE)
+        text_layout.dibujar(draw, (text_x, y), descripcion, fill=(230,230,230))
+
+def comparar_backends(prod, seed=0, imagenes=None, tolerancia=3.0):
+    """Renderiza prod con los backends "pil" y "numpy" y compara píxel a píxel.
+    Devuelve la diferencia media, p99 y máxima por canal, y ok=True si la media
+    no supera `tolerancia`."""
+    if not _usar_numpy("numpy"):
+        raise RuntimeError("NumPy no está disponible")
+    img_pil = crear_imagen_producto(prod, seed=seed, imagenes=imagenes, backend="pil")
+    img_np = crear_imagen_producto(prod, seed=seed, imagenes=imagenes, backend="numpy")
+    resultado = render_numpy.diferencia_imagenes(img_pil, img_np)
+    resultado["ok"] = resultado["media"] <= tolerancia
+    return resultado
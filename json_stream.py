@@ -0,0 +1,188 @@
+# json_stream.py
+# Lectura incremental de un array dentro de un documento JSON grande.
+#
+# LectorArray("productos") recibe el documento por partes (alimentar, en bytes
+# UTF-8 o en texto) y devuelve cada elemento de doc["productos"] en cuanto
+# llega completo, sin construir el documento entero ni guardar más texto que
+# el del elemento en curso. Cada elemento se decodifica con el escáner en C de
+# json (el mismo de json.loads); el resto del documento solo se recorre a
+# nivel superior y sus valores se descartan.
+#
+# Uso:
+#   lector = LectorArray("productos")
+#   for parte in partes:
+#       for elemento in lector.alimentar(parte):
+#           ...
+#   lector.terminar()   # ValueError si el documento quedó incompleto
+
+import re
+import json
+import codecs
+
+# Un elemento (o valor descartado) más grande que esto se considera inválido,
+# para no acumular el resto del documento si viene mal formado
+MAX_ELEMENTO = 4 * 1024 * 1024
+# Texto ya procesado que se tolera al principio del búfer antes de recortarlo
+_RECORTE = 64 * 1024
+
+_ESPACIOS = re.compile(r"[ \t\n\r]*").match
+_NUMERO = "0123456789+-.eE"
+
+
+class _Incompleto(Exception):
+    pass
+
+
+class LectorArray:
+    def __init__(self, clave, max_elemento=MAX_ELEMENTO):
+        self.clave = clave
+        self.max_elemento = max_elemento
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._estado = "inicio"
+        self._clave_actual = None
+        self._final = False
+        # utf-8-sig: acepta (y descarta) un BOM al principio, como response.json()
+        self._utf8 = codecs.getincrementaldecoder("utf-8-sig")()
+
+    def alimentar(self, parte):
+        """Agrega una parte del documento y devuelve la lista de elementos
+        completos nuevos."""
+        if isinstance(parte, (bytes, bytearray)):
+            parte = self._utf8.decode(parte)
+        self._buf += parte
+        elementos = []
+        try:
+            while self._paso(elementos):
+                pass
+        except _Incompleto:
+            if len(self._buf) - self._pos > self.max_elemento:
+                raise ValueError(f"Elemento JSON de más de {self.max_elemento} caracteres o mal formado")
+        if self._pos > _RECORTE:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        return elementos
+
+    def terminar(self):
+        """Procesa lo que quede; ValueError si el documento no está completo."""
+        self._final = True
+        elementos = self.alimentar(self._utf8.decode(b"", final=True))
+        if self._estado != "fin":
+            raise ValueError("JSON incompleto o mal formado")
+        return elementos
+
+    def _caracter(self):
+        """Siguiente carácter que no es espacio (sin consumirlo)."""
+        self._pos = _ESPACIOS(self._buf, self._pos).end()
+        if self._pos >= len(self._buf):
+            raise _Incompleto()
+        return self._buf[self._pos]
+
+    def _valor(self, pos):
+        """Decodifica el valor JSON que empieza en pos; devuelve (valor, fin)."""
+        buf = self._buf
+        try:
+            valor, fin = self._decoder.scan_once(buf, pos)
+        except (StopIteration, json.JSONDecodeError):
+            if self._final:
+                raise ValueError(f"JSON mal formado cerca de la posición {pos}")
+            raise _Incompleto()
+        # Un número al final del búfer ("12" o "12.") puede seguir en la
+        # próxima parte
+        if not self._final:
+            j = fin
+            while j < len(buf) and buf[j] in _NUMERO:
+                j += 1
+            if j == len(buf):
+                raise _Incompleto()
+        return valor, fin
+
+    def _array(self, elementos):
+        """Recorre el array buscado: es el grueso del documento, así que sus
+        elementos y comas se leen en un bucle propio en lugar de un _paso por
+        token."""
+        buf, scan = self._buf, self._decoder.scan_once
+        pos, estado = self._pos, self._estado
+        try:
+            while True:
+                pos = _ESPACIOS(buf, pos).end()
+                if pos >= len(buf):
+                    raise _Incompleto()
+                c = buf[pos]
+                if estado == "coma_array":
+                    if c not in ",]":
+                        raise ValueError(f"JSON inesperado: {c!r} en la posición {pos}")
+                    pos += 1
+                    if c == "]":
+                        estado = "coma_objeto"
+                        return
+                    estado = "elemento"
+                elif c == "]" and estado == "elemento_o_fin":
+                    pos += 1
+                    estado = "coma_objeto"
+                    return
+                else:
+                    # Caso común en línea; los bordes del búfer y los errores
+                    # los resuelve _valor
+                    try:
+                        valor, fin = scan(buf, pos)
+                        if fin == len(buf) or buf[fin] in _NUMERO:
+                            raise _Incompleto()
+                    except (StopIteration, json.JSONDecodeError, _Incompleto):
+                        valor, fin = self._valor(pos)
+                    elementos.append(valor)
+                    pos = fin
+                    estado = "coma_array"
+        finally:
+            self._pos, self._estado = pos, estado
+
+    def _esperar(self, esperado):
+        c = self._caracter()
+        if c not in esperado:
+            raise ValueError(f"JSON inesperado: {c!r} en la posición {self._pos}")
+        self._pos += 1
+        return c
+
+    def _paso(self, elementos):
+        """Avanza un token de nivel superior; False al terminar el documento."""
+        estado = self._estado
+        if estado == "inicio":
+            self._esperar("{")
+            self._estado = "clave_o_fin"
+        elif estado in ("clave_o_fin", "clave"):
+            if estado == "clave_o_fin" and self._caracter() == "}":
+                self._pos += 1
+                self._estado = "fin"
+                return False
+            if self._caracter() != '"':
+                self._esperar('"')
+            self._clave_actual, self._pos = self._valor(self._pos)
+            self._estado = "dos_puntos"
+        elif estado == "dos_puntos":
+            self._esperar(":")
+            self._estado = "array" if self._clave_actual == self.clave else "valor"
+        elif estado == "valor":
+            self._caracter()
+            self._pos = self._valor(self._pos)[1]
+            self._estado = "coma_objeto"
+        elif estado == "coma_objeto":
+            if self._esperar(",}") == "}":
+                self._estado = "fin"
+                return False
+            self._estado = "clave"
+        elif estado == "array":
+            if self._caracter() != "[":
+                raise ValueError(f"'{self.clave}' no es un array")
+            self._pos += 1
+            self._estado = "elemento_o_fin"
+        elif estado in ("elemento_o_fin", "elemento", "coma_array"):
+            self._array(elementos)
+        else:  # fin: solo se admiten espacios
+            try:
+                c = self._caracter()
+            except _Incompleto:
+                return False
+            raise ValueError(f"Texto después del JSON: {c!r}")
+        return True
+
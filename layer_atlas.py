@@ -0,0 +1,102 @@
+# layer_atlas.py
+# Atlas de capas pre-renderizadas de la plantilla (fondos bokeh, capas fijas).
+#
+# Cada capa se registra con un constructor; la primera vez que se pide se busca
+# en disco y, si no existe, se genera y se guarda. Los archivos viven en
+# <directorio>/v<version>/, así que al cambiar la versión de la plantilla se
+# regeneran solos. En memoria se mantienen las capas fijadas (pin) más un LRU
+# pequeño para el resto.
+#
+# Formato en disco: cabecera "modo ancho alto\n" seguida de los píxeles crudos,
+# que se cargan con Image.frombytes (mucho más rápido que decodificar un PNG).
+
+import os
+import threading
+from collections import OrderedDict
+import logging
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class LayerAtlas:
+    def __init__(self, directorio, version, max_en_memoria=2):
+        self.directorio = os.path.join(directorio, f"v{version}")
+        self.max_en_memoria = max_en_memoria
+        self._constructores = {}
+        self._fijas = {}
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._lock_construir = threading.Lock()
+
+    def registrar(self, nombre, constructor, fijar=False):
+        """constructor: función sin argumentos que devuelve una PIL.Image."""
+        self._constructores[nombre] = (constructor, fijar)
+
+    def capa(self, nombre):
+        """Devuelve la capa (no modificarla: se comparte entre renders)."""
+        with self._lock:
+            img = self._fijas.get(nombre)
+            if img is None:
+                img = self._memoria.get(nombre)
+                if img is not None:
+                    self._memoria.move_to_end(nombre)
+        if img is not None:
+            return img
+        img = self._leer(nombre)
+        if img is None:
+            # Construir de a una: si otro hilo ya la generó, se lee de disco
+            with self._lock_construir:
+                img = self._leer(nombre)
+                if img is None:
+                    constructor, _ = self._constructores[nombre]
+                    img = constructor()
+                    self._escribir(nombre, img)
+        self._recordar(nombre, img)
+        return img
+
+    def _recordar(self, nombre, img):
+        _, fijar = self._constructores[nombre]
+        with self._lock:
+            if fijar:
+                self._fijas[nombre] = img
+                return
+            self._memoria[nombre] = img
+            while len(self._memoria) > self.max_en_memoria:
+                self._memoria.popitem(last=False)
+
+    def preparar(self):
+        """Genera en disco las capas que falten y carga en memoria las fijadas."""
+        for nombre, (constructor, fijar) in self._constructores.items():
+            if fijar:
+                self.capa(nombre)
+            elif not os.path.exists(self._path(nombre)):
+                with self._lock_construir:
+                    if not os.path.exists(self._path(nombre)):
+                        self._escribir(nombre, constructor())
+
+    def _path(self, nombre):
+        return os.path.join(self.directorio, nombre + ".raw")
+
+    def _leer(self, nombre):
+        try:
+            with open(self._path(nombre), "rb") as f:
+                cabecera = f.readline().decode("ascii").split()
+                datos = f.read()
+            modo, w, h = cabecera[0], int(cabecera[1]), int(cabecera[2])
+            return Image.frombytes(modo, (w, h), datos)
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _escribir(self, nombre, img):
+        path = self._path(nombre)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(f"{img.mode} {img.width} {img.height}\n".encode("ascii"))
+                f.write(img.tobytes())
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("No se pudo guardar la capa %s : %s", path, e)
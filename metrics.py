@@ -0,0 +1,247 @@
+# metrics.py
+# Métricas de ejecución (contadores e histogramas) en formato de texto de
+# Prometheus.
+#
+# - contador(nombre, ayuda, etiquetas) / histograma(nombre, ayuda, etiquetas)
+#   registran la métrica una sola vez y devuelven el objeto para usarla.
+# - medir(histograma, **etiquetas): context manager (sync) que observa la
+#   duración en segundos; también sirve con `async with`.
+# - instrumentar(nombre, fn): envuelve un handler async de python-telegram-bot.
+# - calibre(nombre, ayuda, fn): valor instantáneo leído de fn() al exportar.
+# - registrar_cache(nombre, fn): fn() -> (aciertos, fallos) de una caché que ya
+#   lleva sus propios contadores; se exportan junto con la tasa de aciertos.
+# - exposicion(): texto para el endpoint /metrics (ver http_server.py).
+#
+# Con METRICS_SLOW_MS > 0, toda medición que supere ese tiempo se registra en
+# el log como petición lenta.
+
+import os
+import time
+import bisect
+import threading
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+METRICS_SLOW_MS = float(os.getenv("METRICS_SLOW_MS", "0"))
+
+# Buckets por defecto (segundos): de 5 ms a 1 minuto
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_metricas = {}
+_caches = {}
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def formato_etiquetas(nombres, valores, extra=""):
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    if float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+
+    def inc(self, valor=1, **etiquetas):
+        clave = tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+        with _lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def lineas(self):
+        with _lock:
+            valores = sorted(self._valores.items())
+        return [f"{self.nombre}{formato_etiquetas(self.etiquetas, clave)} {_numero(v)}"
+                for clave, v in valores]
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # etiquetas -> [conteos por bucket, suma, total]
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+        i = bisect.bisect_left(self.buckets, valor)
+        with _lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * len(self.buckets), 0.0, 0]
+            if i < len(self.buckets):
+                serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def lineas(self):
+        with _lock:
+            series = sorted((clave, (list(s[0]), s[1], s[2])) for clave, s in self._series.items())
+        salida = []
+        for clave, (conteos, suma, total) in series:
+            acumulado = 0
+            for limite, n in zip(self.buckets, conteos):
+                acumulado += n
+                le = formato_etiquetas(self.etiquetas, clave, f'le="{_numero(limite)}"')
+                salida.append(f"{self.nombre}_bucket{le} {acumulado}")
+            le = formato_etiquetas(self.etiquetas, clave, 'le="+Inf"')
+            salida.append(f"{self.nombre}_bucket{le} {total}")
+            etiquetas = formato_etiquetas(self.etiquetas, clave)
+            salida.append(f"{self.nombre}_sum{etiquetas} {_numero(suma)}")
+            salida.append(f"{self.nombre}_count{etiquetas} {total}")
+        return salida
+
+
+def _registrar(clase, nombre, ayuda, etiquetas, **kwargs):
+    with _lock:
+        metrica = _metricas.get(nombre)
+        if metrica is None:
+            metrica = _metricas[nombre] = clase(nombre, ayuda, etiquetas, **kwargs)
+        return metrica
+
+
+def contador(nombre, ayuda, etiquetas=()):
+    return _registrar(Contador, nombre, ayuda, etiquetas)
+
+
+def histograma(nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+    return _registrar(Histograma, nombre, ayuda, etiquetas, buckets=buckets)
+
+
+class Calibre:
+    tipo = "gauge"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), fn=None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.fn = fn
+
+    def lineas(self):
+        try:
+            return [f"{self.nombre} {_numero(self.fn())}"]
+        except Exception as e:
+            logger.warning("Error leyendo la métrica %s: %s", self.nombre, e)
+            return []
+
+
+def calibre(nombre, ayuda, fn):
+    return _registrar(Calibre, nombre, ayuda, (), fn=fn)
+
+
+def registrar_cache(nombre, fn):
+    """fn() -> (aciertos, fallos), evaluada en cada exportación."""
+    _caches[nombre] = fn
+
+
+def _lineas_caches():
+    valores = {}
+    for nombre, fn in list(_caches.items()):
+        try:
+            valores[nombre] = fn()
+        except Exception as e:
+            logger.warning("Error leyendo la caché %s: %s", nombre, e)
+    if not valores:
+        return []
+    lineas = [
+        "# HELP cache_aciertos_total Lecturas servidas desde la caché",
+        "# TYPE cache_aciertos_total counter",
+    ]
+    lineas += [f'cache_aciertos_total{{cache="{n}"}} {a}' for n, (a, _) in sorted(valores.items())]
+    lineas += [
+        "# HELP cache_fallos_total Lecturas que no encontraron la entrada en la caché",
+        "# TYPE cache_fallos_total counter",
+    ]
+    lineas += [f'cache_fallos_total{{cache="{n}"}} {f}' for n, (_, f) in sorted(valores.items())]
+    lineas += [
+        "# HELP cache_tasa_aciertos Aciertos / lecturas desde el arranque",
+        "# TYPE cache_tasa_aciertos gauge",
+    ]
+    lineas += [f'cache_tasa_aciertos{{cache="{n}"}} {_numero(a / (a + f) if a + f else 0)}'
+               for n, (a, f) in sorted(valores.items())]
+    return lineas
+
+
+def registrar_lento(tipo, nombre, segundos, umbral_ms=None):
+    umbral_ms = METRICS_SLOW_MS if umbral_ms is None else umbral_ms
+    if umbral_ms > 0 and segundos * 1000 >= umbral_ms:
+        logger.warning("Lento: %s %s tardó %.0f ms", tipo, nombre, segundos * 1000)
+
+
+class medir:
+    """Observa la duración del bloque en `histograma` con las etiquetas dadas.
+    Si el bloque lanza una excepción se observa con resultado="error" cuando el
+    histograma tiene esa etiqueta."""
+
+    def __init__(self, histograma, **etiquetas):
+        self.histograma = histograma
+        self.etiquetas = etiquetas
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, exc, tb):
+        segundos = time.perf_counter() - self._t0
+        etiquetas = dict(self.etiquetas)
+        if "resultado" in self.histograma.etiquetas and "resultado" not in etiquetas:
+            etiquetas["resultado"] = "error" if tipo else "ok"
+        self.histograma.observar(segundos, **etiquetas)
+        registrar_lento(self.histograma.nombre, ",".join(map(str, self.etiquetas.values())), segundos)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, tipo, exc, tb):
+        return self.__exit__(tipo, exc, tb)
+
+
+_handlers = histograma("bot_handler_segundos", "Duración de los handlers de comandos y botones",
+                       ("handler", "resultado"))
+
+
+def instrumentar(nombre, fn):
+    """Envuelve un callback async de python-telegram-bot para medirlo."""
+
+    @functools.wraps(fn)
+    async def envoltura(*args, **kwargs):
+        with medir(_handlers, handler=nombre):
+            return await fn(*args, **kwargs)
+
+    return envoltura
+
+
+def exposicion():
+    """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)."""
+    with _lock:
+        metricas = list(_metricas.values())
+    lineas = []
+    for m in metricas:
+        lineas.append(f"# HELP {m.nombre} {m.ayuda}")
+        lineas.append(f"# TYPE {m.nombre} {m.tipo}")
+        lineas.extend(m.lineas())
+    lineas.extend(_lineas_caches())
+    return "\n".join(lineas) + "\n"
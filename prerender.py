@@ -0,0 +1,157 @@
+# prerender.py
+# Pre-render en segundo plano de las tarjetas del catálogo.
+#
+# Al arrancar desde el snapshot se consideran todos los productos; después, en
+# cada actualización, solo los agregados y actualizados del feed de cambios
+# (catalog_sync). De esos se encolan los que no tienen su render en caché; la
+# comprobación (hash de render y existencia en disco por perfil) se hace en un
+# hilo, fuera del event loop. Unas pocas tareas los renderizan de a uno y,
+# antes de cada render, ceden el paso mientras haya renders interactivos
+# (pedidos por usuarios) esperando o en curso. Así la publicación diaria y la
+# mayoría de los comandos encuentran la tarjeta ya hecha.
+#
+# La cola se limita a PRERENDER_MAX tarjetas: por defecto las que caben en la
+# mitad de RENDER_CACHE_DISK_MB. Con más, en un catálogo grande el LRU de la
+# caché expulsaría los pre-renders de la propia pasada antes de usarlos.
+#
+# Configuración:
+# - PRERENDER: "0" para desactivarlo
+# - PRERENDER_CONCURRENCIA: renders de fondo a la vez (1 por defecto)
+# - PRERENDER_MAX: tarjetas por pasada como máximo
+
+import os
+import time
+import asyncio
+from collections import deque
+import logging
+
+import encoder
+from render_cache import RENDER_CACHE_DISK_MB, clave_render, render_cache
+from render_executor import render_executor
+
+logger = logging.getLogger(__name__)
+
+# Tamaño aproximado de una tarjeta en todos los perfiles (interactivo + canal)
+BYTES_POR_TARJETA = 200 * 1024
+
+PRERENDER = os.getenv("PRERENDER", "1") == "1"
+PRERENDER_CONCURRENCIA = max(1, int(os.getenv("PRERENDER_CONCURRENCIA", "1")))
+PRERENDER_MAX = int(os.getenv("PRERENDER_MAX", str(RENDER_CACHE_DISK_MB * 1024 * 1024 // 2 // BYTES_POR_TARJETA)))
+
+
+def _sin_render(candidatos, limite):
+    """Los primeros `limite` candidatos sin render en caché en algún perfil.
+    Consulta el disco: se ejecuta en un hilo."""
+    pendientes = []
+    for prod in candidatos:
+        if len(pendientes) >= limite:
+            break
+        clave = clave_render(prod)
+        if not all(render_cache.contiene(clave, perfil) for perfil in encoder.PERFILES):
+            pendientes.append(prod)
+    return pendientes
+
+
+class PrerenderPipeline:
+    def __init__(self, concurrencia=PRERENDER_CONCURRENCIA, maximo=PRERENDER_MAX):
+        self.concurrencia = concurrencia
+        self.maximo = maximo
+        self._cola = deque()
+        self._tareas = set()
+        self._preparaciones = set()
+        self._lock = None
+        self.total = 0
+        self.hechos = 0
+        self.errores = 0
+        self.inicio = None
+        self.fin = None
+
+    @property
+    def en_curso(self):
+        return bool(self._tareas or self._preparaciones)
+
+    def _get_lock(self):
+        # El lock se crea dentro del event loop que lo va a usar
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def iniciar(self, catalogo, cambios=None):
+        """Programa el pre-render de los productos del catálogo (o, si se dan
+        `cambios`, solo de los agregados y actualizados) sin render en caché.
+        No bloquea: la comprobación contra la caché corre en un hilo."""
+        if not PRERENDER:
+            return
+        if cambios is None:
+            candidatos = list(catalogo)
+        else:
+            candidatos = list(cambios.agregados) + [nuevo for _, nuevo in cambios.actualizados]
+        tarea = asyncio.get_running_loop().create_task(self._preparar(catalogo, candidatos))
+        self._preparaciones.add(tarea)
+        tarea.add_done_callback(self._preparaciones.discard)
+
+    async def _preparar(self, catalogo, candidatos):
+        # Una preparación a la vez: cada una suma sus pendientes a la cola que
+        # dejó la anterior
+        async with self._get_lock():
+            pendientes = await asyncio.to_thread(_sin_render, candidatos, self.maximo)
+            # Lo que quedaba en cola sigue si el producto todavía está en el
+            # catálogo y no llegó una versión nueva
+            revisados = {p.id for p in candidatos}
+            resto = [p for p in self._cola if p.id not in revisados and catalogo.get(p.id) is not None]
+            self._cola = deque((resto + pendientes)[:self.maximo])
+            self.total, self.hechos, self.errores = len(self._cola), 0, 0
+            self.inicio, self.fin = time.time(), None
+            if not self._cola:
+                self.fin = self.inicio
+                return
+            logger.info("Pre-render: %d tarjetas sin caché (%d productos revisados, máximo %d)",
+                        len(self._cola), len(candidatos), self.maximo)
+            while len(self._tareas) < min(self.concurrencia, len(self._cola)):
+                tarea = asyncio.get_running_loop().create_task(self._trabajar())
+                self._tareas.add(tarea)
+                tarea.add_done_callback(self._tareas.discard)
+
+    async def _trabajar(self):
+        while self._cola:
+            await render_executor.ceder()
+            if not self._cola:
+                break
+            prod = self._cola.popleft()
+            try:
+                await render_executor.obtener(prod, fondo=True)
+                self.hechos += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errores += 1
+                logger.warning("Pre-render fallo para producto %s: %s", prod.get('id'), e)
+        if len(self._tareas) <= 1 and self.fin is None:
+            self.fin = time.time()
+            logger.info("Pre-render terminado: %d renders, %d errores en %.1fs",
+                        self.hechos, self.errores, self.fin - self.inicio)
+
+    def progreso(self):
+        """Resumen de una línea para /estado."""
+        if self.inicio is None:
+            if self._preparaciones:
+                return "Revisando la cache"
+            return "Sin iniciar" if PRERENDER else "Desactivado"
+        if self.total == 0:
+            return "Todas las tarjetas en cache"
+        texto = f"{self.hechos}/{self.total} tarjetas"
+        if self.errores:
+            texto += f", {self.errores} errores"
+        if self.fin is None:
+            return texto + " (en curso)"
+        return texto + f" (completado en {self.fin - self.inicio:.0f}s)"
+
+    async def detener(self):
+        self._cola.clear()
+        tareas = list(self._preparaciones) + list(self._tareas)
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+
+prerender_pipeline = PrerenderPipeline()
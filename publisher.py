@@ -0,0 +1,341 @@
+# publisher.py
+# Publicaciones programadas en uno o varios canales.
+#
+# - Cola persistente (PUBLICAR_COLA, JSON): cada publicación pendiente guarda
+#   canal, producto, hora programada e intentos. Sobrevive reinicios, así que
+#   un reinicio no pierde publicaciones ya preparadas.
+# - Horarios por canal en PUBLICAR_CANALES, p. ej.
+#   "@canal1=09:30,18:00;-1001234567890=12:00". Si no está definida se usa
+#   CHANNEL_ID con una hora aleatoria diaria, como antes.
+# - PUBLICAR_ANTELACION_MIN minutos antes de cada horario se elige el producto
+#   (sin repetir los últimos PUBLICAR_SIN_REPETIR del canal), se encola y se
+#   pre-renderiza la tarjeta, de modo que en el horario solo queda enviarla.
+# - Límite de envío con token bucket: uno global (PUBLICAR_POR_SEGUNDO) y uno
+#   por chat (PUBLICAR_POR_CHAT_MIN mensajes por minuto).
+# - Reintentos con backoff exponencial (PUBLICAR_MAX_INTENTOS); un RetryAfter de
+#   Telegram se respeta esperando lo que indica antes de volver a intentar. Los
+#   errores permanentes (chat inexistente, bot sin permisos) no se reintentan.
+# - Con PUBLICAR_NUEVOS=1, los productos que aparecen en el catálogo (feed de
+#   catalog_sync) se anuncian en todos los canales, hasta PUBLICAR_NUEVOS_MAX
+#   por sincronización.
+
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from datetime import datetime, timedelta
+import logging
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+import encoder
+import metrics
+from caches import CACHE_DIR
+from envios import enviar_tarjeta
+from render_executor import render_executor
+
+logger = logging.getLogger(__name__)
+
+PUBLICAR_COLA = os.getenv("PUBLICAR_COLA", os.path.join(CACHE_DIR, "publicaciones.json"))
+PUBLICAR_CANALES = os.getenv("PUBLICAR_CANALES", "")
+PUBLICAR_ANTELACION_MIN = int(os.getenv("PUBLICAR_ANTELACION_MIN", "10"))
+PUBLICAR_SIN_REPETIR = int(os.getenv("PUBLICAR_SIN_REPETIR", "20"))
+PUBLICAR_POR_SEGUNDO = float(os.getenv("PUBLICAR_POR_SEGUNDO", "20"))
+PUBLICAR_POR_CHAT_MIN = float(os.getenv("PUBLICAR_POR_CHAT_MIN", "20"))
+PUBLICAR_MAX_INTENTOS = int(os.getenv("PUBLICAR_MAX_INTENTOS", "8"))
+PUBLICAR_BACKOFF_BASE = float(os.getenv("PUBLICAR_BACKOFF_BASE", "5"))
+PUBLICAR_BACKOFF_MAX = float(os.getenv("PUBLICAR_BACKOFF_MAX", "900"))
+PUBLICAR_NUEVOS = os.getenv("PUBLICAR_NUEVOS", "0") == "1"
+PUBLICAR_NUEVOS_MAX = int(os.getenv("PUBLICAR_NUEVOS_MAX", "5"))
+# Publicaciones fallidas que se conservan para consulta
+MAX_FALLIDAS = 50
+
+_publicaciones = metrics.contador("publicaciones_total", "Publicaciones en canales por resultado",
+                                  ("canal", "resultado"))
+
+
+def parsear_canales(texto):
+    """"@a=09:30,18:00;@b=12:00" -> {"@a": [(9, 30), (18, 0)], "@b": [(12, 0)]}"""
+    canales = {}
+    for parte in filter(None, (p.strip() for p in texto.split(";"))):
+        canal, _, horas = parte.rpartition("=")
+        if not canal:
+            raise ValueError(f"Horario sin canal: {parte!r}")
+        for hora in filter(None, (h.strip() for h in horas.split(","))):
+            h, _, m = hora.partition(":")
+            h, m = int(h), int(m or 0)
+            if not (0 <= h < 24 and 0 <= m < 60):
+                raise ValueError(f"Hora inválida para {canal.strip()}: {hora!r}")
+            canales.setdefault(canal.strip(), []).append((h, m))
+    return canales
+
+
+def _segundos(retry_after):
+    # python-telegram-bot usa int en v20/21 y timedelta en versiones nuevas
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class TokenBucket:
+    """`tasa` tokens por segundo con ráfagas de hasta `capacidad`."""
+
+    def __init__(self, tasa, capacidad=1):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.tokens = capacidad
+        self._t = time.monotonic()
+        self._bloqueado_hasta = 0.0
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self._t) * self.tasa)
+        self._t = ahora
+        return ahora
+
+    async def adquirir(self):
+        while True:
+            ahora = self._recargar()
+            if ahora < self._bloqueado_hasta:
+                await asyncio.sleep(self._bloqueado_hasta - ahora)
+                continue
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.tasa)
+
+    def penalizar(self, segundos):
+        """No entrega tokens durante `segundos` (tras un RetryAfter)."""
+        self._bloqueado_hasta = max(self._bloqueado_hasta, time.monotonic() + segundos)
+
+
+class Publisher:
+    def __init__(self, path=PUBLICAR_COLA):
+        self.path = path
+        self._lock = threading.Lock()
+        self.cola = []         # publicaciones pendientes
+        self.recientes = {}    # canal -> ids publicados, del más viejo al más nuevo
+        self.fallidas = []
+        self._global = TokenBucket(PUBLICAR_POR_SEGUNDO, capacidad=max(1, int(PUBLICAR_POR_SEGUNDO)))
+        self._por_chat = {}
+        self._despertar = None
+        self._tarea = None
+        self._prerenders = set()  # tareas de pre-render en curso
+        self._bot = None
+        self._obtener_catalogo = None
+        self._caption = None
+        self.canales = {}
+        self._cargar()
+
+    # --- persistencia ---
+
+    def _cargar(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.cola = data.get("cola", [])
+            self.recientes = data.get("recientes", {})
+            self.fallidas = data.get("fallidas", [])
+        except (OSError, ValueError):
+            pass
+
+    def _guardar(self):
+        tmp = f"{self.path}.tmp"
+        with self._lock:
+            data = {"cola": self.cola, "recientes": self.recientes, "fallidas": self.fallidas}
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                logger.warning("No se pudo guardar la cola de publicaciones %s : %s", self.path, e)
+
+    # --- programación ---
+
+    def iniciar(self, bot, scheduler, canales, obtener_catalogo, caption):
+        """Registra en `scheduler` (AsyncIOScheduler) la preparación de cada
+        horario y arranca el despachador.
+        canales: {canal: [(hora, minuto), ...]} (ver parsear_canales).
+        obtener_catalogo: función que devuelve el Catalog vigente.
+        caption: función producto -> texto de la publicación."""
+        self._bot = bot
+        self.canales = canales
+        self._obtener_catalogo = obtener_catalogo
+        self._caption = caption
+        for canal, horarios in canales.items():
+            for hora, minuto in horarios:
+                preparar = datetime(2000, 1, 1, hora, minuto) - timedelta(minutes=PUBLICAR_ANTELACION_MIN)
+                scheduler.add_job(self.preparar, 'cron', hour=preparar.hour, minute=preparar.minute,
+                                  args=[canal, hora, minuto], misfire_grace_time=PUBLICAR_ANTELACION_MIN * 60)
+                logger.info("Publicación en %s programada a las %02d:%02d", canal, hora, minuto)
+        self._despertar = asyncio.Event()
+        self._tarea = asyncio.get_running_loop().create_task(self._despachar())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+        for tarea in list(self._prerenders):
+            tarea.cancel()
+        await asyncio.gather(*self._prerenders, return_exceptions=True)
+
+    def _elegir(self, canal):
+        cat = self._obtener_catalogo()
+        if not cat:
+            return None
+        excluidos = set(map(str, self.recientes.get(canal, [])[-PUBLICAR_SIN_REPETIR:]))
+        excluidos |= {str(p["producto_id"]) for p in self.cola if p["canal"] == canal}
+        candidatos = [p for p in cat if str(p.id) not in excluidos]
+        return random.choice(candidatos or list(cat))
+
+    async def preparar(self, canal, hora, minuto):
+        """Elige el producto del próximo horario, lo encola y pre-renderiza la
+        tarjeta mientras llega la hora."""
+        programado = datetime.now().replace(hour=hora, minute=minuto, second=0, microsecond=0)
+        if programado < datetime.now() - timedelta(minutes=PUBLICAR_ANTELACION_MIN):
+            programado += timedelta(days=1)
+        self.encolar(canal, programado=programado.timestamp())
+
+    def encolar(self, canal, producto=None, programado=None, id_pub=None):
+        """Agrega una publicación (ahora, o a la hora `programado` en epoch).
+        id_pub: identificador para no encolar dos veces lo mismo (por defecto,
+        canal y hora)."""
+        programado = time.time() if programado is None else programado
+        id_pub = id_pub or f"{canal}|{int(programado)}"
+        if any(p["id"] == id_pub for p in self.cola):
+            return None
+        producto = producto or self._elegir(canal)
+        if producto is None:
+            logger.warning("No hay productos para publicar en %s", canal)
+            return None
+        item = {"id": id_pub, "canal": canal, "producto_id": producto.id, "programado": programado,
+                "intentos": 0, "proximo_intento": programado}
+        self.cola.append(item)
+        self._guardar()
+        logger.info("Publicación encolada en %s: %s para %s", canal, producto.nombre,
+                    datetime.fromtimestamp(programado).strftime("%Y-%m-%d %H:%M"))
+        tarea = asyncio.get_running_loop().create_task(
+            render_executor.obtener(producto, perfil=encoder.PERFIL_CANAL, fondo=True))
+        self._prerenders.add(tarea)
+        tarea.add_done_callback(lambda t, p=producto: self._prerender_terminado(t, p))
+        if self._despertar is not None:
+            self._despertar.set()
+        return item
+
+    def _prerender_terminado(self, tarea, producto):
+        self._prerenders.discard(tarea)
+        if not tarea.cancelled() and tarea.exception() is not None:
+            # El envío vuelve a intentar el render; solo se registra
+            logger.warning("Error pre-renderizando %s para el canal: %s", producto.id, tarea.exception())
+
+    def anunciar_nuevos(self, cambios, catalogo):
+        """Suscriptor del feed de catalog_sync: encola los productos nuevos.
+        La primera carga (sin catálogo anterior) no anuncia nada."""
+        if not PUBLICAR_NUEVOS or not cambios.total_anterior or self._despertar is None:
+            return
+        for producto in cambios.agregados[:PUBLICAR_NUEVOS_MAX]:
+            for canal in self.canales:
+                self.encolar(canal, producto, id_pub=f"{canal}|nuevo|{producto.id}")
+
+    # --- envío ---
+
+    def _bucket_chat(self, canal):
+        bucket = self._por_chat.get(canal)
+        if bucket is None:
+            bucket = self._por_chat[canal] = TokenBucket(PUBLICAR_POR_CHAT_MIN / 60, capacidad=1)
+        return bucket
+
+    async def _despachar(self):
+        en_curso = {}
+        while True:
+            ahora = time.time()
+            for item in list(self.cola):
+                if item["proximo_intento"] <= ahora and item["canal"] not in en_curso:
+                    tarea = asyncio.get_running_loop().create_task(self._enviar(item))
+                    en_curso[item["canal"]] = tarea
+                    tarea.add_done_callback(lambda _, c=item["canal"]: (en_curso.pop(c, None), self._despertar.set()))
+            proximos = [p["proximo_intento"] for p in self.cola if p["canal"] not in en_curso]
+            espera = min([60.0] + [max(0.0, t - time.time()) for t in proximos])
+            self._despertar.clear()
+            try:
+                await asyncio.wait_for(self._despertar.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+
+    def _quitar(self, item):
+        self.cola = [p for p in self.cola if p["id"] != item["id"]]
+
+    async def _enviar(self, item):
+        canal = item["canal"]
+        cat = self._obtener_catalogo()
+        producto = cat.get(item["producto_id"]) if cat else None
+        if producto is None:
+            # El producto ya no está en el catálogo: elegir otro
+            producto = self._elegir(canal)
+            if producto is None:
+                self._reintentar(item, "catálogo vacío")
+                return
+            item["producto_id"] = producto.id
+
+        await self._global.adquirir()
+        await self._bucket_chat(canal).adquirir()
+        item["intentos"] += 1
+        try:
+            await enviar_tarjeta(self._bot, canal, producto, self._caption(producto), perfil=encoder.PERFIL_CANAL)
+        except RetryAfter as e:
+            espera = _segundos(e.retry_after)
+            logger.warning("Control de flood en %s: reintento en %.0fs", canal, espera)
+            self._bucket_chat(canal).penalizar(espera)
+            item["intentos"] -= 1  # no cuenta como fallo
+            item["proximo_intento"] = time.time() + espera
+            _publicaciones.inc(canal=canal, resultado="retry_after")
+            self._guardar()
+            return
+        except (BadRequest, Forbidden) as e:
+            self._fallar(item, str(e))
+            return
+        except Exception as e:
+            self._reintentar(item, str(e))
+            return
+
+        self._quitar(item)
+        recientes = self.recientes.setdefault(canal, [])
+        recientes.append(producto.id)
+        del recientes[:-max(PUBLICAR_SIN_REPETIR, 1)]
+        _publicaciones.inc(canal=canal, resultado="ok")
+        self._guardar()
+        logger.info("Publicado en %s: %s", canal, producto.nombre)
+
+    def _reintentar(self, item, error):
+        if item["intentos"] >= PUBLICAR_MAX_INTENTOS:
+            self._fallar(item, error)
+            return
+        espera = min(PUBLICAR_BACKOFF_MAX, PUBLICAR_BACKOFF_BASE * 2 ** item["intentos"])
+        espera *= random.uniform(0.8, 1.2)
+        item["proximo_intento"] = time.time() + espera
+        item["ultimo_error"] = error
+        _publicaciones.inc(canal=item["canal"], resultado="reintento")
+        self._guardar()
+        logger.warning("Publicación en %s falló (%s), intento %d, reintento en %.0fs",
+                       item["canal"], error, item["intentos"], espera)
+
+    def _fallar(self, item, error):
+        self._quitar(item)
+        self.fallidas.append(dict(item, error=error, fecha=time.time()))
+        del self.fallidas[:-MAX_FALLIDAS]
+        _publicaciones.inc(canal=item["canal"], resultado="fallida")
+        self._guardar()
+        logger.error("Publicación en %s descartada tras %d intentos: %s", item["canal"], item["intentos"], error)
+
+    def resumen(self):
+        """Texto de una línea para /estado."""
+        if not self.cola:
+            return f"sin pendientes ({len(self.fallidas)} fallidas)" if self.fallidas else "sin pendientes"
+        proxima = min(p["proximo_intento"] for p in self.cola)
+        return (f"{len(self.cola)} pendientes, proxima {datetime.fromtimestamp(proxima).strftime('%d/%m %H:%M')}"
+                + (f", {len(self.fallidas)} fallidas" if self.fallidas else ""))
+
+
+publisher = Publisher()
@@ -0,0 +1,120 @@
+# render_cache.py
+# Caché de imágenes de producto ya renderizadas y codificadas.
+#
+# La clave es un hash de los campos del producto que afectan al render
+# (nombre, precio, descripcion, imagen_url, packaging_url) más la versión de la
+# plantilla. De la clave se deriva una semilla determinista para el RNG del
+# render, de modo que el mismo producto siempre produce la misma imagen.
+#
+# Cada render se guarda ya codificado en los perfiles de encoder.py que se
+# pidieron, uno junto a otro bajo la misma clave. Los renders interactivos solo
+# codifican el perfil que se va a enviar; los de fondo (pre-render, canal)
+# codifican todos.
+#
+# Dos niveles: LRU en memoria (RENDER_CACHE_MEM_MB) y disco (RENDER_CACHE_DISK_MB)
+# que sobrevive reinicios.
+
+import os
+import json
+import hashlib
+
+import encoder
+from caches import CACHE_DIR, LRUBytesCache, DiskBytesCache
+from image_utils import TEMPLATE_VERSION, crear_imagen_producto
+from render_etapas import etapa, medir
+import metrics
+
+CAMPOS_RENDER = ("nombre", "precio", "descripcion", "imagen_url", "packaging_url")
+
+RENDER_CACHE_MEM_MB = int(os.getenv("RENDER_CACHE_MEM_MB", "64"))
+RENDER_CACHE_DISK_MB = int(os.getenv("RENDER_CACHE_DISK_MB", "512"))
+
+
+def clave_render(prod):
+    """Hash estable de los campos del producto que influyen en la imagen."""
+    datos = [TEMPLATE_VERSION] + [prod.get(campo) for campo in CAMPOS_RENDER]
+    crudo = json.dumps(datos, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(crudo.encode("utf-8")).hexdigest()
+
+
+def semilla_render(clave):
+    """Semilla determinista para el RNG del render derivada de la clave."""
+    return int(clave[:16], 16)
+
+
+class RenderCache:
+    def __init__(self, directorio, mem_bytes, disk_bytes):
+        self.memoria = LRUBytesCache(mem_bytes)
+        self.disco = DiskBytesCache(directorio, max_bytes=disk_bytes, sufijo=".bin")
+
+    @staticmethod
+    def _clave(clave, perfil):
+        return f"{clave}-{encoder.huella(perfil)}"
+
+    def get(self, clave, perfil=encoder.PERFIL_INTERACTIVO):
+        clave = self._clave(clave, perfil)
+        data = self.memoria.get(clave)
+        if data is not None:
+            return data
+        data = self.disco.get(clave)
+        if data is not None:
+            self.memoria.put(clave, data)
+        return data
+
+    def put(self, clave, perfil, data, memoria=True):
+        clave = self._clave(clave, perfil)
+        if memoria:
+            self.memoria.put(clave, data)
+        self.disco.put(clave, data)
+
+    def put_perfiles(self, clave, codificadas, memoria=True):
+        """Guarda {perfil: bytes} de un mismo render. memoria=False lo deja
+        solo en disco (procesos por lotes que no vuelven a leerlo)."""
+        for perfil, data in codificadas.items():
+            self.put(clave, perfil, data, memoria=memoria)
+
+    def descartar(self, clave):
+        """Borra el render en todos los perfiles (memoria y disco)."""
+        for perfil in encoder.PERFILES:
+            self.memoria.discard(self._clave(clave, perfil))
+            self.disco.discard(self._clave(clave, perfil))
+
+    def contiene(self, clave, perfil=encoder.PERFIL_INTERACTIVO):
+        clave = self._clave(clave, perfil)
+        return clave in self.memoria or clave in self.disco
+
+    def __contains__(self, clave):
+        return self.contiene(clave)
+
+
+render_cache = RenderCache(
+    os.path.join(CACHE_DIR, "render"),
+    RENDER_CACHE_MEM_MB * 1024 * 1024,
+    RENDER_CACHE_DISK_MB * 1024 * 1024,
+)
+metrics.registrar_cache("render_memoria", lambda: (render_cache.memoria.hits, render_cache.memoria.misses))
+metrics.registrar_cache("render_disco", lambda: (render_cache.disco.hits, render_cache.disco.misses))
+
+
+def urls_imagenes(prod):
+    """URLs de imagen que necesita el render del producto."""
+    return [u for u in (prod.get("imagen_url"), prod.get("packaging_url")) if u]
+
+
+def renderizar_producto(prod, clave=None, imagenes=None, perfiles=None):
+    """Renderiza la tarjeta sin consultar la caché y la codifica en `perfiles`
+    (todos por defecto): {perfil: bytes}. Es la función que ejecutan los
+    workers de render_executor."""
+    clave = clave or clave_render(prod)
+    img = crear_imagen_producto(prod, seed=semilla_render(clave), imagenes=imagenes)
+    with etapa("codificacion"):
+        return encoder.codificar_perfiles(img, perfiles)
+
+
+def renderizar_producto_medido(prod, clave=None, imagenes=None, perfiles=None):
+    """Como renderizar_producto, pero devuelve también los tiempos por etapa
+    (ver render_etapas) para que el proceso principal los exporte."""
+    with medir() as tiempos:
+        codificadas = renderizar_producto(prod, clave, imagenes, perfiles)
+    return codificadas, tiempos
+
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# render_catalogo.py
+# Render por lotes del catálogo a archivos (para Instagram y el sitio web).
+#
+# Renderiza todo el catálogo, o un subconjunto filtrado, en un directorio de
+# salida usando un pool de procesos con todos los núcleos. Reutiliza las mismas
+# cachés que el bot (imágenes descargadas, recortes de rembg y renders), así
+# que lo que ya se renderizó para Telegram no se vuelve a calcular.
+#
+# En el directorio de salida se escribe manifest.jsonl, una línea por producto
+# terminado, a medida que terminan. Al volver a ejecutarlo se saltan los
+# productos cuyo archivo existe y cuyo hash de render coincide con el del
+# manifest: sirve tanto para reanudar tras una interrupción como para
+# regenerar solo lo que cambió.
+#
+# Uso:
+#   python render_catalogo.py --salida tarjetas
+#   python render_catalogo.py --categoria ropa --buscar bufanda --perfil canal interactivo
+#   python render_catalogo.py --fuente productos.json --workers 8
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import encoder
+from caches import CACHE_DIR
+from catalog import Catalog
+
+WEBSITE_URL = os.getenv("WEBSITE_URL", "https://www.nexushcr.com")
+MANIFEST = "manifest.jsonl"
+
+
+def cargar_catalogo(fuente, snapshot):
+    """Catálogo desde un productos.json local, una URL o el snapshot del bot."""
+    if fuente is None and snapshot and os.path.exists(snapshot):
+        cat = Catalog.cargar_snapshot(snapshot)
+        if cat:
+            print(f"{len(cat)} productos desde el snapshot {snapshot}")
+            return cat
+    fuente = fuente or WEBSITE_URL + "/productos.json"
+    import catalog_sync
+    if fuente.startswith("http"):
+        import http_client
+
+        async def descargar():
+            try:
+                return await catalog_sync.descargar_productos(fuente, base_url=WEBSITE_URL, timeout=30)
+            finally:
+                await http_client.cerrar()
+
+        productos = asyncio.run(descargar())[0]
+    else:
+        with open(fuente, "rb") as f:
+            partes = iter(lambda: f.read(256 * 1024), b"")
+            productos = list(catalog_sync.leer_productos(partes, WEBSITE_URL))
+    print(f"{len(productos)} productos desde {fuente}")
+    return Catalog.desde_productos(productos)
+
+
+def filtrar(cat, args):
+    prods = cat.buscar(args.buscar) if args.buscar else list(cat)
+    if args.categoria:
+        categorias = {c.lower() for c in args.categoria}
+        prods = [p for p in prods if (p.categoria or "").lower() in categorias]
+    if args.ids:
+        ids = {str(i) for i in args.ids}
+        prods = [p for p in prods if str(p.id) in ids]
+    if args.precio_min is not None or args.precio_max is not None:
+        en_rango = {id(p) for p in cat.en_rango_precio(args.precio_min, args.precio_max)}
+        prods = [p for p in prods if id(p) in en_rango]
+    if args.limite:
+        prods = prods[:args.limite]
+    return prods
+
+
+def nombre_archivo(prod, perfil):
+    return f"producto_{prod['id']}_{perfil}.{encoder.extension(perfil)}"
+
+
+def leer_manifest(path):
+    """{id: entrada} con la última entrada correcta de cada producto."""
+    hechos = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    entrada = json.loads(linea)
+                except ValueError:
+                    continue  # línea cortada por una interrupción
+                if entrada.get("estado") == "ok":
+                    hechos[str(entrada["id"])] = entrada
+    except FileNotFoundError:
+        pass
+    return hechos
+
+
+def al_dia(entrada, clave, perfiles, salida):
+    if not entrada or entrada.get("clave") != clave:
+        return False
+    archivos = entrada.get("archivos", {})
+    return all(p in archivos and os.path.exists(os.path.join(salida, archivos[p])) for p in perfiles)
+
+
+def _escribir(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def renderizar_a_disco(prod, clave, perfiles, salida):
+    """Trabajo de cada worker: toma el render de la caché o lo genera, y
+    escribe un archivo por perfil. Devuelve la entrada del manifest."""
+    from render_cache import render_cache, renderizar_producto
+
+    t0 = time.perf_counter()
+    datos = {p: render_cache.get(clave, p) for p in perfiles}
+    renderizado = any(d is None for d in datos.values())
+    if renderizado:
+        codificadas = renderizar_producto(prod, clave)
+        render_cache.put_perfiles(clave, codificadas, memoria=False)
+        datos = {p: codificadas[p] for p in perfiles}
+    archivos = {}
+    for perfil, data in datos.items():
+        archivos[perfil] = nombre_archivo(prod, perfil)
+        _escribir(os.path.join(salida, archivos[perfil]), data)
+    return {
+        "id": prod["id"],
+        "nombre": prod["nombre"],
+        "clave": clave,
+        "archivos": archivos,
+        "renderizado": renderizado,
+        "segundos": round(time.perf_counter() - t0, 3),
+        "estado": "ok",
+    }
+
+
+def _init_worker():
+    import image_utils
+    image_utils.warm_up()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Renderiza las tarjetas del catálogo a archivos")
+    parser.add_argument("--salida", default="tarjetas", help="directorio de salida (default tarjetas)")
+    parser.add_argument("--fuente", help="productos.json local o URL (default: snapshot del bot o el sitio)")
+    parser.add_argument("--snapshot", default=os.getenv("CATALOG_SNAPSHOT", os.path.join(CACHE_DIR, "catalogo.json.gz")),
+                        help="snapshot del catálogo guardado por el bot")
+    parser.add_argument("--perfil", nargs="+", default=[encoder.PERFIL_CANAL], choices=sorted(encoder.PERFILES),
+                        help="perfiles de codificación (default canal)")
+    parser.add_argument("--categoria", nargs="+", help="solo estas categorías")
+    parser.add_argument("--ids", nargs="+", help="solo estos ids de producto")
+    parser.add_argument("--buscar", help="solo los productos que coinciden con el texto")
+    parser.add_argument("--precio-min", type=float)
+    parser.add_argument("--precio-max", type=float)
+    parser.add_argument("--limite", type=int, help="como máximo N productos")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--forzar", action="store_true", help="renderizar aunque estén al día")
+    args = parser.parse_args(argv)
+
+    from render_cache import clave_render
+
+    prods = filtrar(cargar_catalogo(args.fuente, args.snapshot), args)
+    os.makedirs(args.salida, exist_ok=True)
+    manifest_path = os.path.join(args.salida, MANIFEST)
+    hechos = {} if args.forzar else leer_manifest(manifest_path)
+
+    pendientes = []
+    for prod in prods:
+        clave = clave_render(prod)
+        if not al_dia(hechos.get(str(prod.id)), clave, args.perfil, args.salida):
+            pendientes.append((prod, clave))
+    print(f"{len(prods)} productos seleccionados, {len(prods) - len(pendientes)} al día, "
+          f"{len(pendientes)} por renderizar con {args.workers} workers")
+    if not pendientes:
+        return 0
+
+    t0 = time.perf_counter()
+    ok = errores = renderizados = 0
+    with open(manifest_path, "a", encoding="utf-8") as manifest, ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    ) as pool:
+        futuros = {
+            pool.submit(renderizar_a_disco, prod.to_dict(), clave, args.perfil, args.salida): prod
+            for prod, clave in pendientes
+        }
+        try:
+            for n, futuro in enumerate(as_completed(futuros), start=1):
+                prod = futuros[futuro]
+                try:
+                    entrada = futuro.result()
+                    ok += 1
+                    renderizados += entrada["renderizado"]
+                except Exception as e:
+                    entrada = {"id": prod.id, "nombre": prod.nombre, "estado": "error", "error": str(e)}
+                    errores += 1
+                manifest.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+                manifest.flush()
+                estado = f"{entrada['segundos']:.1f}s" if entrada["estado"] == "ok" else f"ERROR {entrada['error']}"
+                print(f"[{n}/{len(pendientes)}] {prod.id} {prod.nombre} - {estado}")
+        except KeyboardInterrupt:
+            print("Interrumpido: el manifest guarda lo terminado, vuelve a ejecutar para reanudar")
+            pool.shutdown(wait=False, cancel_futures=True)
+            return 130
+
+    total = time.perf_counter() - t0
+    print(f"Listo en {total:.1f}s: {ok} ok ({renderizados} renderizados, {ok - renderizados} desde caché), "
+          f"{errores} errores, {ok / total if total else 0:.1f} productos/s")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
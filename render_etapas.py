@@ -0,0 +1,146 @@
+# render_etapas.py
+# Medición por etapas del render (fondo, descarga, rembg, sombra, texto...).
+#
+# crear_imagen_producto marca sus pasos con `with etapa("nombre"):`. Fuera de
+# un bloque `with medir() as tiempos:` las marcas no hacen nada más que leer un
+# thread-local, así que pueden quedarse en el camino caliente. Dentro, cada
+# etapa acumula en `tiempos` su tiempo de pared, su tiempo de CPU del hilo, el
+# pico de memoria residente del proceso al terminarla y el pico de memoria
+# reservada durante la etapa por encima de la que había al empezar medir()
+# ("mem_pico_mb": búferes de imagen de PIL y NumPy, que salen de malloc).
+#
+# La memoria solo se mide con medir(memoria=True) (tools/bench_render.py) o
+# si MUESTREO_MEMORIA_MS > 0 (para la métrica render_memoria_pico_mb en
+# producción); si no, mem_pico_mb queda en None y las etapas no leen memoria.
+# Se lee de mallinfo2 (glibc) y se muestrea cada MUESTREO_MEMORIA_MS (2 ms con
+# medir(memoria=True)) desde un hilo mientras haya etapas abiertas; en otras
+# plataformas mem_pico_mb queda en None. Es memoria de todo el proceso: con
+# varios renders en hilos del mismo proceso se mezclan.
+#
+# Lo usan tools/bench_render.py y las métricas de render.
+
+import os
+import time
+import ctypes
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MUESTREO_MEMORIA_MS = float(os.getenv("MUESTREO_MEMORIA_MS", "0"))
+_MUESTREO_POR_DEFECTO_MS = 2
+
+_local = threading.local()
+
+
+class _Mallinfo2(ctypes.Structure):
+    _fields_ = [(campo, ctypes.c_size_t) for campo in
+                ("arena", "ordblks", "smblks", "hblks", "hblkhd", "usmblks",
+                 "fsmblks", "uordblks", "fordblks", "keepcost")]
+
+
+def _cargar_mallinfo2():
+    try:
+        fn = ctypes.CDLL(None).mallinfo2
+    except (OSError, AttributeError):  # no es glibc o es anterior a 2.33
+        return None
+    fn.restype = _Mallinfo2
+    return fn
+
+
+_mallinfo2 = _cargar_mallinfo2()
+
+
+def memoria_reservada_mb():
+    """Memoria reservada con malloc y todavía en uso (MB), o None."""
+    if _mallinfo2 is None:
+        return None
+    info = _mallinfo2()
+    return (info.uordblks + info.hblkhd) / (1024 * 1024)
+
+
+# Picos de las etapas abiertas (en cualquier hilo), actualizados por el muestreador
+_abiertas = {}
+_abiertas_lock = threading.Lock()
+_hay_abiertas = threading.Event()
+_muestreador = None
+
+
+def _muestrear():
+    intervalo = (MUESTREO_MEMORIA_MS or _MUESTREO_POR_DEFECTO_MS) / 1000
+    while True:
+        _hay_abiertas.wait()
+        valor = memoria_reservada_mb()
+        with _abiertas_lock:
+            for pico in _abiertas.values():
+                if valor > pico[0]:
+                    pico[0] = valor
+        time.sleep(intervalo)
+
+
+def _iniciar_muestreador():
+    global _muestreador
+    if _muestreador is None and _mallinfo2 is not None:
+        _muestreador = threading.Thread(target=_muestrear, name="render-memoria", daemon=True)
+        _muestreador.start()
+
+
+def rss_pico_mb():
+    """Pico de memoria residente del proceso (MB), o None si no se puede leer."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextlib.contextmanager
+def medir(memoria=None):
+    """Activa la medición en este hilo. Produce un dict
+    {etapa: {"wall": s, "cpu": s, "n": veces, "rss_pico_mb": MB, "mem_pico_mb": MB}}.
+    memoria: medir también la memoria reservada (por defecto, si
+    MUESTREO_MEMORIA_MS > 0)."""
+    if memoria is None:
+        memoria = MUESTREO_MEMORIA_MS > 0
+    if memoria:
+        _iniciar_muestreador()
+    anterior = getattr(_local, "tiempos", None), getattr(_local, "base_mb", None)
+    tiempos = _local.tiempos = {}
+    # base_mb en None desactiva la medición de memoria de las etapas
+    _local.base_mb = memoria_reservada_mb() if memoria else None
+    try:
+        yield tiempos
+    finally:
+        _local.tiempos, _local.base_mb = anterior
+
+
+@contextlib.contextmanager
+def etapa(nombre):
+    tiempos = getattr(_local, "tiempos", None)
+    if tiempos is None:
+        yield
+        return
+    pico = [memoria_reservada_mb() if _local.base_mb is not None else None]
+    if pico[0] is not None:
+        with _abiertas_lock:
+            _abiertas[id(pico)] = pico
+            _hay_abiertas.set()
+    w0, c0 = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - w0, time.thread_time() - c0
+        dato = tiempos.setdefault(nombre, {"wall": 0.0, "cpu": 0.0, "n": 0, "rss_pico_mb": None,
+                                           "mem_pico_mb": None})
+        if pico[0] is not None:
+            with _abiertas_lock:
+                del _abiertas[id(pico)]
+                if not _abiertas:
+                    _hay_abiertas.clear()
+            maximo = max(pico[0], memoria_reservada_mb()) - _local.base_mb
+            dato["mem_pico_mb"] = max(dato["mem_pico_mb"] or 0.0, maximo)
+        dato["wall"] += wall
+        dato["cpu"] += cpu
+        dato["n"] += 1
+        dato["rss_pico_mb"] = rss_pico_mb()
@@ -0,0 +1,209 @@
+# render_executor.py
+# Ejecuta crear_imagen_producto fuera del event loop, en un pool de procesos.
+#
+# Configuración:
+# - RENDER_WORKERS: número de procesos (0 = usar un hilo en el proceso actual)
+# - RENDER_QUEUE_MAX: renders admitidos a la vez (en curso + en cola). Al
+#   llegar al límite, los handlers esperan turno en vez de acumular trabajo.
+# - RENDER_MP_CONTEXT: método de arranque de multiprocessing (spawn por defecto,
+#   más seguro que fork con los hilos de python-telegram-bot)
+#
+# Cada worker precarga fuentes y la sesión de rembg en su initializer, de modo
+# que solo el primer render de cada proceso paga ese coste.
+
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+
+import encoder
+import metrics
+from image_cache import descargar_imagenes
+from render_cache import clave_render, render_cache, renderizar_producto_medido, urls_imagenes
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+RENDER_QUEUE_MAX = int(os.getenv("RENDER_QUEUE_MAX", "16"))
+RENDER_MP_CONTEXT = os.getenv("RENDER_MP_CONTEXT", "spawn")
+# Espera entre comprobaciones de los renders de fondo mientras hay trabajo interactivo
+_ESPERA_CEDER = 0.2
+
+
+_renders = metrics.histograma("render_segundos", "Renders de tarjetas, desde el pedido hasta los bytes codificados",
+                              ("modo", "resultado"))
+_cola = metrics.histograma("render_cola_segundos", "Espera por un lugar en el pool de render")
+_etapas = metrics.histograma("render_etapa_segundos", "Tiempo de pared de cada etapa del render (en el worker)",
+                             ("etapa",))
+_etapas_cpu = metrics.contador("render_etapa_cpu_segundos_total", "Tiempo de CPU de cada etapa del render",
+                               ("etapa",))
+_memoria = metrics.histograma("render_memoria_pico_mb",
+                              "Pico de memoria reservada por render (búferes de imagen), en MB; solo con MUESTREO_MEMORIA_MS > 0",
+                              buckets=(8, 16, 32, 64, 96, 128, 192, 256, 384, 512, 1024))
+
+
+def _sin_render(prods):
+    """Productos cuyo render no está en caché (consulta el disco: va en un hilo)."""
+    return [prod for prod in prods if clave_render(prod) not in render_cache]
+
+
+def _init_worker():
+    import image_utils
+    image_utils.warm_up()
+
+
+class RenderExecutor:
+    def __init__(self, workers=RENDER_WORKERS, max_pendientes=RENDER_QUEUE_MAX):
+        self.workers = workers
+        self.max_pendientes = max_pendientes
+        self._pool = None
+        self._cupo = None
+        self.pendientes = 0
+        # Renders pedidos por usuarios (no de fondo) esperando o en curso
+        self.interactivos = 0
+        # Pedidos simultáneos del mismo render comparten una sola ejecución
+        self._vuelos = SingleFlight("render")
+
+    def _get_pool(self):
+        if self.workers <= 0:
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(RENDER_MP_CONTEXT),
+                initializer=_init_worker,
+            )
+        return self._pool
+
+    def _get_cupo(self):
+        # El semáforo se crea dentro del event loop que lo va a usar
+        if self._cupo is None:
+            self._cupo = asyncio.Semaphore(self.max_pendientes)
+        return self._cupo
+
+    async def precargar_imagenes(self, prods):
+        """Descarga en paralelo las imágenes de los productos cuyo render no
+        está en caché. Devuelve {url: bytes} para pasar a obtener()."""
+        urls = []
+        for prod in await asyncio.to_thread(_sin_render, prods):
+            urls.extend(urls_imagenes(prod))
+        return await descargar_imagenes(urls)
+
+    async def obtener(self, prod, imagenes=None, perfil=encoder.PERFIL_INTERACTIVO, fondo=False):
+        """Devuelve los bytes de la tarjeta del producto codificada con `perfil`
+        (ver encoder); usa la caché y, si no está, renderiza en el pool sin
+        bloquear el event loop. El nivel de disco de la caché se consulta y
+        escribe en un hilo.
+        imagenes: {url: bytes} ya descargadas o intentadas (ver precargar_imagenes).
+        fondo: render de baja prioridad (ver prerender.py); no cuenta en
+        `interactivos` y codifica todos los perfiles. Los interactivos solo
+        codifican `perfil`, para no hacer esperar al usuario por los demás."""
+        clave = clave_render(prod)
+        data = await asyncio.to_thread(render_cache.get, clave, perfil)
+        if data is not None:
+            return data
+        if fondo:
+            codificadas = await self._vuelos.hacer(clave, self._renderizar, prod, clave, imagenes, "fondo", None)
+            return codificadas[perfil]
+        self.interactivos += 1
+        try:
+            codificadas = await self._vuelos.hacer(f"{clave}-{perfil}", self._renderizar, prod, clave, imagenes,
+                                                   "interactivo", (perfil,))
+            return codificadas[perfil]
+        finally:
+            self.interactivos -= 1
+
+    async def _renderizar(self, prod, clave, imagenes, modo, perfiles):
+        with metrics.medir(_renders, modo=modo):
+            return await self._renderizar_medido(prod, clave, imagenes, perfiles)
+
+    async def _renderizar_medido(self, prod, clave, imagenes, perfiles):
+        """Renderiza y codifica `perfiles` (None: todos); devuelve {perfil: bytes}."""
+        imagenes = imagenes or {}
+        faltantes = [u for u in urls_imagenes(prod) if u not in imagenes]
+        if faltantes:
+            imagenes = {**imagenes, **await descargar_imagenes(faltantes)}
+        # Todas las URLs van al worker, también las fallidas (DESCARGA_FALLIDA):
+        # así usa el placeholder en vez de volver a descargarlas por su cuenta
+        propias = {u: imagenes[u] for u in urls_imagenes(prod)}
+        t0 = time.perf_counter()
+        async with self._get_cupo():
+            _cola.observar(time.perf_counter() - t0)
+            self.pendientes += 1
+            try:
+                codificadas, tiempos = await self._ejecutar(renderizar_producto_medido, dict(prod), clave, propias,
+                                                          perfiles)
+            finally:
+                self.pendientes -= 1
+        for nombre, dato in tiempos.items():
+            _etapas.observar(dato["wall"], etapa=nombre)
+            _etapas_cpu.inc(dato["cpu"], etapa=nombre)
+        picos = [d["mem_pico_mb"] for d in tiempos.values() if d.get("mem_pico_mb") is not None]
+        if picos:
+            _memoria.observar(max(picos))
+        await asyncio.to_thread(render_cache.put_perfiles, clave, codificadas)
+        return codificadas
+
+    async def ceder(self):
+        """Espera a que no haya renders interactivos pendientes (los de fondo
+        llaman a esto antes de pedir un lugar en el pool)."""
+        while self.interactivos > 0:
+            await asyncio.sleep(_ESPERA_CEDER)
+
+    async def prerender(self, prods):
+        """Deja en caché las tarjetas de prods (p. ej. la siguiente página)
+        como renders de fondo, cediendo el paso a los interactivos."""
+        imagenes = await self.precargar_imagenes(prods)
+        await asyncio.gather(*(self._prerender_uno(p, imagenes) for p in prods), return_exceptions=True)
+
+    async def _prerender_uno(self, prod, imagenes):
+        await self.ceder()
+        await self.obtener(prod, imagenes, fondo=True)
+
+    async def _ejecutar(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_pool(), fn, *args)
+        except BrokenProcessPool:
+            # Un worker murió (p. ej. OOM): descartar el pool para recrearlo
+            logger.warning("Pool de render roto, se recreará en el próximo render")
+            self._descartar_pool()
+            raise
+
+    def _descartar_pool(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def warm_up(self):
+        """Arranca los workers por adelantado para que el primer render no
+        pague el arranque del proceso. Devuelve futures (concurrent.futures)
+        que terminan cuando el calentamiento acaba."""
+        pool = self._get_pool()
+        if pool is None:
+            futuro = Future()
+
+            def calentar():
+                try:
+                    _init_worker()
+                    futuro.set_result(None)
+                except BaseException as e:
+                    futuro.set_exception(e)
+
+            threading.Thread(target=calentar, daemon=True).start()
+            return [futuro]
+        return [pool.submit(int) for _ in range(self.workers)]
+
+    def shutdown(self):
+        self._descartar_pool()
+
+
+render_executor = RenderExecutor()
+metrics.calibre("render_pendientes", "Renders ejecutándose en el pool", lambda: render_executor.pendientes)
+metrics.calibre("render_interactivos", "Renders pedidos por usuarios esperando o en curso",
+                lambda: render_executor.interactivos)
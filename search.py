@@ -0,0 +1,151 @@
+# search.py
+# Búsqueda de productos tolerante a errores e insensible a acentos.
+#
+# IndiceBusqueda se construye una vez por catálogo (ver catalog.Catalog) con:
+# - un índice invertido token -> {producto: peso}, con más peso para el nombre
+#   que para la categoría y la descripción;
+# - un índice de trigramas sobre el vocabulario, para encontrar tokens parecidos
+#   cuando la palabra buscada tiene errores ("bufnada" -> "bufanda");
+# - el vocabulario ordenado, para completar prefijos ("bufa" -> "bufanda").
+#
+# Cada consulta solo toca las listas de los tokens candidatos, no todo el
+# catálogo. Las palabras vacías ("de", "la", "para") no se indexan, y los
+# tokens que aparecen en más de FRECUENCIA_MAXIMA del catálogo ("lana" en una
+# tienda de lana) no aportan candidatos si la consulta tiene otras palabras:
+# solo suman puntos a los productos que esas otras palabras encontraron. Del
+# resultado se eligen los `limite` mejores con heapq, sin ordenar todo.
+
+import re
+import heapq
+import bisect
+import unicodedata
+
+# Peso de cada campo del producto en la puntuación
+PESOS_CAMPOS = (("nombre", 3.0), ("categoria", 2.0), ("descripcion", 1.0))
+
+# Similitud mínima (Jaccard de trigramas) para aceptar un token parecido
+SIMILITUD_MINIMA = 0.3
+# Máximo de tokens del vocabulario que se expanden por prefijo
+MAX_PREFIJOS = 20
+
+# Fracción del catálogo a partir de la cual un token se considera frecuente
+# (solo en catálogos de al menos MIN_PRODUCTOS_FRECUENTES productos)
+FRECUENCIA_MAXIMA = 0.5
+MIN_PRODUCTOS_FRECUENTES = 50
+
+PALABRAS_VACIAS = frozenset(
+    "al con de del el en es la las lo los para por que se su sus un una uno unos unas y".split()
+)
+
+_NO_ALFANUMERICO = re.compile(r"[^a-z0-9]+")
+
+
+def normalizar(texto):
+    """Minúsculas, sin acentos y solo letras/dígitos separados por espacios."""
+    texto = unicodedata.normalize("NFKD", str(texto or ""))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return _NO_ALFANUMERICO.sub(" ", texto.lower()).strip()
+
+
+def tokenizar(texto):
+    return [t for t in normalizar(texto).split() if len(t) > 1 and t not in PALABRAS_VACIAS]
+
+
+def trigramas(token):
+    t = f"  {token} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+
+class IndiceBusqueda:
+    def __init__(self, productos):
+        self.productos = tuple(productos)
+        self._invertido = {}
+        for i, prod in enumerate(self.productos):
+            for campo, peso in PESOS_CAMPOS:
+                for token in tokenizar(prod.get(campo, "")):
+                    postings = self._invertido.setdefault(token, {})
+                    postings[i] = postings.get(i, 0.0) + peso
+
+        self._vocabulario = sorted(self._invertido)
+        self._frecuentes = set()
+        if len(self.productos) >= MIN_PRODUCTOS_FRECUENTES:
+            limite = FRECUENCIA_MAXIMA * len(self.productos)
+            self._frecuentes = {t for t, postings in self._invertido.items() if len(postings) > limite}
+        self._trigramas = {}
+        self._num_trigramas = {}
+        for token in self._vocabulario:
+            tris = trigramas(token)
+            self._num_trigramas[token] = len(tris)
+            for tri in tris:
+                self._trigramas.setdefault(tri, []).append(token)
+
+    def _parecidos(self, token):
+        """[(token_vocabulario, factor)] para un token de la consulta."""
+        if token in self._invertido:
+            candidatos = {token: 1.0}
+        else:
+            candidatos = {}
+        # Prefijos: la consulta es el comienzo de una palabra del catálogo
+        i = bisect.bisect_left(self._vocabulario, token)
+        for v in self._vocabulario[i:i + MAX_PREFIJOS]:
+            if not v.startswith(token):
+                break
+            candidatos.setdefault(v, 0.8)
+        # Errores de tipeo: tokens con muchos trigramas en común
+        tris = trigramas(token)
+        comunes = {}
+        for tri in tris:
+            for v in self._trigramas.get(tri, ()):
+                comunes[v] = comunes.get(v, 0) + 1
+        for v, n in comunes.items():
+            similitud = n / (len(tris) + self._num_trigramas[v] - n)
+            if similitud >= SIMILITUD_MINIMA and similitud * 0.7 > candidatos.get(v, 0):
+                candidatos[v] = similitud * 0.7
+        return candidatos.items()
+
+    def buscar(self, consulta, limite=None):
+        """Productos que coinciden con la consulta, del más al menos relevante
+        (como mucho `limite`). Primero los que cubren más palabras de la
+        consulta; a igualdad, los de mayor puntuación."""
+        tokens = tokenizar(consulta)
+        if not tokens:
+            return []
+        # Las palabras que solo se expanden a tokens frecuentes no generan
+        # candidatos salvo que la consulta no tenga otras
+        generan, frecuentes = [], []
+        for token in dict.fromkeys(tokens):
+            expansion = list(self._parecidos(token))
+            if expansion:
+                es_frecuente = all(v in self._frecuentes for v, _ in expansion)
+                (frecuentes if es_frecuente else generan).append(expansion)
+        if not generan:
+            generan, frecuentes = frecuentes, []
+
+        puntuacion = {}
+        cubiertos = {}
+        for expansion in generan:
+            mejor = {}
+            for v, factor in expansion:
+                for i, peso in self._invertido[v].items():
+                    valor = peso * factor
+                    if valor > mejor.get(i, 0):
+                        mejor[i] = valor
+            for i, valor in mejor.items():
+                puntuacion[i] = puntuacion.get(i, 0.0) + valor
+                cubiertos[i] = cubiertos.get(i, 0) + 1
+        for expansion in frecuentes:
+            postings = [(self._invertido[v], factor) for v, factor in expansion]
+            for i in puntuacion:
+                valor = max(p.get(i, 0.0) * factor for p, factor in postings)
+                if valor:
+                    puntuacion[i] += valor
+                    cubiertos[i] += 1
+
+        def relevancia(i):
+            return cubiertos[i], puntuacion[i], -i
+
+        if limite is None:
+            orden = sorted(puntuacion, key=relevancia, reverse=True)
+        else:
+            orden = heapq.nlargest(limite, puntuacion, key=relevancia)
+        return [self.productos[i] for i in orden]
@@ -0,0 +1,55 @@
+# singleflight.py
+# Deduplicación de trabajo concurrente idéntico.
+#
+# Mientras una llamada con cierta clave está en curso, las demás llamadas con
+# la misma clave no repiten el trabajo: esperan a la que ya está corriendo y
+# reciben el mismo resultado (o la misma excepción). Al terminar, la clave se
+# libera y la siguiente llamada vuelve a ejecutar.
+#
+# Se usa para los renders (clave = hash de render) y para la descarga del
+# catálogo (clave = URL de productos.json).
+
+import asyncio
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_llamadas = metrics.contador("singleflight_llamadas_total",
+                             "Llamadas deduplicadas: lider ejecuta, compartida espera al lider",
+                             ("grupo", "rol"))
+
+
+class SingleFlight:
+    def __init__(self, grupo):
+        self.grupo = grupo
+        self._en_vuelo = {}  # clave -> asyncio.Task
+
+    def __contains__(self, clave):
+        return clave in self._en_vuelo
+
+    def __len__(self):
+        return len(self._en_vuelo)
+
+    async def hacer(self, clave, fn, *args, **kwargs):
+        """Ejecuta `await fn(*args, **kwargs)` salvo que ya haya una llamada
+        con `clave` en curso, en cuyo caso espera su resultado.
+        Si quien espera se cancela, el trabajo compartido sigue para los demás."""
+        tarea = self._en_vuelo.get(clave)
+        if tarea is None:
+            tarea = asyncio.ensure_future(fn(*args, **kwargs))
+            self._en_vuelo[clave] = tarea
+            tarea.add_done_callback(lambda t: self._terminar(clave, t))
+            _llamadas.inc(grupo=self.grupo, rol="lider")
+        else:
+            _llamadas.inc(grupo=self.grupo, rol="compartida")
+        return await asyncio.shield(tarea)
+
+    def _terminar(self, clave, tarea):
+        if self._en_vuelo.get(clave) is tarea:
+            del self._en_vuelo[clave]
+        # Recuperar la excepción aunque todos los que esperaban se hayan
+        # cancelado, para que asyncio no la reporte como no atendida
+        if not tarea.cancelled() and tarea.exception() is not None:
+            logger.debug("%s %s terminó con error: %s", self.grupo, clave, tarea.exception())
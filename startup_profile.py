@@ -0,0 +1,124 @@
+# startup_profile.py
+# Perfil de arranque: tiempo de import por módulo y de cada etapa de
+# inicialización. Se activa con STARTUP_PROFILE=1.
+#
+# activar() instala un finder en sys.meta_path que mide la ejecución de cada
+# módulo importado a partir de ese momento (tiempo propio, sin contar los
+# imports anidados, y tiempo total). etapa("nombre") mide bloques de la
+# inicialización del bot. reporte() arma el resumen con la memoria residente.
+#
+# Debe activarse antes de importar el resto de módulos del bot.
+
+import os
+import sys
+import time
+import threading
+import contextlib
+import importlib.abc
+
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "0") == "1"
+
+_inicio = time.perf_counter()
+_imports = {}   # módulo -> [tiempo propio, tiempo total]
+_etapas = []    # (nombre, segundos)
+_pila = threading.local()
+_activo = False
+
+
+class _LoaderMedido(importlib.abc.Loader):
+    def __init__(self, loader):
+        self._loader = loader
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        pila = getattr(_pila, "valor", None)
+        if pila is None:
+            pila = _pila.valor = []
+        pila.append(0.0)
+        t0 = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - t0
+            hijos = pila.pop()
+            if pila:
+                pila[-1] += total
+            _imports[module.__name__] = [total - hijos, total]
+
+    def __getattr__(self, nombre):
+        return getattr(self._loader, nombre)
+
+
+class _FinderMedido(importlib.abc.MetaPathFinder):
+    def find_spec(self, nombre, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(nombre, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _LoaderMedido(spec.loader)
+                return spec
+        return None
+
+
+def activar():
+    """Empieza a medir imports. No hace nada si ya está activo."""
+    global _activo
+    if not _activo:
+        sys.meta_path.insert(0, _FinderMedido())
+        _activo = True
+
+
+def activar_si_configurado():
+    if STARTUP_PROFILE:
+        activar()
+
+
+@contextlib.contextmanager
+def etapa(nombre):
+    """Mide un bloque de la inicialización (solo si el perfil está activo)."""
+    if not _activo:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _etapas.append((nombre, time.perf_counter() - t0))
+
+
+def _memoria_residente_mb():
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except Exception:
+        return None
+
+
+def reporte(max_modulos=25):
+    """Resumen de texto: etapas, módulos más lentos por tiempo propio y RSS."""
+    lineas = [f"Perfil de arranque ({time.perf_counter() - _inicio:.3f}s desde el inicio)"]
+    rss = _memoria_residente_mb()
+    if rss is not None:
+        lineas.append(f"Memoria residente: {rss:.1f} MB")
+    if _etapas:
+        lineas.append("Etapas:")
+        lineas += [f"  {nombre:<30} {seg * 1000:8.1f} ms" for nombre, seg in _etapas]
+    if _imports:
+        total = sum(propio for propio, _ in _imports.values())
+        lineas.append(f"Imports: {len(_imports)} módulos, {total * 1000:.1f} ms")
+        lineas.append(f"  {'módulo':<40} {'propio':>9} {'total':>9}")
+        orden = sorted(_imports.items(), key=lambda kv: kv[1][0], reverse=True)
+        for nombre, (propio, acumulado) in orden[:max_modulos]:
+            lineas.append(f"  {nombre:<40} {propio * 1000:7.1f}ms {acumulado * 1000:7.1f}ms")
+    return "\n".join(lineas)
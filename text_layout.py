@@ -0,0 +1,136 @@
+# text_layout.py
+# Fuentes cacheadas y maquetado de texto por ancho real en píxeles.
+#
+# - fuente(candidatas, tamaño): una sola FreeTypeFont por (familia, tamaño) y
+#   proceso; la familia es la tupla de rutas candidatas.
+# - envolver(): parte el texto en líneas midiendo cada una con la fuente, en
+#   lugar de contar caracteres.
+# - ajustar(): elige el mayor tamaño de fuente (entre un máximo y un mínimo)
+#   con el que el texto cabe en una caja y un número máximo de líneas; si no
+#   cabe ni con el mínimo, recorta la última línea con "…".
+#
+# Los maquetados se memorizan por (texto, fuente, caja): los mismos textos se
+# repiten entre renders de un producto y entre perfiles.
+
+import functools
+import threading
+from collections import namedtuple
+
+from PIL import ImageFont
+
+INTERLINEADO = 1.15
+ELIPSIS = "…"
+
+# Resultado de ajustar(): líneas, fuente elegida y alto de cada línea en px
+Maquetado = namedtuple("Maquetado", "lineas fuente tamaño alto_linea")
+
+_fuentes = {}
+_lock = threading.Lock()
+
+
+def fuente(candidatas, tamaño):
+    """FreeTypeFont de la primera ruta candidata que se pueda abrir (o la fuente
+    por defecto de PIL), cacheada por (familia, tamaño)."""
+    clave = (tuple(candidatas), tamaño)
+    font = _fuentes.get(clave)
+    if font is not None:
+        return font
+    for p in candidatas:
+        try:
+            font = ImageFont.truetype(p, tamaño)
+            break
+        except Exception:
+            continue
+    else:
+        font = ImageFont.load_default()
+    with _lock:
+        return _fuentes.setdefault(clave, font)
+
+
+def alto_linea(font):
+    try:
+        ascent, descent = font.getmetrics()
+    except AttributeError:
+        ascent, descent = font.getbbox("Ag")[3], 0
+    return int((ascent + descent) * INTERLINEADO)
+
+
+def _partir_palabra(palabra, font, ancho):
+    """Parte una palabra más ancha que la caja en trozos que quepan."""
+    trozos, actual = [], ""
+    for c in palabra:
+        if actual and font.getlength(actual + c) > ancho:
+            trozos.append(actual)
+            actual = c
+        else:
+            actual += c
+    if actual:
+        trozos.append(actual)
+    return trozos
+
+
+def _envolver(texto, font, ancho):
+    lineas = []
+    for parrafo in texto.splitlines() or [""]:
+        linea = ""
+        for palabra in parrafo.split():
+            candidata = f"{linea} {palabra}" if linea else palabra
+            if font.getlength(candidata) <= ancho:
+                linea = candidata
+                continue
+            if linea:
+                lineas.append(linea)
+            if font.getlength(palabra) <= ancho:
+                linea = palabra
+            else:
+                *completos, linea = _partir_palabra(palabra, font, ancho)
+                lineas.extend(completos)
+        if linea:
+            lineas.append(linea)
+    return tuple(lineas)
+
+
+@functools.lru_cache(maxsize=4096)
+def envolver(texto, candidatas, tamaño, ancho):
+    """Líneas de `texto` que no superan `ancho` px con la fuente dada."""
+    return _envolver(texto, fuente(candidatas, tamaño), ancho)
+
+
+def _recortar(linea, font, ancho):
+    while linea and font.getlength(linea + ELIPSIS) > ancho:
+        linea = linea[:-1]
+    return linea.rstrip() + ELIPSIS
+
+
+@functools.lru_cache(maxsize=4096)
+def ajustar(texto, candidatas, caja, max_lineas, tamaño_max, tamaño_min=None, paso=2):
+    """Maquetado de `texto` dentro de caja=(ancho, alto) en a lo sumo
+    max_lineas líneas, con el mayor tamaño posible entre tamaño_max y
+    tamaño_min (por defecto, tamaño fijo)."""
+    ancho, alto = caja
+    tamaño_min = tamaño_max if tamaño_min is None else tamaño_min
+    tamaño = tamaño_max
+    while True:
+        font = fuente(candidatas, tamaño)
+        lineas = envolver(texto, tuple(candidatas), tamaño, ancho)
+        h = alto_linea(font)
+        cabe = len(lineas) <= max_lineas and len(lineas) * h <= alto
+        if cabe or tamaño - paso < tamaño_min:
+            break
+        tamaño -= paso
+
+    if not cabe:
+        max_lineas = max(1, min(max_lineas, alto // h)) if h else max_lineas
+        if len(lineas) > max_lineas:
+            lineas = lineas[:max_lineas - 1] + (_recortar(lineas[max_lineas - 1], font, ancho),)
+    return Maquetado(lineas, font, tamaño, h)
+
+
+def dibujar(draw, xy, maquetado, fill):
+    """Dibuja las líneas desde la esquina superior izquierda xy. Devuelve la
+    coordenada y donde termina el bloque."""
+    x, y = xy
+    for linea in maquetado.lineas:
+        draw.text((x, y), linea, font=maquetado.fuente, fill=fill)
+        y += maquetado.alto_linea
+    return y
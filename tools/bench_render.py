@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# tools/bench_render.py
+# Benchmark por etapas de crear_imagen_producto.
+#
+# Genera imágenes de prueba, las sirve con un servidor HTTP local y renderiza
+# productos sintéticos midiendo cada etapa del pipeline (ver render_etapas):
+# tiempo de pared, tiempo de CPU, pico de memoria residente y pico de memoria
+# reservada (el de la etapa "total" es el pico por render). El resultado se
+# guarda como JSON y se puede comparar con una corrida anterior; si alguna
+# etapa empeora más que el umbral, el proceso termina con código 1.
+#
+# Cada producto se renderiza dos veces por repetición y se informa por
+# separado: "frio", con las cachés de imágenes y de recortes vaciadas antes
+# (descarga y rembg reales), y "caliente", justo después, servido por ellas.
+#
+# Uso:
+#   python tools/bench_render.py --salida base.json
+#   python tools/bench_render.py --comparar base.json --umbral 0.2
+#
+# Usa un CACHE_DIR temporal, así que no toca las cachés del bot.
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def generar_fixtures(n, rng):
+    """{nombre_archivo: bytes} con fotos de producto sintéticas (figura de
+    color sobre fondo claro) de tamaños y formatos variados."""
+    from PIL import Image, ImageDraw
+
+    tamaños = [(800, 800), (1600, 1200), (600, 900), (2400, 2400)]
+    fixtures = {}
+    for i in range(n):
+        w, h = tamaños[i % len(tamaños)]
+        img = Image.new("RGB", (w, h), (245, 245, 240))
+        d = ImageDraw.Draw(img)
+        color = tuple(rng.randint(30, 220) for _ in range(3))
+        caja = (int(w * 0.2), int(h * 0.15), int(w * 0.8), int(h * 0.85))
+        if i % 2:
+            d.ellipse(caja, fill=color)
+        else:
+            d.rounded_rectangle(caja, radius=int(w * 0.05), fill=color)
+        bio = io.BytesIO()
+        if i % 3 == 2:
+            img.save(bio, "PNG")
+            fixtures[f"img_{i}.png"] = bio.getvalue()
+        else:
+            img.save(bio, "JPEG", quality=90)
+            fixtures[f"img_{i}.jpg"] = bio.getvalue()
+    return fixtures
+
+
+def servir_fixtures(fixtures):
+    """Servidor HTTP local en un hilo. Devuelve (servidor, url_base)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            data = fixtures.get(self.path.lstrip("/"))
+            if data is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png" if self.path.endswith(".png") else "image/jpeg")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("ETag", f'"{hash(data) & 0xffffffff:x}"')
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+def productos_sinteticos(n, url_base, fixtures, rng):
+    nombres = ["Bufanda de lana", "Taza de cerámica artesanal", "Camión de juguete",
+               "Set de pinceles profesionales para acuarela", "Lámpara", "Mochila escolar reforzada"]
+    archivos = sorted(fixtures)
+    productos = []
+    for i in range(n):
+        prod = {
+            "id": i,
+            "nombre": f"{nombres[i % len(nombres)]} {i}",
+            "precio": rng.randint(1, 400) * 500,
+            "imagen_url": f"{url_base}/{archivos[i % len(archivos)]}",
+            "categoria": ["ropa", "hogar", "juguetes"][i % 3],
+            "descripcion": "Descripción de prueba " * (1 + i % 4),
+        }
+        if i % 4 == 3:
+            prod["packaging_url"] = f"{url_base}/{archivos[(i + 1) % len(archivos)]}"
+        productos.append(prod)
+    return productos
+
+
+def _percentil(valores, p):
+    orden = sorted(valores)
+    return orden[min(len(orden) - 1, int(round(p * (len(orden) - 1))))]
+
+
+def resumir(muestras):
+    """muestras: lista de dicts etapa -> dato (uno por render)."""
+    etapas = {}
+    for muestra in muestras:
+        for nombre, dato in muestra.items():
+            etapas.setdefault(nombre, []).append(dato)
+    resumen = {}
+    for nombre, datos in etapas.items():
+        wall = [d["wall"] * 1000 for d in datos]
+        cpu = [d["cpu"] * 1000 for d in datos]
+        rss = [d["rss_pico_mb"] for d in datos if d.get("rss_pico_mb") is not None]
+        mem = [d["mem_pico_mb"] for d in datos if d.get("mem_pico_mb") is not None]
+        resumen[nombre] = {
+            "n": len(datos),
+            "wall_ms": round(statistics.mean(wall), 3),
+            "wall_p50_ms": round(_percentil(wall, 0.5), 3),
+            "wall_p95_ms": round(_percentil(wall, 0.95), 3),
+            "wall_max_ms": round(max(wall), 3),
+            "cpu_ms": round(statistics.mean(cpu), 3),
+            "rss_pico_mb": round(max(rss), 1) if rss else None,
+            "mem_pico_mb": round(max(mem), 1) if mem else None,
+        }
+    return resumen
+
+
+MODOS = ("frio", "caliente")
+
+
+def vaciar_caches(image_utils):
+    """Borra las imágenes descargadas y los recortes para que el siguiente
+    render los vuelva a descargar y recortar."""
+    for directorio in (image_utils.image_cache.disco.directorio, image_utils._cutout_cache.directorio):
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def comparar(actual, base, umbral, minimo_ms):
+    """Lista de (modo, etapa, base_ms, actual_ms) que empeoraron más que
+    `umbral` (fracción) y más que `minimo_ms` en términos absolutos."""
+    regresiones = []
+    for modo in MODOS:
+        for nombre, dato in actual[modo].items():
+            anterior = base.get(modo, {}).get(nombre)
+            if not anterior:
+                continue
+            antes, ahora = anterior["wall_ms"], dato["wall_ms"]
+            if ahora > antes * (1 + umbral) and ahora - antes > minimo_ms:
+                regresiones.append((modo, nombre, antes, ahora))
+    return regresiones
+
+
+def imprimir(resultado, base=None):
+    print(f"Backend: {resultado['backend']}  renders: {resultado['renders']}  "
+          f"pico RSS: {resultado['rss_pico_mb']} MB  "
+          f"pico por render: {resultado['frio'].get('total', {}).get('mem_pico_mb')} MB")
+    for modo in MODOS:
+        print(f"\n{modo:<22} {'wall':>9} {'p95':>9} {'cpu':>9} {'mem':>9} {'base':>9}")
+        for nombre, dato in sorted(resultado[modo].items(), key=lambda kv: -kv[1]["wall_ms"]):
+            antes = (base or {}).get(modo, {}).get(nombre, {}).get("wall_ms")
+            antes = f"{antes:8.1f}ms" if antes is not None else f"{'-':>9}"
+            mem = f"{dato['mem_pico_mb']:7.1f}MB" if dato.get("mem_pico_mb") is not None else f"{'-':>9}"
+            print(f"{nombre:<22} {dato['wall_ms']:7.1f}ms {dato['wall_p95_ms']:7.1f}ms "
+                  f"{dato['cpu_ms']:7.1f}ms {mem} {antes}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark por etapas del render de tarjetas")
+    parser.add_argument("--productos", type=int, default=8, help="productos sintéticos (default 8)")
+    parser.add_argument("--repeticiones", type=int, default=3, help="pasadas sobre los productos (default 3)")
+    parser.add_argument("--calentamiento", type=int, default=1,
+                        help="renders iniciales no medidos: atlas, fuentes, rembg (default 1)")
+    parser.add_argument("--backend", choices=("pil", "numpy"), default=None,
+                        help="backend de render (default RENDER_BACKEND)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="guardar el resultado en este JSON")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--umbral", type=float, default=0.25,
+                        help="empeoramiento relativo tolerado por etapa (default 0.25)")
+    parser.add_argument("--minimo-ms", type=float, default=2.0,
+                        help="ignorar diferencias absolutas menores (default 2 ms)")
+    args = parser.parse_args(argv)
+
+    # CACHE_DIR se lee al importar los módulos del bot
+    directorio = tempfile.mkdtemp(prefix="bench_render_")
+    os.environ["CACHE_DIR"] = directorio
+    sys.path.insert(0, RAIZ)
+    import image_utils
+    from render_etapas import etapa, medir, rss_pico_mb
+
+    rng = random.Random(args.semilla)
+    fixtures = generar_fixtures(max(4, args.productos), rng)
+    servidor, url_base = servir_fixtures(fixtures)
+    productos = productos_sinteticos(args.productos, url_base, fixtures, rng)
+    backend = args.backend or image_utils.RENDER_BACKEND
+
+    try:
+        if args.calentamiento:
+            image_utils._get_atlas(backend).preparar()
+        for i in range(args.calentamiento):
+            image_utils.crear_imagen_producto(productos[i % len(productos)], seed=i, backend=backend)
+        muestras = {modo: [] for modo in MODOS}
+        for _ in range(args.repeticiones):
+            for i, prod in enumerate(productos):
+                vaciar_caches(image_utils)
+                for modo in MODOS:
+                    with medir(memoria=True) as tiempos:
+                        with etapa("total"):
+                            image_utils.crear_imagen_producto(prod, seed=i, backend=backend)
+                    muestras[modo].append(tiempos)
+    finally:
+        servidor.shutdown()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    resultado = {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "backend": backend,
+        "rembg": image_utils._HAS_REMBG,
+        "productos": args.productos,
+        "repeticiones": args.repeticiones,
+        "renders": sum(len(m) for m in muestras.values()),
+        "rss_pico_mb": round(rss_pico_mb() or 0, 1),
+    }
+    for modo in MODOS:
+        resultado[modo] = resumir(muestras[modo])
+
+    base = None
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as f:
+            base = json.load(f)
+    imprimir(resultado, base)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+    if base is not None:
+        regresiones = comparar(resultado, base, args.umbral, args.minimo_ms)
+        for modo, nombre, antes, ahora in regresiones:
+            print(f"REGRESION {nombre} ({modo}): {antes:.1f}ms -> {ahora:.1f}ms (+{(ahora / antes - 1) * 100:.0f}%)")
+        if regresiones:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
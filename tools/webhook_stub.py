@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# tools/webhook_stub.py
+# Prueba de punta a punta del modo webhook sin Telegram.
+#
+# Levanta una Bot API falsa (responde getMe, setWebhook, sendMessage,
+# sendPhoto, ... y registra cada llamada) y envía actualizaciones falsas al
+# webhook del bot, en paralelo desde chats distintos. Para cada una mide el
+# tiempo hasta la primera respuesta del bot a ese chat.
+#
+# Uso, en dos terminales:
+#   TELEGRAM_TOKEN=123:stub TELEGRAM_API_URL=http://127.0.0.1:8081 \
+#   WEBHOOK_URL=http://127.0.0.1:8080/telegram WEBHOOK_SECRET=s3cret PORT=8080 python bot.py
+#
+#   python tools/webhook_stub.py --webhook http://127.0.0.1:8080/telegram --secreto s3cret \
+#       --puerto 8081 --actualizaciones 200 --concurrencia 20 --comando /start
+#
+# Con --solo-api solo sirve la Bot API falsa, p. ej. para ver las llamadas a
+# getUpdates que hace el bot en modo polling aunque no reciba mensajes.
+
+import sys
+import json
+import time
+import argparse
+import threading
+import statistics
+import urllib.request
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class BotApiFalsa:
+    """Bot API mínima: guarda (método, chat_id, instante) de cada llamada."""
+
+    def __init__(self):
+        self.llamadas = []
+        self.lock = threading.Lock()
+        self.respuestas = {}   # chat_id -> instante de la primera respuesta
+        self.webhook = None
+        self._message_id = 0
+
+    def _mensaje(self, chat_id):
+        with self.lock:
+            self._message_id += 1
+            message_id = self._message_id
+        return {"message_id": message_id, "date": int(time.time()),
+                "chat": {"id": int(chat_id or 0), "type": "private"}}
+
+    def resultado(self, metodo, params):
+        chat_id = params.get("chat_id")
+        ahora = time.perf_counter()
+        with self.lock:
+            self.llamadas.append((metodo, chat_id, ahora))
+            if chat_id is not None:
+                self.respuestas.setdefault(str(chat_id), ahora)
+        if metodo == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if metodo == "setWebhook":
+            self.webhook = params.get("url")
+            return True
+        if metodo == "getUpdates":
+            time.sleep(float(params.get("timeout") or 0))
+            return []
+        if metodo == "sendMediaGroup":
+            return [self._mensaje(chat_id) for _ in json.loads(params.get("media") or "[]")]
+        if metodo.startswith("send") or metodo.startswith("edit"):
+            return self._mensaje(chat_id)
+        return True
+
+
+def _params(handler, cuerpo):
+    tipo = handler.headers.get("Content-Type", "")
+    if tipo.startswith("application/json"):
+        return json.loads(cuerpo or b"{}")
+    if tipo.startswith("multipart/form-data"):
+        # Solo hacen falta los campos de texto (chat_id, media)
+        frontera = tipo.split("boundary=", 1)[1].strip('"').encode()
+        params = {}
+        for parte in cuerpo.split(b"--" + frontera):
+            cabecera, _, valor = parte.partition(b"\r\n\r\n")
+            if b"filename=" in cabecera or b'name="' not in cabecera:
+                continue
+            nombre = cabecera.split(b'name="', 1)[1].split(b'"', 1)[0].decode()
+            params[nombre] = valor.rstrip(b"\r\n").decode("utf-8", "replace")
+        return params
+    return {k: v[0] for k, v in parse_qs(cuerpo.decode("utf-8")).items()}
+
+
+def servir_api(api, puerto):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            cuerpo = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            metodo = self.path.rsplit("/", 1)[-1]
+            data = json.dumps({"ok": True, "result": api.resultado(metodo, _params(self, cuerpo))}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), Handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def actualizacion(update_id, chat_id, texto):
+    comando = texto.split()[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Prueba"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Prueba"},
+            "text": texto,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(comando)}],
+        },
+    }
+
+
+def enviar(url, secreto, update):
+    req = urllib.request.Request(url, data=json.dumps(update).encode(), method="POST",
+                                 headers={"Content-Type": "application/json"})
+    if secreto:
+        req.add_header("X-Telegram-Bot-Api-Secret-Token", secreto)
+    with urllib.request.urlopen(req, timeout=10) as r:
+        return r.status
+
+
+def _percentil(valores, p):
+    orden = sorted(valores)
+    return orden[min(len(orden) - 1, int(round(p * (len(orden) - 1))))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bot API falsa y generador de actualizaciones para el webhook")
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/telegram", help="URL del webhook del bot")
+    parser.add_argument("--secreto", default="", help="WEBHOOK_SECRET del bot")
+    parser.add_argument("--puerto", type=int, default=8081, help="puerto de la Bot API falsa (default 8081)")
+    parser.add_argument("--actualizaciones", type=int, default=100)
+    parser.add_argument("--concurrencia", type=int, default=10)
+    parser.add_argument("--comando", default="/start", help="texto de cada mensaje (default /start)")
+    parser.add_argument("--espera", type=float, default=30, help="segundos máximos esperando el registro del webhook")
+    parser.add_argument("--retraso", type=float, default=0,
+                        help="segundos a esperar tras el registro antes de enviar (p. ej. al calentamiento)")
+    parser.add_argument("--solo-api", action="store_true", help="solo servir la Bot API falsa")
+    args = parser.parse_args(argv)
+
+    api = BotApiFalsa()
+    servidor = servir_api(api, args.puerto)
+    print(f"Bot API falsa en http://127.0.0.1:{args.puerto}")
+    if args.solo_api:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return 0
+
+    limite = time.monotonic() + args.espera
+    while api.webhook is None and time.monotonic() < limite:
+        time.sleep(0.1)
+    if api.webhook is None:
+        print("El bot no llamó a setWebhook: ¿TELEGRAM_API_URL apunta a este puerto?")
+        return 1
+    print(f"Webhook registrado: {api.webhook}")
+    time.sleep(args.retraso)
+
+    base_chat = 100000
+    enviados = {}
+
+    def uno(i):
+        chat_id = base_chat + i
+        t0 = time.perf_counter()
+        status = enviar(args.webhook, args.secreto, actualizacion(i + 1, chat_id, args.comando))
+        enviados[str(chat_id)] = t0
+        return status
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as pool:
+        estados = list(pool.map(uno, range(args.actualizaciones)))
+    limite = time.monotonic() + args.espera
+    while len(api.respuestas) < args.actualizaciones and time.monotonic() < limite:
+        time.sleep(0.05)
+    total = time.perf_counter() - t0
+    servidor.shutdown()
+
+    latencias = [(api.respuestas[c] - t) * 1000 for c, t in enviados.items() if c in api.respuestas]
+    rechazadas = sum(1 for s in estados if s != 200)
+    print(f"{args.actualizaciones} actualizaciones, {rechazadas} rechazadas, "
+          f"{len(latencias)} respondidas en {total:.2f}s")
+    if latencias:
+        print(f"latencia hasta la respuesta: p50 {_percentil(latencias, 0.5):.1f}ms  "
+              f"p95 {_percentil(latencias, 0.95):.1f}ms  max {max(latencias):.1f}ms  "
+              f"media {statistics.mean(latencias):.1f}ms")
+    return 0 if len(latencias) == args.actualizaciones and not rechazadas else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
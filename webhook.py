@@ -0,0 +1,114 @@
+# webhook.py
+# Modo webhook: Telegram envía cada actualización por HTTP al servidor de
+# http_server.py en lugar de que el bot las pida con long polling.
+#
+# Se activa definiendo WEBHOOK_URL, la URL pública (https) que Telegram va a
+# llamar, p. ej. https://bot.ejemplo.com/telegram. Configuración:
+# - WEBHOOK_PATH: ruta local que recibe las actualizaciones (por defecto la
+#   ruta de WEBHOOK_URL, o /telegram)
+# - WEBHOOK_SECRET: se registra en setWebhook y se exige en el header
+#   X-Telegram-Bot-Api-Secret-Token de cada petición
+# - WEBHOOK_HOST / PORT: dónde escucha el servidor (0.0.0.0 y $PORT, como
+#   lo asignan Railway y Heroku; si no hay PORT, WEBHOOK_PORT o 8080)
+# - BOT_CONCURRENCIA: actualizaciones que se procesan en paralelo
+#
+# El servidor público sirve también /health, pero no /metrics: las métricas
+# siguen solo en METRICS_HOST:METRICS_PORT (ver http_server.py). Las
+# actualizaciones pendientes se conservan entre reinicios. Para probarlo en
+# local sin Telegram ver tools/webhook_stub.py.
+
+import os
+import hmac
+import json
+import signal
+import asyncio
+from urllib.parse import urlsplit
+import logging
+
+from telegram import Update
+
+import http_server
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or urlsplit(WEBHOOK_URL).path or "/telegram"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT") or os.getenv("WEBHOOK_PORT") or 8080)
+BOT_CONCURRENCIA = int(os.getenv("BOT_CONCURRENCIA", "16"))
+
+_recibidas = metrics.contador("webhook_actualizaciones_total", "Actualizaciones recibidas por webhook",
+                              ("resultado",))
+
+
+def activo():
+    return bool(WEBHOOK_URL)
+
+
+def configurar(application):
+    """Registra la ruta que recibe las actualizaciones y las encola en la
+    Application; se responde a Telegram sin esperar a que se procesen."""
+
+    async def recibir(peticion):
+        if WEBHOOK_SECRET:
+            recibido = peticion.headers.get("x-telegram-bot-api-secret-token", "")
+            if not hmac.compare_digest(recibido.encode(), WEBHOOK_SECRET.encode()):
+                _recibidas.inc(resultado="no_autorizada")
+                return 403, "text/plain", b""
+        try:
+            update = Update.de_json(json.loads(peticion.cuerpo), application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning("Actualización inválida en el webhook: %s", e)
+            _recibidas.inc(resultado="invalida")
+            return 400, "text/plain", b""
+        await application.update_queue.put(update)
+        _recibidas.inc(resultado="ok")
+        return 200, "text/plain", b""
+
+    http_server.agregar_ruta("POST", WEBHOOK_PATH, recibir)
+
+
+async def _ejecutar(application):
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, parar.set)
+        except NotImplementedError:
+            pass
+
+    await application.initialize()
+    try:
+        configurar(application)
+        # Servidor público, sin las rutas internas (/metrics); post_init
+        # arranca aparte el de métricas
+        if await http_server.iniciar(WEBHOOK_HOST, WEBHOOK_PORT, internas=False) is None:
+            raise RuntimeError(f"No se pudo escuchar en {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await application.bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=False,
+            max_connections=max(1, min(100, BOT_CONCURRENCIA)),
+        )
+        logger.info("Webhook registrado en %s (escuchando en %s:%s%s)",
+                    WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        await parar.wait()
+    finally:
+        # El webhook queda registrado: Telegram guarda las actualizaciones que
+        # lleguen durante un reinicio. run_polling lo borra si se vuelve a polling.
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def ejecutar(application):
+    """Equivalente a application.run_polling() para el modo webhook."""
+    asyncio.run(_ejecutar(application))